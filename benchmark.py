@@ -0,0 +1,71 @@
+# benchmark.py
+
+import os
+import json
+import time
+
+from main import build_arg_parser, load_config, start_monitoring, create_controllers, create_throttle, aquire_images
+from utils_acquisition.profiler import StageProfiler, print_summary
+
+
+def benchmark_take_image(config, camera_controller, profiler):
+    """
+    Capture and save n_images without moving the stage, to time the camera and storage path alone.
+    """
+    os.makedirs(config['images_path'], exist_ok=True)
+    for i in range(config["n_images"]):
+        with profiler.frame(i):
+            camera_controller.take_image(f"{config['images_path']}/{i}")
+    with profiler.stage("flush"):
+        camera_controller.flush()
+
+
+def main():
+    parser = build_arg_parser()
+    parser.description = 'Acquisition benchmark with per-stage timings'
+    parser.add_argument('--benchmark', type=str, default='scan', choices=['scan', 'take_image'],
+                        help="'scan' times a whole aquire_images run, 'take_image' only captures and saves images.")
+    parser.add_argument('--benchmark_output', type=str, default='',
+                        help='JSON file for the results (default: benchmarks/<benchmark>_<time>.json).')
+    parser.add_argument('--baseline', type=str, default='',
+                        help='Results of an earlier run to compare the median stage timings against.')
+    config = load_config(parser.parse_args())
+
+    metrics_server = start_monitoring(config)
+    profiler = StageProfiler()
+    camera_controller, motor_controller, writer, simulated_arduino = create_controllers(
+        config, profiler, create_throttle(config)
+    )
+    profiler.start()
+    try:
+        if config["benchmark"] == "take_image":
+            benchmark_take_image(config, camera_controller, profiler)
+        else:
+            aquire_images(config, camera_controller, motor_controller, profiler)
+        if writer is not None:
+            writer.close()
+        profiler.stop()
+    finally:
+        motor_controller.close()
+        camera_controller.close()
+        if simulated_arduino is not None:
+            simulated_arduino.close()
+        if metrics_server is not None:
+            metrics_server.close()
+
+    output = config["benchmark_output"]
+    if not output:
+        os.makedirs("benchmarks", exist_ok=True)
+        output = f"benchmarks/{config['benchmark']}_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    report = profiler.save_json(output, benchmark=config["benchmark"], config=config)
+
+    baseline = None
+    if config["baseline"]:
+        with open(config["baseline"]) as f:
+            baseline = json.load(f)["summary"]
+    print_summary(report["summary"], baseline)
+    print(f"Benchmark results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,88 @@
 # light_tester.py
 
+import asyncio
+import functools
+
 from utils_arduino.arduino_controller import ArduinoController
-import time
-import serial
+from utils_acquisition.session import AcquisitionSession
+
+
+def open_arduino(config):
+    # Connect to the Arduino
+    arduino = ArduinoController(config)
+    arduino.connect()
+    return arduino
+
+
+async def run_rainbow(session, seconds):
+    await session.rainbow(seconds)
+    print("Rainbow mode ended.")
+
+
+async def handle_led_command(session, user_input, background_tasks):
+    """
+    Handle an LED strip command; returns False if user_input is not one.
+    The rainbow runs in the background, so further commands can be entered meanwhile.
+    """
+    if user_input.lower() == 'on':
+        print("Turning on the LED strip with full brightness...")
+        await session.set_led_brightness(255)  # Turn on with full brightness
+    elif user_input.lower() == 'off':
+        print("Turning off the LED strip...")
+        await session.led_off()
+    elif user_input.lower().startswith('set_color '):
+        color_hex = user_input.split()[1]
+        if len(color_hex) == 6:
+            print(f"Setting LED strip color to #{color_hex}...")
+            await session.set_led_color(color_hex)
+        else:
+            print("Invalid color format. Please use RRGGBB format.")
+    elif user_input.lower().startswith('brightness '):
+        try:
+            brightness = int(user_input.split()[1])
+            if 0 <= brightness <= 255:
+                print(f"Setting LED strip brightness to {brightness}...")
+                await session.set_led_brightness(brightness)
+            else:
+                print("Brightness must be between 0 and 255.")
+        except ValueError:
+            print("Invalid brightness value. Please enter a number between 0 and 255.")
+    elif user_input.lower().startswith('fun '):
+        try:
+            ts = int(user_input.split()[1])
+            print(f"Activating rainbow mode for {ts} seconds...")
+            task = asyncio.create_task(run_rainbow(session, ts))
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+        except ValueError:
+            print("Invalid time value. Please enter a number.")
+    else:
+        return False
+    return True
+
+
+async def run(config):
+    background_tasks = set()
+    async with AcquisitionSession(open_arduino=functools.partial(open_arduino, config)) as session:
+        try:
+            while True:
+                # Get user input from the console
+                user_input = await session.prompt(
+                    "Enter command for LED strip ('on'/'off'/'set_color RRGGBB'/'brightness 0-255'/'fun seconds'/'quit'): "
+                )
+
+                # Check if the user wants to quit
+                if user_input.lower() == 'quit':
+                    print("Exiting...")
+                    break
+
+                # Handle LED strip commands
+                if not await handle_led_command(session, user_input, background_tasks):
+                    print("Invalid command. Please try again.")
+        finally:
+            for task in background_tasks:
+                task.cancel()
+
 
 def main():
     # Configuration for the motor
@@ -15,74 +95,11 @@ def main():
         "revolutions": 1
     }
 
-    # Initialize the arduino controller
-    arduino = ArduinoController(config)
-
     try:
-        # Connect to the Arduino
-        arduino.connect()
-
-        # Initialize LED tester
-        ser = serial.Serial(arduino.port, 9600, timeout=1)
-        time.sleep(2)  # Allow some time for the Arduino to reset
-
-        while True:
-            # Get user input from the console
-            user_input = input("Enter command for LED strip ('steps num_of_steps''on'/'off'/'set_color RRGGBB'/'brightness 0-255'/'quit'): ")
-
-            # Check if the user wants to quit
-            if user_input.lower() == 'quit':
-                print("Exiting...")
-                break
-
-            # Handle LED strip commands
-            if user_input.lower() == 'on':
-                print("Turning on the LED strip with full brightness...")
-                ser.write(b'L255\n')  # Turn on with full brightness
-            elif user_input.lower() == 'off':
-                print("Turning off the LED strip...")
-                ser.write(b'O\n')  # Turn off
-            elif user_input.lower().startswith('set_color '):
-                color_hex = user_input.split()[1]
-                if len(color_hex) == 6:
-                    print(f"Setting LED strip color to #{color_hex}...")
-                    ser.write(f'C{color_hex}\n'.encode())
-                else:
-                    print("Invalid color format. Please use RRGGBB format.")
-            elif user_input.lower().startswith('brightness '):
-                try:
-                    brightness = int(user_input.split()[1])
-                    if 0 <= brightness <= 255:
-                        print(f"Setting LED strip brightness to {brightness}...")
-                        ser.write(f'L{brightness}\n'.encode())
-                    else:
-                        print("Brightness must be between 0 and 255.")
-                except ValueError:
-                    print("Invalid brightness value. Please enter a number between 0 and 255.")
-            elif user_input.lower().startswith('fun '):
-                try :
-                    ts = int(user_input.split()[1])
-                    print("Activating rainbow mode for 10 seconds...")
-                    ser.write(b'R\n')  # Send rainbow mode command
-                    time.sleep(ts)  # Keep the rainbow mode active for 10 seconds
-                    ser.write(b'O\n')  # Turn off after 10 seconds
-                    print("Rainbow mode ended.")
-                except ValueError:
-                    print("Invalid time value. Please enter a number.")
-
-            else:
-                print("Invalid command. Please try again.")
-
-            # Small delay to allow serial communication to complete
-            time.sleep(0.5)
-
+        asyncio.run(run(config))
     except Exception as e:
         print(f"Error: {e}")
 
-    finally:
-        # Ensure the serial connection is closed properly
-        arduino.close()
-
 
 if __name__ == "__main__":
     main()
@@ -1,49 +1,454 @@
 import os
+import math
 import argparse
 import configparser
 import time
-import threading
+import asyncio
+import functools
+import logging
+import tifffile
 
 from utils_camera.camera_controller import CameraController,CameraControllerSimple
+from utils_camera.image_writer import ImageWriter
+from utils_camera.scan_container import ScanContainer
+from utils_camera.segmentation import Segmenter, capture_average, read_reference
+from utils_camera.hdr import parse_exposures
+from utils_camera.calibration import CalibrationCache, build_master
+from utils_camera.color import parse_gains
 from utils_arduino.arduino_controller import ArduinoController
+from utils_arduino.simulated_arduino import SimulatedArduino
+from utils_camera.simulated_camera import SimulatedTLCameraSDK
+from utils_acquisition.profiler import NULL_PROFILER
+from utils_acquisition.metrics import REGISTRY, MetricsServer, configure_logging, log_event
+from utils_acquisition.session import AcquisitionSession
+from utils_acquisition.stop import ScanStopped, check_stop
+from utils_acquisition.throttle import DiskThrottle
+from utils_acquisition.nerf_transforms import DATASET_FILES, TransformsWriter
+from utils_acquisition.journal import ScanJournal, resume_state
 
 from tqdm import tqdm
 
-def aquire_images(config, camera_controller, motor_controller):
+def steps_per_turn(config):
     """
-    Function to handle motor control and image acquisition.
-    Mainly used for threading purposes...
+    Number of microsteps for one full turn of the stage.
     """
-    input("Press Enter to start image acquisition and motor rotation ...")
-    os.makedirs(config['images_path'], exist_ok=True)
-    for i in tqdm(range(config["n_images"])):
-        # Capture an image and save it
-        image_path = f"{config['images_path']}/{i}"
-        camera_controller.take_picture(image_path)
-
-        # Rotate the motor
-        steps = (
-            config["micro_stepping"]
-            * config["steps_per_revolution_base"]
-            * 40
-            / config["n_images"]
+    return config["micro_stepping"] * config["steps_per_revolution_base"] * config["gear_ratio"]
+
+
+def dataset_directory(config):
+    """
+    Directory holding the image directory, the NeRF transforms files and the scan journal.
+    """
+    return os.path.dirname(os.path.abspath(config["images_path"]))
+
+
+class ScanOutputs:
+    """
+    Destinations of the views of a scan: the optional scan container, NeRF transforms, segmentation and journal.
+    """
+
+    def __init__(self, container=None, transforms=None, journal=None, segmenter=None):
+        self.container = container
+        self.transforms = transforms
+        self.journal = journal
+        self.segmenter = segmenter
+
+    def record(self, event, **fields):
+        if self.journal is not None:
+            self.journal.record(event, **fields)
+
+    def frame_written(self, view, steps, path=None, image=None):
+        """
+        Segment a view once its image is complete, journal it and add TIFF views to the NeRF transforms.
+        image is the raw frame, still valid while the writer holds its slot.
+        """
+        if self.segmenter is not None and image is not None:
+            self.segmenter.process(view, image)
+        self.record("frame_written", view=view, steps=steps, path=path)
+        if self.transforms is not None and path is not None:
+            self.transforms.add_frame(view, path, steps)
+
+    def close(self):
+        for output in (self.container, self.segmenter, self.transforms, self.journal):
+            if output is not None:
+                output.close()
+
+
+def save_view(config, camera_controller, outputs, slot, i, steps, **metadata):
+    """
+    Save one captured view either into the scan container or as a separate TIFF file.
+    """
+    if outputs.container is not None:
+        camera_controller.save_frame_to_container(
+            slot,
+            outputs.container,
+            on_written=functools.partial(outputs.frame_written, i, steps),
+            view=i,
+            angle_deg=360.0 * steps / steps_per_turn(config),
+            steps=steps,
+            **metadata
         )
-        motor_controller.rotate_forwards(steps)
+    else:
+        image_path = f"{config['images_path']}/{i}"
+        on_written = functools.partial(outputs.frame_written, i, steps, image_path + ".tiff", slot.array)
+        camera_controller.save_frame(slot, image_path, on_written=on_written)
+
+
+def capture_view(config, camera_controller, outputs, i, steps):
+    """
+    Capture a view with a software trigger, as a single frame or as an HDR exposure bracket, and save it.
+    The bracket is merged by the writer, so only the exposures themselves hold up the next move.
+    """
+    exposures = parse_exposures(config["hdr_exposures_us"])
+    if not exposures:
+        save_view(config, camera_controller, outputs, camera_controller.capture_frame(), i, steps)
+        return
 
-        # Wait for 3 seconds before taking the next picture
-        time.sleep(3)
+    slots = camera_controller.capture_bracket(exposures)
+    image_path = f"{config['images_path']}/{i}"
+    # Segmentation uses the raw frame closest to the configured exposure
+    reference = min(range(len(exposures)), key=lambda k: abs(exposures[k] - config["exposure_time_us"]))
+    on_written = functools.partial(outputs.frame_written, i, steps, image_path + ".tiff", slots[reference].array)
+    camera_controller.save_bracket(slots, exposures, image_path, on_written=on_written)
 
-    # Rotate the motor back to the original position
-    motor_controller.rotate_backwards(
-        config["micro_stepping"] * config["steps_per_revolution_base"] * 40
+
+def create_transforms(config):
+    """
+    Create the writer of the NeRF transforms files next to the image directory, or None if disabled.
+    """
+    if config["nerf_convention"] == "none":
+        return None
+    if config["scan_container"]:
+        log_event("transforms_skipped", "No transforms.json is written for scans into a container",
+                  level=logging.WARNING, scan_container=config["scan_container"])
+        return None
+    files = None  # All conventions, like the datasets under data/
+    if config["nerf_convention"] != "all":
+        radius = config["nerf_radius"] or next(radius for convention, radius in DATASET_FILES.values()
+                                                if convention == config["nerf_convention"])
+        files = {"transforms.json": (config["nerf_convention"], radius)}
+    return TransformsWriter(
+        dataset_directory(config),
+        steps_per_turn(config),
+        camera_angle_x=config["camera_angle_x"],
+        camera_angle_y=config["camera_angle_y"],
+        files=files,
+        test_every=config["nerf_test_every"],
     )
 
-    # Stop the motor_controller after loop is done
-    motor_controller.close()
 
+def background_frame_path(config):
+    return config["background_frame"] or os.path.join(dataset_directory(config), "background.tiff")
 
-def main():
-    ######## Load Configuration ########
+
+def create_segmenter(config, color=None):
+    """
+    Create the segmentation stage writing RGBA views next to the image directory, or None if disabled.
+    color is the ColorProcessor of a colour camera, whose views are segmented and written in RGB.
+    """
+    if not config["segment"]:
+        return None
+    if config["scan_container"]:
+        log_event("segmentation_skipped", "Views of scans into a container are not segmented",
+                  level=logging.WARNING, scan_container=config["scan_container"])
+        return None
+    return Segmenter(
+        config["segmentation_path"] or config["images_path"].rstrip("/\\") + "_rgba",
+        read_reference(background_frame_path(config)),
+        config["bit_depth"],
+        dark=read_reference(config["dark_frame"]) if config["dark_frame"] else None,
+        threshold=config["segmentation_threshold"],
+        color=color,
+    )
+
+
+def save_reference_frame(config, path, camera_controller, motor_controller, stop_event=None):
+    """
+    Average config["reference_frames"] captures and save them as a float32 TIFF.
+    """
+    check_stop(stop_event)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tifffile.imwrite(path, capture_average(camera_controller, config["reference_frames"]))
+    log_event("reference_captured", f"Saved reference frame {path}", path=path, frames=config["reference_frames"])
+
+
+async def capture_references(session, config, confirm=True):
+    """
+    Capture the empty-stage reference and the dark frame needed for segmentation, unless they exist already.
+    """
+    references = (
+        (background_frame_path(config), "Remove the object from the stage"),
+        (config["dark_frame"], "Cover the lens"),
+    )
+    for path, instruction in references:
+        if not path or os.path.exists(path):
+            continue
+        if not confirm:
+            raise FileNotFoundError(f"The reference frame {path} does not exist.")
+        await session.prompt(f"{instruction} and press Enter to capture {path} ...")
+        await session.run_scan(save_reference_frame, config, path)
+
+
+def calibration_exposures(config):
+    """
+    Exposure times that need master dark frames: the configured one and those of the HDR bracket.
+    """
+    exposures = [config["exposure_time_us"]] + parse_exposures(config["hdr_exposures_us"])
+    return list(dict.fromkeys(exposures))
+
+
+def capture_master_frames(config, cache, kind, exposures, camera_controller, motor_controller, stop_event=None):
+    for exposure_us in exposures:
+        check_stop(stop_event)
+        master = build_master(camera_controller, config["calibration_frames"], config["calibration_method"],
+                              exposure_us)
+        cache.save(kind, exposure_us, config["bit_depth"], master)
+
+
+def apply_calibration(config, cache, camera_controller, motor_controller, stop_event=None):
+    check_stop(stop_event)
+    flat_exposure_us = config["exposure_time_us"] if config["flat_field"] else None
+    calibrations = cache.calibrations(calibration_exposures(config), config["bit_depth"], flat_exposure_us,
+                                      bayer=camera_controller.is_color_camera)
+    camera_controller.set_calibration(calibrations)
+
+
+async def prepare_calibration(session, config, confirm=True):
+    """
+    Capture the master dark (and flat) frames missing from the calibration directory,
+    then let the camera correct every frame on the fly.
+    """
+    cache = CalibrationCache(config["calibration_dir"], session.camera.serial_number)
+    missing = {
+        "dark": [exposure_us for exposure_us in calibration_exposures(config)
+                 if cache.load("dark", exposure_us, config["bit_depth"]) is None],
+        "flat": [config["exposure_time_us"]]
+        if config["flat_field"] and cache.load("flat", config["exposure_time_us"], config["bit_depth"]) is None
+        else [],
+    }
+    instructions = {
+        "dark": "Cover the lens",
+        "flat": "Place the flat-field target in front of the camera",
+    }
+    for kind, exposures in missing.items():
+        if not exposures:
+            continue
+        if not confirm:
+            raise FileNotFoundError(f"Master {kind} frames are missing in {config['calibration_dir']}.")
+        await session.prompt(f"{instructions[kind]} and press Enter to capture the master {kind} frames ...")
+        await session.run_scan(capture_master_frames, config, cache, kind, exposures)
+    await session.run_scan(apply_calibration, config, cache)
+
+
+def step_scan(config, camera_controller, motor_controller, outputs, profiler=NULL_PROFILER, views=None,
+              stop_event=None):
+    """
+    Stop at every view: the next image is taken as soon as the Arduino reports that the stage
+    has stopped, optionally after an additional settle delay.
+    Only the given views are captured (default: all); the stage has to be at the start angle.
+    Setting stop_event ends the scan with ScanStopped between views or while waiting for a move.
+    """
+    total_steps = steps_per_turn(config)
+    views = list(range(config["n_images"])) if views is None else views
+    start_position = motor_controller.get_position()
+
+    def move_to(view, position, target):
+        # Rotate against the absolute target, so no drift accumulates
+        outputs.record("move_commanded", view=view, commanded=target)
+        position = motor_controller.rotate_forwards(target - position, stop_event=stop_event) - start_position
+        outputs.record("move_completed", view=view, achieved=position)
+
+        # Let vibrations of the stage decay before taking the next picture
+        if config["settle_time_s"] > 0:
+            with profiler.stage("settle"):
+                if stop_event is None:
+                    time.sleep(config["settle_time_s"])
+                elif stop_event.wait(config["settle_time_s"]):
+                    check_stop(stop_event)
+        return position
+
+    position = 0
+    for k, i in enumerate(tqdm(views)):
+        check_stop(stop_event)
+        with profiler.frame(i):
+            # A resumed scan may start at a later view
+            target = round(i * total_steps / config["n_images"])
+            if position != target:
+                position = move_to(i, position, target)
+
+            # Capture an image and save it
+            capture_view(config, camera_controller, outputs, i, position)
+
+            # Rotate the motor to the next view
+            next_view = views[k + 1] if k + 1 < len(views) else i + 1
+            position = move_to(next_view, position, round(next_view * total_steps / config["n_images"]))
+
+
+def continuous_scan(config, camera_controller, motor_controller, outputs, profiler=NULL_PROFILER, stop_event=None):
+    """
+    Rotate at constant speed while the Arduino triggers the camera at every view.
+    Each frame is tagged with the step position the sketch reported for its trigger.
+    Setting stop_event ends the scan with ScanStopped while waiting for the next trigger.
+    """
+    total_steps = steps_per_turn(config)
+    origin = motor_controller.get_position()
+    camera_controller.start_hardware_triggered()
+    try:
+        start_position = None
+        outputs.record("move_commanded", view=None, commanded=total_steps)
+        duration = motor_controller.start_continuous_scan(total_steps, config["n_images"])
+        for i in tqdm(range(config["n_images"])):
+            with profiler.frame(i):
+                with profiler.stage("trigger_event"):
+                    index, position, trigger_time_us = motor_controller.read_trigger_event(duration + 2, stop_event)
+                outputs.record("position", view=index, achieved=position - origin)
+                if start_position is None:
+                    start_position = position
+                slot = camera_controller.receive_frame()
+                save_view(config, camera_controller, outputs, slot, index, position - start_position,
+                          trigger_time_us=trigger_time_us)
+        position = motor_controller.wait_for_motion_complete(duration + 2, stop_event)
+        outputs.record("move_completed", view=None, achieved=position - origin)
+    finally:
+        camera_controller.stop_hardware_triggered()
+
+
+def plan_scan(config, camera_controller, motor_controller, outputs, profiler=NULL_PROFILER, views=None,
+              stop_event=None):
+    """
+    Upload the whole scan as a plan of absolute positions; the Arduino moves, settles and triggers
+    the camera for every view on its own, so the host only collects the frames.
+    Only the given views are captured (default: all); the stage has to be at the start angle.
+    Setting stop_event ends the scan with ScanStopped while waiting for the next trigger.
+    """
+    total_steps = steps_per_turn(config)
+    views = list(range(config["n_images"])) if views is None else views
+    start_position = motor_controller.get_position()
+    positions = [start_position + round(i * total_steps / config["n_images"]) for i in views]
+    camera_controller.start_hardware_triggered()
+    try:
+        outputs.record("move_commanded", view=None, commanded=positions[-1] - start_position)
+        duration = motor_controller.start_plan(
+            positions,
+            dwell_ms=round(config["settle_time_s"] * 1000),
+            hold_ms=math.ceil(config["exposure_time_us"] / 1000) + 1,  # Keep still until the exposure has ended
+        )
+        for i in tqdm(views):
+            with profiler.frame(i):
+                with profiler.stage("trigger_event"):
+                    index, position, trigger_time_us = motor_controller.read_trigger_event(duration + 2, stop_event)
+                outputs.record("position", view=views[index], achieved=position - start_position)
+                slot = camera_controller.receive_frame()
+                save_view(config, camera_controller, outputs, slot, views[index], position - start_position,
+                          trigger_time_us=trigger_time_us)
+        position = motor_controller.wait_for_motion_complete(duration + 2, stop_event)
+        outputs.record("move_completed", view=None, achieved=position - start_position)
+    finally:
+        camera_controller.stop_hardware_triggered()
+
+
+def missing_views(config, state, transforms):
+    """
+    Return the views of an interrupted scan that still have to be captured.
+    Views already on disk are added to the NeRF transforms again.
+    """
+    written = {
+        view: record for view, record in state["written"].items()
+        if record["path"] is not None and os.path.exists(record["path"])
+    }
+    if transforms is not None:
+        for view, record in written.items():
+            transforms.add_frame(view, record["path"], record["steps"])
+    return [i for i in range(config["n_images"]) if i not in written]
+
+
+def home_stage(config, motor_controller, outputs, state):
+    """
+    Rotate the stage back to the start angle of an interrupted scan.
+    There is no end stop, so the angle is taken from the journal, assuming the stage has not been moved since.
+    """
+    if state["in_motion"]:
+        log_event("resume_position_uncertain",
+                  "The scan was interrupted during a move; assuming the stage stopped at the last reported position",
+                  level=logging.WARNING, offset=state["offset"])
+    start_position = motor_controller.get_position() - state["offset"]
+    outputs.record("move_commanded", view=None, commanded=0)
+    motor_controller.return_to_start(start_position, steps_per_turn(config))
+    outputs.record("move_completed", view=None, achieved=0)
+
+
+def aquire_images(config, camera_controller, motor_controller, profiler=NULL_PROFILER, stop_event=None):
+    """
+    Function to handle motor control and image acquisition.
+    With config["resume"], an interrupted scan is continued from its journal and only the missing views are captured.
+    Blocking; the session runs it on a helper thread and sets stop_event to end it early. A stopped scan keeps
+    the stage where it is and can be continued with config["resume"].
+    """
+    os.makedirs(config['images_path'], exist_ok=True)
+    total_steps = steps_per_turn(config)
+    journal_path = os.path.join(dataset_directory(config), "journal.jsonl")
+
+    state = None
+    if config["resume"]:
+        state = resume_state(ScanJournal.read(journal_path))
+        if state["scan"]["n_images"] != config["n_images"] or state["scan"]["steps_per_turn"] != total_steps:
+            raise ValueError(f"The journal {journal_path} belongs to a scan with other views or gear settings.")
+
+    # Optionally collect all views in a single file instead of one TIFF per angle
+    container = None
+    if config["scan_container"]:
+        container = ScanContainer(config["scan_container"], config["bit_depth"], config["exposure_time_us"])
+    # The NeRF transforms files grow with every view written, so the dataset is complete when the scan ends
+    outputs = ScanOutputs(container, create_transforms(config), ScanJournal(journal_path, append=state is not None),
+                          create_segmenter(config, camera_controller.color))
+
+    views = None
+    if state is not None:
+        views = missing_views(config, state, outputs.transforms)
+        home_stage(config, motor_controller, outputs, state)
+        log_event("scan_resumed", f"Resuming scan, {len(views)} of {config['n_images']} views missing",
+                  missing_views=len(views), journal_path=journal_path)
+    start_position = motor_controller.get_position()
+    outputs.record("scan_started", n_images=config["n_images"], steps_per_turn=total_steps,
+                   scan_mode=config["scan_mode"], images_path=config["images_path"], resumed=state is not None)
+
+    log_event("scan_started", f"Starting {config['scan_mode']} scan of {config['n_images']} views",
+              scan_mode=config["scan_mode"], n_images=config["n_images"], images_path=config["images_path"])
+    scan_start = time.monotonic()
+    try:
+        if views is not None and not views:
+            log_event("scan_complete", "All views of the scan are already on disk")
+        elif config["scan_mode"] == "continuous" and views is None:
+            continuous_scan(config, camera_controller, motor_controller, outputs, profiler, stop_event)
+        elif config["scan_mode"] in ("plan", "continuous"):
+            # A continuous sweep cannot skip views, so the missing views of a continuous scan are taken with a plan
+            plan_scan(config, camera_controller, motor_controller, outputs, profiler, views, stop_event)
+        else:
+            step_scan(config, camera_controller, motor_controller, outputs, profiler, views, stop_event)
+
+        # Rotate the motor back to the original angle along the shorter direction
+        with profiler.stage("return"):
+            motor_controller.return_to_start(start_position, total_steps)
+        outputs.record("scan_finished")
+    except ScanStopped:
+        outputs.record("scan_stopped")
+        log_event("scan_stopped", "Scan stopped, continue it with --resume", logging.WARNING,
+                  duration_s=time.monotonic() - scan_start)
+        raise
+    finally:
+        # Make sure the images still queued for writing are on disk, also when the scan was stopped
+        with profiler.stage("flush"):
+            camera_controller.flush()
+            outputs.close()
+
+    log_event("scan_finished", f"Scan finished in {time.monotonic() - scan_start:.1f} s",
+              duration_s=time.monotonic() - scan_start, metrics=REGISTRY.snapshot())
+
+
+def build_arg_parser():
+    """
+    Command line arguments of the acquisition; every argument can also be set in the config file.
+    """
     parser = argparse.ArgumentParser(description='Motor Controller Script')
     parser.add_argument('--steps_per_revolution_base', type=int, default=200,
                         help='Number of steps for one rotation.')
@@ -52,7 +457,10 @@ def main():
     parser.add_argument('--set_motor_speed', type=int, default=50, help='Desired motor speed in steps per second.')
     parser.add_argument('--motor_acceleration', type=int, default=200,
                         help='Motor acceleration in steps per second².')
+    parser.add_argument('--serial_baud_rate', type=int, default=115200, help='Baud rate of the Arduino serial link.')
     parser.add_argument('--revolutions', type=int, default=1, help='Number of revolutions to rotate.')
+    parser.add_argument('--gear_ratio', type=int, default=40,
+                        help='Motor revolutions for one full turn of the stage.')
     parser.add_argument('--config_path', type=str, default='configs/config.ini', help='Configuration file path.')
     parser.add_argument('--load_config', action='store_true', help='Load configuration from file.')
     parser.add_argument('--sketch_path', type=str, required=True, help='Path to the Arduino sketch.')
@@ -62,10 +470,80 @@ def main():
 
     parser.add_argument('--exposure_time_us', type=int, default=10000, help='Exposure time in Microseconds.')
     parser.add_argument('--bit_depth', type=int, default=16, help='Target bit depth.')
+    parser.add_argument('--keep_bayer', action='store_true',
+                        help='Save the raw Bayer mosaics of colour cameras instead of demosaiced RGB images.')
+    parser.add_argument('--white_balance', type=str, default='',
+                        help='White balance gains r,g,b of colour cameras (default: the camera\'s own).')
+    parser.add_argument('--hdr_exposures_us', type=str, default='',
+                        help="Exposure bracket in microseconds, e.g. '2500,10000,40000'; every view is merged into a "
+                             "float32 radiance TIFF scaled to exposure_time_us (step scans only).")
+    parser.add_argument('--scan_mode', type=str, default='step', choices=['step', 'continuous', 'plan'],
+                        help="'step' stops the stage for every view, 'continuous' rotates at set_motor_speed "
+                             "and triggers the camera in hardware, 'plan' uploads all views to the Arduino "
+                             "which moves and triggers the camera on its own.")
+    parser.add_argument('--scan_container', type=str, default='',
+                        help='Write all views into this multi-page BigTIFF instead of one TIFF per angle.')
+    parser.add_argument('--writer_queue_size', type=int, default=4,
+                        help='Number of images that may wait for the background writer (0 writes synchronously).')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted scan from its journal, capturing only the missing views.')
+    parser.add_argument('--settle_time_s', type=float, default=0.0,
+                        help='Additional delay in seconds after each move has completed.')
+    parser.add_argument('--nerf_convention', type=str, default='all',
+                        choices=['all', 'z_up', 'y_up', 'y_down', 'none'],
+                        help="Coordinate convention of the transforms files written next to the image directory: "
+                             "'all' writes transforms.json (y_down), transforms_0.json (z_up) and transforms_1.json "
+                             "(y_up) like the datasets in data/, a single convention only transforms.json, "
+                             "'none' disables them.")
+    parser.add_argument('--nerf_radius', type=float, default=0.0,
+                        help='Distance of the cameras from the turntable axis with a single --nerf_convention '
+                             '(0: that of the datasets in data/, 25 for y_down and 4 otherwise).')
+    parser.add_argument('--camera_angle_x', type=float, default=0.5227599091661386,
+                        help='Horizontal field of view of the camera in radians.')
+    parser.add_argument('--camera_angle_y', type=float, default=0.39872024692551256,
+                        help='Vertical field of view of the camera in radians.')
+    parser.add_argument('--nerf_test_every', type=int, default=8,
+                        help='Every n-th view goes to transforms_test.json, the others to transforms_train.json '
+                             '(0 disables the split).')
+    parser.add_argument('--calibration_dir', type=str, default='',
+                        help='Directory of the master dark and flat frames; frames are corrected on the fly '
+                             '(missing masters are captured before the scan).')
+    parser.add_argument('--calibration_frames', type=int, default=16, help='Captures combined into a master frame.')
+    parser.add_argument('--calibration_method', type=str, default='mean', choices=['mean', 'median'],
+                        help='How captures are combined into a master frame.')
+    parser.add_argument('--flat_field', action='store_true', help='Apply a flat-field correction as well.')
+    parser.add_argument('--segment', action='store_true',
+                        help='Cut the object out of every view by comparing it with a frame of the empty stage.')
+    parser.add_argument('--background_frame', type=str, default='',
+                        help='Reference frame of the empty stage (default: background.tiff next to the image '
+                             'directory); captured before the scan if it does not exist.')
+    parser.add_argument('--dark_frame', type=str, default='',
+                        help='Dark frame that makes the segmentation threshold relative to the brightness of the '
+                             'empty stage; captured before the scan if it does not exist.')
+    parser.add_argument('--reference_frames', type=int, default=8, help='Captures averaged into a reference frame.')
+    parser.add_argument('--segmentation_threshold', type=float, default=0.04,
+                        help='Difference to the empty stage above which a pixel belongs to the object, as a '
+                             'fraction of full scale, or of the dark-corrected empty stage with --dark_frame.')
+    parser.add_argument('--segmentation_path', type=str, default='',
+                        help='Directory of the RGBA views (default: the image directory with suffix _rgba).')
+    parser.add_argument('--simulate', action='store_true',
+                        help='Run against a simulated camera and Arduino instead of the hardware.')
+    parser.add_argument('--camera_serial', type=str, default='',
+                        help='Serial number of the camera to use (default: the first camera found).')
+    parser.add_argument('--arduino_port', type=str, default='',
+                        help='Serial port of the Arduino to use (default: the first board found).')
+    parser.add_argument('--disk_bandwidth_mb_s', type=float, default=0.0,
+                        help='Limit the image write bandwidth in MB/s (0 means unlimited).')
+    parser.add_argument('--metrics_port', type=int, default=0,
+                        help='Serve acquisition metrics on http://localhost:<port>/metrics (0 disables it).')
+    parser.add_argument('--log_path', type=str, default='', help='Append structured log events to this JSON lines file.')
+    return parser
 
 
-    args = parser.parse_args()
-
+def load_config(args):
+    """
+    Return the config dict from the parsed arguments, updated from the config file if requested.
+    """
     # If load_config is True, load config file and update args
     if args.load_config:
         print('Loading configuration from file')
@@ -78,34 +556,131 @@ def main():
             if hasattr(args, key):
                 # Convert the config value to the correct type
                 arg_type = type(getattr(args, key))
-                setattr(args, key, arg_type(config_defaults[key]))
+                if arg_type is bool:
+                    setattr(args, key, config_defaults.getboolean(key))
+                else:
+                    setattr(args, key, arg_type(config_defaults[key]))
             else:
                 print(f"Warning: Unknown config parameter '{key}' in config file.")
 
     # Now you can use vars(args) as your config dict
     config = vars(args)
+    # Checked here, before the operator is asked to capture any calibration or reference frames
+    if config["hdr_exposures_us"] and (config["scan_mode"] != "step" or config["scan_container"]):
+        raise ValueError("HDR bracketing needs scan_mode 'step' and one TIFF file per view.")
+    if config["resume"] and config["scan_container"]:
+        raise ValueError("Scans into a container cannot be resumed.")
+    return config
+
+
+def start_monitoring(config):
+    """
+    Set up the structured log file and the metrics endpoint if configured.
+    Returns the MetricsServer, or None.
+    """
+    configure_logging(config["log_path"] or None)
+    if config["metrics_port"] > 0:
+        return MetricsServer(config["metrics_port"]).start()
+    return None
 
+
+def create_simulation(config):
+    """
+    Create the simulated camera SDK and Arduino if config["simulate"] is set, otherwise return (None, None).
+    """
+    if not config["simulate"]:
+        return None, None
+    # The simulated Arduino triggers the simulated camera like the trigger cable does on the rig
+    camera_sdk = SimulatedTLCameraSDK(serial_numbers=[config["camera_serial"]] if config["camera_serial"] else None)
+    simulated_arduino = SimulatedArduino(config, sketch_path=config["sketch_path"],
+                                         trigger_callback=camera_sdk.hardware_trigger).start()
+    return camera_sdk, simulated_arduino
+
+
+def open_arduino(config, simulated_arduino=None, profiler=None):
+    """
+    Connect to the Arduino (or the simulated one), uploading the sketch if needed.
+    """
     # Create an instance of MotorController with the updated arguments
     motor_controller = ArduinoController(
         config=config,
-        sketch_path=args.sketch_path,
+        sketch_path=config["sketch_path"],
+        port=simulated_arduino.port if simulated_arduino else (config["arduino_port"] or None),
+        fqbn=simulated_arduino.fqbn if simulated_arduino else None,
+        profiler=profiler,
     )
     motor_controller.connect()
+    return motor_controller
+
 
-    # Create an instance of CameraController
-    camera_controller = CameraControllerSimple(exposure_time_us = args.exposure_time_us, bit_depth=args.bit_depth)
+def create_writer(config):
+    return ImageWriter(max_pending=config["writer_queue_size"]) if config["writer_queue_size"] > 0 else None
+
+
+def create_throttle(config):
+    return DiskThrottle(config["disk_bandwidth_mb_s"]) if config["disk_bandwidth_mb_s"] > 0 else None
+
+
+def open_camera(config, writer=None, camera_sdk=None, profiler=None, throttle=None):
+    """
+    Open the camera (or the simulated one) for triggered acquisition.
+    """
     #camera_controller = CameraController()
+    # Every view holds one ring slot per exposure of its bracket until it has been written
+    frames_per_view = max(len(parse_exposures(config["hdr_exposures_us"])), 1)
+    return CameraControllerSimple(exposure_time_us=config["exposure_time_us"], bit_depth=config["bit_depth"],
+                                  writer=writer, ring_size=(config["writer_queue_size"] + 2) * frames_per_view,
+                                  sdk=camera_sdk, profiler=profiler, serial_number=config["camera_serial"] or None,
+                                  throttle=throttle, demosaic=not config["keep_bayer"],
+                                  white_balance=parse_gains(config["white_balance"]))
 
-    # Run the motor control task in a separate thread
-    motor_thread = threading.Thread(target=aquire_images, args=(config, camera_controller, motor_controller))
-    motor_thread.start()
 
-    # Start the live view (this needs to be on the main thread)
-    #camera_controller.start_live_view()
+def create_controllers(config, profiler=None, throttle=None):
+    """
+    Connect to the Arduino and open the camera, or their simulated stand-ins if config["simulate"] is set.
+    Returns (camera_controller, motor_controller, writer, simulated_arduino); writer and simulated_arduino may be None.
+    """
+    camera_sdk, simulated_arduino = create_simulation(config)
+    motor_controller = open_arduino(config, simulated_arduino, profiler)
+    writer = create_writer(config)
+    camera_controller = open_camera(config, writer, camera_sdk, profiler, throttle)
+    return camera_controller, motor_controller, writer, simulated_arduino
 
-    # Wait for the motor control thread to finish
-    motor_thread.join()
-    #camera_controller.stop_live_view()
+
+async def run_acquisition(config, throttle=None, confirm=True):
+    """
+    Open the Arduino and the camera concurrently, wait for the user (if confirm is set) and run the scan.
+    """
+    camera_sdk, simulated_arduino = create_simulation(config)
+    writer = create_writer(config)
+    try:
+        async with AcquisitionSession(
+            open_arduino=functools.partial(open_arduino, config, simulated_arduino),
+            open_camera=functools.partial(open_camera, config, writer, camera_sdk, throttle=throttle),
+        ) as session:
+            if config["calibration_dir"]:
+                await prepare_calibration(session, config, confirm)
+            if config["segment"]:
+                await capture_references(session, config, confirm)
+            if confirm:
+                await session.prompt("Press Enter to start image acquisition and motor rotation ...")
+            await session.run_scan(aquire_images, config)
+    finally:
+        if writer is not None:
+            writer.close()
+        if simulated_arduino is not None:
+            simulated_arduino.close()
+
+
+def main():
+    ######## Load Configuration ########
+    config = load_config(build_arg_parser().parse_args())
+    metrics_server = start_monitoring(config)
+    try:
+        asyncio.run(run_acquisition(config, create_throttle(config)))
+    finally:
+        if metrics_server is not None:
+            metrics_server.close()
 
 
 if __name__ == "__main__":
@@ -1,7 +1,92 @@
 import os
+import argparse
 import pygame
-from PIL import Image, ImageDraw
+from PIL import Image
 import numpy as np
+import tifffile
+
+from utils_camera.masking import (AngularMasks, MASK_EXTENSIONS, apply_mask, mask_container, mask_directory,
+                                  rasterize_polygons, view_angles)
+
+
+def load_preview(image_path):
+    """
+    Open an image for drawing; 16 bit TIFF views are scaled to 8 bit for display.
+    """
+    if image_path.lower().endswith(('.tif', '.tiff')):
+        image_data = tifffile.imread(image_path).astype(np.float64)
+        image_data = 255 * image_data / max(image_data.max(), 1)
+        return Image.fromarray(image_data.astype(np.uint8)).convert("RGBA")
+    return Image.open(image_path).convert("RGBA")
+
+
+def draw_polygons(image, caption):
+    """
+    Let the user draw polygons on an image: left click adds a point, right click, Enter or Space finish
+    a polygon and 's' accepts the drawing. Returns the polygons, or None if the window was closed.
+    """
+    width, height = image.size
+
+    # Create a Pygame window with the size of the image
+    screen = pygame.display.set_mode((width, height))
+    pygame.display.set_caption(caption)
+
+    # Load the image into Pygame
+    mode = image.mode
+    size = image.size
+    data = image.tobytes()
+
+    pygame_image = pygame.image.fromstring(data, size, mode)
+
+    # Main loop for this image
+    done = False
+    polygons = []  # List to store polygons
+    current_polygon = []  # Points in the current polygon
+
+    while not done:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return None
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_RETURN or event.key == pygame.K_SPACE:
+                    if current_polygon:
+                        # Finish current polygon
+                        polygons.append(current_polygon.copy())
+                        current_polygon = []
+                elif event.key == pygame.K_s:
+                    # Save and move to next image
+                    done = True
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                if event.button == 1:  # Left click
+                    pos = pygame.mouse.get_pos()
+                    current_polygon.append(pos)
+                elif event.button == 3:  # Right click
+                    if current_polygon:
+                        # Finish current polygon
+                        polygons.append(current_polygon.copy())
+                        current_polygon = []
+
+        # Draw the image
+        screen.blit(pygame_image, (0, 0))
+
+        # Draw current polygon
+        if current_polygon:
+            if len(current_polygon) > 1:
+                pygame.draw.lines(screen, (255, 0, 0), False, current_polygon, 2)
+            for point in current_polygon:
+                pygame.draw.circle(screen, (255, 0, 0), point, 3)
+
+        # Draw finished polygons
+        for poly in polygons:
+            if len(poly) > 2:
+                pygame.draw.polygon(screen, (0, 255, 0), poly, 2)
+            else:
+                pygame.draw.lines(screen, (0, 255, 0), False, poly, 2)
+
+        pygame.display.flip()
+
+    return polygons
+
 
 def transparent_polygon_editor(folder_path):
     """
@@ -27,79 +112,13 @@ def transparent_polygon_editor(folder_path):
                 # Convert the image to a NumPy array for manipulation
                 img_array = np.array(image)
 
-                # Create a Pygame window with the size of the image
-                screen = pygame.display.set_mode((width, height))
-                pygame.display.set_caption(f"Editing {filename}")
-
-                # Load the image into Pygame
-                mode = image.mode
-                size = image.size
-                data = image.tobytes()
-
-                pygame_image = pygame.image.fromstring(data, size, mode)
-
-                # Main loop for this image
-                done = False
-                polygons = []  # List to store polygons
-                current_polygon = []  # Points in the current polygon
-
-                while not done:
-                    for event in pygame.event.get():
-                        if event.type == pygame.QUIT:
-                            pygame.quit()
-                            return
-                        elif event.type == pygame.KEYDOWN:
-                            if event.key == pygame.K_RETURN or event.key == pygame.K_SPACE:
-                                if current_polygon:
-                                    # Finish current polygon
-                                    polygons.append(current_polygon.copy())
-                                    current_polygon = []
-                            elif event.key == pygame.K_s:
-                                # Save and move to next image
-                                done = True
-                        elif event.type == pygame.MOUSEBUTTONDOWN:
-                            if event.button == 1:  # Left click
-                                pos = pygame.mouse.get_pos()
-                                current_polygon.append(pos)
-                            elif event.button == 3:  # Right click
-                                if current_polygon:
-                                    # Finish current polygon
-                                    polygons.append(current_polygon.copy())
-                                    current_polygon = []
-
-                    # Draw the image
-                    screen.blit(pygame_image, (0, 0))
-
-                    # Draw current polygon
-                    if current_polygon:
-                        if len(current_polygon) > 1:
-                            pygame.draw.lines(screen, (255, 0, 0), False, current_polygon, 2)
-                        for point in current_polygon:
-                            pygame.draw.circle(screen, (255, 0, 0), point, 3)
-
-                    # Draw finished polygons
-                    for poly in polygons:
-                        if len(poly) > 2:
-                            pygame.draw.polygon(screen, (0, 255, 0), poly, 2)
-                        else:
-                            pygame.draw.lines(screen, (0, 255, 0), False, poly, 2)
-
-                    pygame.display.flip()
-
-                # After done editing, apply polygons to image
-
-                # Create a mask
-                mask = Image.new('L', (width, height), 0)
-                mask_draw = ImageDraw.Draw(mask)
-
-                for poly in polygons:
-                    mask_draw.polygon(poly, fill=255)
-
-                # Convert mask to numpy array
-                mask_array = np.array(mask)
+                polygons = draw_polygons(image, f"Editing {filename}")
+                if polygons is None:
+                    pygame.quit()
+                    return
 
-                # Set alpha channel of img_array to 0 where mask is 255
-                img_array[mask_array == 255, 3] = 0
+                # After done editing, make the area inside the polygons transparent
+                apply_mask(img_array, rasterize_polygons(polygons, (height, width)))
 
                 # Convert back to image
                 new_image = Image.fromarray(img_array)
@@ -118,6 +137,72 @@ def transparent_polygon_editor(folder_path):
 
     pygame.quit()
 
+
+def draw_masks(folder_path, mask_path, n_keyframes=1, n_views=None):
+    """
+    Draw the masks of a scan once, on n_keyframes evenly spaced views, and save them for batch masking.
+    Masks in between are interpolated from the keyframes. n_views is the number of views of the full scan
+    (default: the highest view index in the folder + 1).
+    """
+    filenames = sorted(
+        (filename for filename in os.listdir(folder_path) if filename.lower().endswith(MASK_EXTENSIONS)),
+        key=lambda filename: (len(filename), filename),
+    )
+    if not filenames:
+        print(f"No images found in '{folder_path}'.")
+        return
+    angles = view_angles(filenames, n_views)
+
+    pygame.init()
+    keyframes = {}
+    shape = None
+    try:
+        for i in range(n_keyframes):
+            index = i * len(filenames) // n_keyframes
+            image = load_preview(os.path.join(folder_path, filenames[index]))
+            shape = (image.size[1], image.size[0])
+            polygons = draw_polygons(image, f"Masks at {angles[index]:.1f} degrees ({filenames[index]})")
+            if polygons is None:
+                return
+            keyframes[angles[index]] = polygons
+    finally:
+        pygame.quit()
+
+    AngularMasks(shape, keyframes).save(mask_path)
+    print(f"Saved masks of {len(keyframes)} keyframes to {mask_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mask regions of scan images')
+    parser.add_argument('--folder', type=str, default='', help='Folder containing the images.')
+    parser.add_argument('--container', type=str, default='', help='Scan container to mask instead of a folder.')
+    parser.add_argument('--draw_masks', type=str, default='',
+                        help='Draw masks on keyframe views of the folder and save them to this file.')
+    parser.add_argument('--keyframes', type=int, default=1, help='Number of views to draw masks on.')
+    parser.add_argument('--apply_masks', type=str, default='',
+                        help='Apply the masks saved in this file to all images of the folder or container.')
+    parser.add_argument('--output', type=str, default='', help='Write masked images here instead of overwriting them.')
+    parser.add_argument('--fill', type=int, default=0, help='Value of masked pixels in images without alpha channel.')
+    parser.add_argument('--processes', type=int, default=0, help='Number of worker processes (0: one per core).')
+    parser.add_argument('--n_views', type=int, default=0,
+                        help='Number of views of the full scan, e.g. for a partial scan '
+                             '(0: the highest view index in the folder + 1).')
+    args = parser.parse_args()
+
+    if args.draw_masks:
+        draw_masks(args.folder, args.draw_masks, args.keyframes, args.n_views or None)
+    elif args.apply_masks:
+        masks = AngularMasks.load(args.apply_masks)
+        if args.container:
+            n_masked = mask_container(args.container, masks, args.output or None, args.fill, args.processes or None)
+        else:
+            n_masked = mask_directory(args.folder, masks, args.output or None, args.fill, args.n_views or None,
+                                      args.processes or None)
+        print(f"Masked {n_masked} images.")
+    else:
+        folder_path = args.folder or input("Enter the path to the folder containing images: ")
+        transparent_polygon_editor(folder_path)
+
+
 if __name__ == "__main__":
-    folder_path = input("Enter the path to the folder containing images: ")
-    transparent_polygon_editor(folder_path)
+    main()
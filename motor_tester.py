@@ -1,29 +1,17 @@
 # motor_tester.py
 
-from utils_arduino.arduino_controller import ArduinoController
-import time
+import asyncio
+import functools
 
-def main():
-    # Configuration for the motor
-    config = {
-        "steps_per_revolution_base": 200,
-        "micro_stepping": 16,
-        "motor_max_speed": 1600,
-        "set_motor_speed": 800,
-        "motor_acceleration": 1600,
-        "revolutions": 1
-    }
+from utils_acquisition.session import AcquisitionSession
+from light_tester import open_arduino
 
-    # Initialize the motor controller
-    motor = ArduinoController(config)
-
-    try:
-        # Connect to the Arduino
-        motor.connect()
 
+async def run(config):
+    async with AcquisitionSession(open_arduino=functools.partial(open_arduino, config)) as session:
         while True:
             # Get user input from the console
-            user_input = input("Enter the number of steps (positive for forward, negative for backward, 'q' to quit): ")
+            user_input = await session.prompt("Enter the number of steps (positive for forward, negative for backward, 'q' to quit): ")
 
             # Check if the user wants to quit
             if user_input.lower() == 'q':
@@ -40,23 +28,31 @@ def main():
             # Move the motor based on the user input
             if steps > 0:
                 print(f"Moving forward by {steps} steps...")
-                motor.rotate_forwards(steps)
             elif steps < 0:
                 print(f"Moving backward by {-steps} steps...")
-                motor.rotate_backwards(-steps)
             else:
                 print("Zero steps entered, motor will not move.")
+                continue
+            position = await session.move(steps)
+            print(f"Stage stopped at position {position}.")
 
-            # Small delay to allow serial communication to complete
-            time.sleep(0.5)
 
+def main():
+    # Configuration for the motor
+    config = {
+        "steps_per_revolution_base": 200,
+        "micro_stepping": 16,
+        "motor_max_speed": 1600,
+        "set_motor_speed": 800,
+        "motor_acceleration": 1600,
+        "revolutions": 1
+    }
+
+    try:
+        asyncio.run(run(config))
     except Exception as e:
         print(f"Error: {e}")
 
-    finally:
-        # Ensure the serial connection is closed properly
-        motor.close()
-
 
 if __name__ == "__main__":
     main()
@@ -1,42 +1,22 @@
 # run_all.py
 
-from utils_camera.camera_controller import CameraController
-from utils_arduino.arduino_controller import ArduinoController
-import time
-import serial
+import asyncio
+import functools
 
-def main():
-    try:
-        camera_controller = CameraController()
-        camera_controller.start_live_view()
-    except:
-        pass
-
-    # Configuration for the motor
-    config = {
-        "steps_per_revolution_base": 200,
-        "micro_stepping": 16,
-        "motor_max_speed": 1600,
-        "set_motor_speed": 800,
-        "motor_acceleration": 1600,
-        "revolutions": 1
-    }
+from utils_camera.camera_controller import CameraController
+from utils_acquisition.session import AcquisitionSession
+from light_tester import open_arduino, handle_led_command
 
-    # Initialize the arduino controller
-    arduino = ArduinoController(config)
 
+async def console(session):
+    background_tasks = set()
     try:
-        # Connect to the Arduino
-        arduino.connect()
-
-        # Initialize LED tester
-        ser = serial.Serial(arduino.port, 9600, timeout=1)
-        time.sleep(2)  # Allow some time for the Arduino to reset
-
-
         while True:
             # Get user input from the console
-            user_input = input("Enter command for LED strip ('on'/'off'/'set_color RRGGBB'/'brightness 0-255'/'quit'): ")
+            user_input = await session.prompt(
+                "Enter command for LED strip ('on'/'off'/'set_color RRGGBB'/'brightness 0-255'/'fun seconds'"
+                "/'steps num_of_steps'/'quit'): "
+            )
 
             # Check if the user wants to quit
             if user_input.lower() == 'quit':
@@ -44,63 +24,61 @@ def main():
                 break
 
             # Handle LED strip commands
-            if user_input.lower() == 'on':
-                print("Turning on the LED strip with full brightness...")
-                ser.write(b'L255\n')  # Turn on with full brightness
-            elif user_input.lower() == 'off':
-                print("Turning off the LED strip...")
-                ser.write(b'O\n')  # Turn off
-            elif user_input.lower().startswith('set_color '):
-                color_hex = user_input.split()[1]
-                if len(color_hex) == 6:
-                    print(f"Setting LED strip color to #{color_hex}...")
-                    ser.write(f'C{color_hex}\n'.encode())
-                else:
-                    print("Invalid color format. Please use RRGGBB format.")
-            elif user_input.lower().startswith('brightness '):
-                try:
-                    brightness = int(user_input.split()[1])
-                    if 0 <= brightness <= 255:
-                        print(f"Setting LED strip brightness to {brightness}...")
-                        ser.write(f'L{brightness}\n'.encode())
-                    else:
-                        print("Brightness must be between 0 and 255.")
-                except ValueError:
-                    print("Invalid brightness value. Please enter a number between 0 and 255.")
-            elif user_input.lower().startswith('fun '):
-                try :
-                    ts = int(user_input.split()[1])
-                    print(f"Activating rainbow mode for {ts} seconds...")
-                    ser.write(f'R{ts}\n'.encode())  # Send rainbow mode command
-                    time.sleep(ts)  # Keep the rainbow mode active for 10 seconds
-                    print("Rainbow mode ended.")
-                except ValueError:
-                    print("Invalid time value. Please enter a number.")
+            if await handle_led_command(session, user_input, background_tasks):
+                continue
 
-            elif user_input.lower().startswith('steps '):
+            if user_input.lower().startswith('steps '):
                 try:
                     steps = int(user_input.split()[1])
-                    if steps >= 0:
-                        print(f"Moving forward by {steps} steps...")
-                        arduino.rotate_forwards(steps)
-                    elif steps < 0:
-                        print(f"Moving backward by {-steps} steps...")
-                        arduino.rotate_backwards(-steps)
                 except ValueError:
-                    print("Invalid brightness value. Please enter a number between 0 and 255.")
+                    print("Invalid number of steps. Please enter an integer value.")
+                    continue
+                if steps >= 0:
+                    print(f"Moving forward by {steps} steps...")
+                else:
+                    print(f"Moving backward by {-steps} steps...")
+                await session.move(steps)
             else:
                 print("Invalid command. Please try again.")
+    finally:
+        for task in background_tasks:
+            task.cancel()
+
+
+async def run(config):
+    async with AcquisitionSession(open_arduino=functools.partial(open_arduino, config)) as session:
+        # The live view runs next to the console; the Tk window has to be created on the event loop thread
+        live_view = None
+        try:
+            camera_controller = CameraController()
+            live_view = asyncio.create_task(session.live_view(camera_controller))
+        except Exception:
+            pass
 
-        # Small delay to allow serial communication to complete
-        time.sleep(0.5)
+        try:
+            await console(session)
+        finally:
+            if live_view is not None and not live_view.done():
+                camera_controller.stop_live_view()
+                await live_view
+
+
+def main():
+    # Configuration for the motor
+    config = {
+        "steps_per_revolution_base": 200,
+        "micro_stepping": 16,
+        "motor_max_speed": 1600,
+        "set_motor_speed": 800,
+        "motor_acceleration": 1600,
+        "revolutions": 1
+    }
 
+    try:
+        asyncio.run(run(config))
     except Exception as e:
         print(f"Error: {e}")
 
-    finally:
-        # Ensure the serial connection is closed properly
-        arduino.close()
-
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,53 @@
+# run_rigs.py
+
+import os
+import sys
+import asyncio
+import argparse
+
+from main import build_arg_parser, load_config, start_monitoring, run_acquisition
+from utils_acquisition.rig_scheduler import RigScheduler
+
+
+def run_rig(config, throttle):
+    """
+    Scan with one rig; runs in a process of its own.
+    """
+    start_monitoring(config)
+    asyncio.run(run_acquisition(config, throttle, confirm=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the scans of several rigs in parallel')
+    parser.add_argument('--rig', action='append', required=True,
+                        help='Config file of a rig, with its camera_serial and arduino_port (repeat for every rig).')
+    parser.add_argument('--sketch_path', type=str, required=True, help='Path to the Arduino sketch.')
+    parser.add_argument('--disk_bandwidth_mb_s', type=float, default=0.0,
+                        help='Combined image write bandwidth of all rigs in MB/s (0 means unlimited).')
+    parser.add_argument('--max_parallel', type=int, default=0, help='Maximum number of rigs scanning at once (0: all).')
+    parser.add_argument('--simulate', action='store_true', help='Use simulated cameras and Arduinos.')
+    parser.add_argument('--resume', action='store_true', help='Continue the interrupted scans of all rigs.')
+    args = parser.parse_args()
+
+    rig_configs = []
+    for config_path in args.rig:
+        rig_args = ['--load_config', '--config_path', config_path, '--sketch_path', args.sketch_path]
+        if args.simulate:
+            rig_args.append('--simulate')
+        if args.resume:
+            rig_args.append('--resume')
+        config = load_config(build_arg_parser().parse_args(rig_args))
+        config["rig_name"] = os.path.splitext(os.path.basename(config_path))[0]
+        rig_configs.append(config)
+
+    scheduler = RigScheduler(run_rig, rig_configs, args.disk_bandwidth_mb_s, args.max_parallel or None)
+    results = scheduler.run()
+    failed = [name for name, exitcode in results.items() if exitcode != 0]
+    if failed:
+        print(f"Scans failed on: {', '.join(failed)}")
+        sys.exit(1)
+    print("All scans finished.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import argparse
+
+from utils_camera.transcode import TONE_METHODS, transcode_scan
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert the raw views of a scan into an 8 bit PNG dataset')
+    parser.add_argument('source', type=str, help='Scan directory (with images/ and transforms.json) or scan container.')
+    parser.add_argument('output', type=str, help='Dataset directory for the PNG images and transforms files.')
+    parser.add_argument('--tone', type=str, default='shift', choices=TONE_METHODS,
+                        help='Tone mapping: drop the low bits, stretch between percentiles, or gamma encode.')
+    parser.add_argument('--bit_depth', type=int, default=0,
+                        help='Bit depth of the raw views (0: from the TIFF tags or the data type).')
+    parser.add_argument('--percentiles', type=float, nargs=2, default=(0.5, 99.5),
+                        help='Percentiles stretched to black and white with --tone percentile.')
+    parser.add_argument('--gamma', type=float, default=2.2, help='Gamma of --tone gamma.')
+    parser.add_argument('--downscale', type=int, default=1, help='Shrink the images by this integer factor.')
+    parser.add_argument('--alpha', type=str, default='',
+                        help='Segmentation folder of RGBA views or masks file to take the alpha channel from.')
+    parser.add_argument('--processes', type=int, default=0, help='Number of worker processes (0: one per core).')
+    parser.add_argument('--force', action='store_true', help='Convert all views, also those that are up to date.')
+    args = parser.parse_args()
+
+    n_converted = transcode_scan(args.source, args.output, args.tone, args.bit_depth or None, args.percentiles,
+                                 args.gamma, args.downscale, args.alpha or None, args.processes or None, args.force)
+    print(f"Converted {n_converted} views.")
+
+
+if __name__ == "__main__":
+    main()
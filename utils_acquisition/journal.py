@@ -0,0 +1,86 @@
+# utils_acquisition/journal.py
+
+import os
+import json
+import threading
+import time
+
+
+class ScanJournal:
+    """
+    Append-only record of a scan as JSON lines, so an interrupted scan can be resumed:
+    - scan_started: scan parameters, once per run (a resumed scan adds another one).
+    - move_commanded / move_completed: stage target and reached position of a move or a whole sweep.
+    - position: stage position reported with a hardware trigger, while the stage keeps moving.
+    - frame_written: a view whose image is complete on disk.
+    - scan_finished: the scan ran to the end.
+    - scan_stopped: the scan was stopped early, e.g. by cancelling its session.
+    Positions are in microsteps relative to the start angle of the scan, so they stay valid when the
+    Arduino restarts its position count. Every record is flushed to disk before record() returns.
+    """
+
+    def __init__(self, path, append=False):
+        """
+        Start a new journal at path, or continue an existing one if append is set.
+        """
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a" if append else "w")
+        self._lock = threading.Lock()
+
+    def record(self, event, **fields):
+        line = json.dumps({"event": event, "time": time.time(), **fields})
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    @staticmethod
+    def read(path):
+        """
+        Return the records of a journal as a list of dicts, ignoring a line cut off by a crash.
+        """
+        records = []
+        with open(path) as journal_file:
+            for line in journal_file:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+        return records
+
+
+def resume_state(records):
+    """
+    Summarize the journal of an interrupted scan:
+    - scan: the parameters of the first run.
+    - written: frame_written records by view.
+    - offset: last known stage position relative to the start angle.
+    - in_motion: True if the journal ends during a move, so the stage may have stopped anywhere on the way.
+    """
+    starts = [record for record in records if record["event"] == "scan_started"]
+    if not starts:
+        raise ValueError("The journal does not contain a scan.")
+    written = {}
+    offset = 0
+    in_motion = False
+    for record in records:
+        event = record["event"]
+        if event == "scan_started":
+            offset = 0  # Every run starts at the start angle
+            in_motion = False
+        elif event == "move_commanded":
+            in_motion = True
+        elif event == "move_completed":
+            offset = record["achieved"]
+            in_motion = False
+        elif event == "position":
+            offset = record["achieved"]
+        elif event == "frame_written":
+            written[record["view"]] = record
+    return {"scan": starts[0], "written": written, "offset": offset, "in_motion": in_motion}
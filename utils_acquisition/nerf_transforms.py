@@ -0,0 +1,127 @@
+# utils_acquisition/nerf_transforms.py
+
+import os
+import json
+import threading
+import time
+import numpy as np
+
+# Pose of view 0 and turntable axis of the coordinate conventions found in the datasets under data/:
+#   z_up:   transforms_0.json, z axis up (Blender / NeRF synthetic)
+#   y_up:   transforms_1.json, y axis up
+#   y_down: transforms.json, y axis down
+# The base rotation holds the camera x, y and z axes (in world coordinates) as columns;
+# the camera looks along its -z axis, i.e. towards the turntable axis.
+CONVENTIONS = {
+    "z_up": {"axis": (0.0, 0.0, 1.0), "sign": 1.0, "base": ((0, 0, 1), (1, 0, 0), (0, 1, 0))},
+    "y_up": {"axis": (0.0, 1.0, 0.0), "sign": -1.0, "base": ((0, 0, 1), (0, 1, 0), (-1, 0, 0))},
+    "y_down": {"axis": (0.0, 1.0, 0.0), "sign": -1.0, "base": ((0, 0, 1), (0, -1, 0), (1, 0, 0))},
+}
+
+# Transforms files of the datasets under data/ with their convention and camera distance
+DATASET_FILES = {
+    "transforms.json": ("y_down", 25.0),
+    "transforms_0.json": ("z_up", 4.0),
+    "transforms_1.json": ("y_up", 4.0),
+}
+
+
+def write_json_atomic(path, data):
+    """
+    Write data as JSON to a temporary file and rename it over path, so readers never see a partial file.
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f, indent=4)
+    os.replace(temp_path, path)
+
+
+def turntable_poses(angles, radius, convention="z_up"):
+    """
+    Camera-to-world matrices (N x 4 x 4) of a camera circling the turntable axis at the given angles (radians).
+    """
+    spec = CONVENTIONS[convention]
+    angles = spec["sign"] * np.asarray(angles, dtype=np.float64)
+    axis = np.asarray(spec["axis"])
+    base = np.asarray(spec["base"], dtype=np.float64)
+
+    # Rodrigues' formula for all angles at once: R = I + sin(a) K + (1 - cos(a)) K^2
+    k = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+    sin = np.sin(angles)[:, None, None]
+    cos = np.cos(angles)[:, None, None]
+    rotations = np.eye(3) + sin * k + (1 - cos) * (k @ k)
+
+    poses = np.zeros((len(angles), 4, 4))
+    poses[:, :3, :3] = rotations @ base
+    poses[:, :3, 3] = poses[:, :3, 2] * radius  # Camera on its own z axis, looking at the turntable axis
+    poses[:, 3, 3] = 1.0
+    return poses
+
+
+class TransformsWriter:
+    """
+    Writes the NeRF transforms files of a scan while it is running:
+    - add_frame() registers a view once its image has been written, with the stage position in microsteps.
+    - Poses are computed from the positions for all views at once, as rotations about the turntable axis.
+    - files maps file names to (convention, radius); by default the three files of the datasets under data/.
+    - transforms_train.json and transforms_test.json split the views of the first file
+      (every test_every-th view is a test view; 0 disables the split).
+    - The files are rewritten atomically at most every flush_interval seconds and by close(),
+      so the dataset can be used as soon as the scan ends.
+    """
+
+    def __init__(self, directory, steps_per_turn, camera_angle_x, camera_angle_y, files=None, test_every=8,
+                 flush_interval=5.0):
+        files = dict(files or DATASET_FILES)
+        for convention, _ in files.values():
+            if convention not in CONVENTIONS:
+                raise ValueError(f"Unknown convention '{convention}'. Allowed: {', '.join(CONVENTIONS)}")
+        self.directory = directory
+        self._steps_per_turn = steps_per_turn
+        self._camera_angle_x = camera_angle_x
+        self._camera_angle_y = camera_angle_y
+        self._files = files
+        self._test_every = test_every
+        self._flush_interval = flush_interval
+        self._frames = {}  # view index -> (file path relative to directory, steps)
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+
+    def add_frame(self, index, image_path, steps):
+        with self._lock:
+            self._frames[index] = (os.path.relpath(image_path, self.directory).replace(os.sep, "/"), steps)
+            due = time.monotonic() - self._last_flush >= self._flush_interval
+        if due:
+            self.flush()
+
+    def _transforms(self, frames):
+        return {
+            "camera_angle_x": self._camera_angle_x,
+            "camera_angle_y": self._camera_angle_y,
+            "frames": frames,
+        }
+
+    def flush(self):
+        with self._lock:
+            indices = sorted(self._frames)
+            paths = [self._frames[index][0] for index in indices]
+            steps = np.array([self._frames[index][1] for index in indices], dtype=np.float64)
+            self._last_flush = time.monotonic()
+
+        angles = 2 * np.pi * steps / self._steps_per_turn
+        for file_number, (filename, (convention, radius)) in enumerate(self._files.items()):
+            frames = [
+                {"file_path": path, "transform_matrix": pose.tolist()}
+                for path, pose in zip(paths, turntable_poses(angles, radius, convention))
+            ]
+            write_json_atomic(os.path.join(self.directory, filename), self._transforms(frames))
+            if file_number == 0 and self._test_every > 0:
+                is_test = [index % self._test_every == 0 for index in indices]
+                train = [frame for frame, test in zip(frames, is_test) if not test]
+                test = [frame for frame, test in zip(frames, is_test) if test]
+                write_json_atomic(os.path.join(self.directory, "transforms_train.json"), self._transforms(train))
+                write_json_atomic(os.path.join(self.directory, "transforms_test.json"), self._transforms(test))
+
+    def close(self):
+        self.flush()
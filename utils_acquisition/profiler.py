@@ -0,0 +1,179 @@
+# utils_acquisition/profiler.py
+
+import contextlib
+import json
+import platform
+import subprocess
+import threading
+import time
+import numpy as np
+
+PERCENTILES = (50, 90, 99)
+
+
+class StageProfiler:
+    """
+    Collects per-frame timings of the acquisition stages (trigger, readout, copy, write, serial, motor, ...):
+    - stage() times a block and attributes it to the current frame of the calling thread (set by frame()),
+      or to an explicit frame for work handed off to other threads such as the image writer.
+    - summary() reports count, mean and percentiles per stage plus throughput in views/min and MB/s.
+    - save_json() stores the summary and the raw per-frame timings so runs can be compared across commits.
+    """
+
+    def __init__(self):
+        self._records = []  # (frame, stage, start, duration, nbytes)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._start = time.perf_counter()
+        self._end = None
+
+    @property
+    def current_frame(self):
+        return getattr(self._local, "frame", None)
+
+    def record(self, stage, start, duration, frame=None, nbytes=0):
+        with self._lock:
+            self._records.append((frame, stage, start - self._start, duration, nbytes))
+
+    @contextlib.contextmanager
+    def stage(self, name, frame=None, nbytes=0):
+        if frame is None:
+            frame = self.current_frame
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter() - start, frame, nbytes)
+
+    @contextlib.contextmanager
+    def frame(self, index):
+        """
+        Attribute the stages of the calling thread to frame index; the whole block is recorded as stage 'view'.
+        """
+        previous = self.current_frame
+        self._local.frame = index
+        try:
+            with self.stage("view", frame=index):
+                yield
+        finally:
+            self._local.frame = previous
+
+    def start(self):
+        """
+        Restart the clock for the throughput figures, e.g. once the hardware is connected.
+        """
+        self._start = time.perf_counter()
+        self._end = None
+
+    def stop(self):
+        """
+        Mark the end of the run; summary() measures throughput up to here (default: up to the summary call).
+        """
+        self._end = time.perf_counter()
+
+    def summary(self):
+        with self._lock:
+            records = list(self._records)
+        wall_time = (self._end or time.perf_counter()) - self._start
+        durations = {}
+        for _, stage, _, duration, _ in records:
+            durations.setdefault(stage, []).append(duration)
+
+        stages = {}
+        for stage, values in durations.items():
+            values = np.array(values) * 1000
+            stages[stage] = {
+                "count": len(values),
+                "total_s": float(values.sum() / 1000),
+                "mean_ms": float(values.mean()),
+                **{f"p{p}_ms": float(np.percentile(values, p)) for p in PERCENTILES},
+                "max_ms": float(values.max()),
+            }
+
+        views = len({frame for frame, stage, _, _, _ in records if stage == "view"})
+        bytes_written = sum(nbytes for _, _, _, _, nbytes in records)
+        return {
+            "wall_time_s": wall_time,
+            "views": views,
+            "views_per_min": views / wall_time * 60 if wall_time > 0 else 0.0,
+            "bytes_written": bytes_written,
+            "mb_per_s": bytes_written / 1e6 / wall_time if wall_time > 0 else 0.0,
+            "stages": stages,
+        }
+
+    def frames(self):
+        """
+        Per-frame timings as {frame: {stage: milliseconds}}; repeated stages of a frame are summed.
+        """
+        frames = {}
+        with self._lock:
+            records = list(self._records)
+        for frame, stage, _, duration, _ in records:
+            if frame is None:
+                continue
+            timings = frames.setdefault(frame, {})
+            timings[stage] = timings.get(stage, 0.0) + duration * 1000
+        return frames
+
+    def save_json(self, path, **info):
+        """
+        Write summary, per-frame timings and run information (e.g. the config) to a JSON file.
+        """
+        report = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": git_commit(),
+            "host": platform.node(),
+            "python": platform.python_version(),
+            **info,
+            "summary": self.summary(),
+            "frames": [{"frame": frame, **timings} for frame, timings in sorted(self.frames().items())],
+        }
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+        return report
+
+
+class _NullProfiler:
+    """
+    Profiler that records nothing; the default of the controllers so that timing has no cost unless enabled.
+    """
+
+    current_frame = None
+
+    def record(self, stage, start, duration, frame=None, nbytes=0):
+        pass
+
+    def stage(self, name, frame=None, nbytes=0):
+        return contextlib.nullcontext()
+
+    def frame(self, index):
+        return contextlib.nullcontext()
+
+
+NULL_PROFILER = _NullProfiler()
+
+
+def git_commit():
+    """
+    Return the commit of the working tree, or None outside of a git checkout.
+    """
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def print_summary(summary, baseline=None):
+    """
+    Print the stage timings of a summary, with the change of the median against a baseline summary if given.
+    """
+    print(f"{summary['views']} views in {summary['wall_time_s']:.2f} s: "
+          f"{summary['views_per_min']:.1f} views/min, {summary['mb_per_s']:.1f} MB/s")
+    print(f"{'stage':<14}{'count':>7}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}  [ms]")
+    for stage, stats in sorted(summary["stages"].items(), key=lambda item: -item[1]["total_s"]):
+        line = (f"{stage:<14}{stats['count']:>7}{stats['mean_ms']:>10.2f}{stats['p50_ms']:>10.2f}"
+                f"{stats['p90_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}")
+        if baseline is not None and stage in baseline["stages"]:
+            line += f"  p50 {stats['p50_ms'] - baseline['stages'][stage]['p50_ms']:+.2f}"
+        print(line)
@@ -0,0 +1,116 @@
+# utils_acquisition/rig_scheduler.py
+
+import logging
+import multiprocessing
+import os
+import time
+
+from utils_acquisition.metrics import log_event
+from utils_acquisition.throttle import DiskThrottle
+
+
+class RigScheduler:
+    """
+    Runs the scans of several rigs at the same time, one process per rig:
+    - Each rig uses its own camera and Arduino, selected by camera_serial and arduino_port in its config.
+    - Separate processes keep the camera SDK instances apart and spread the image encoding over all cores.
+    - All rigs share one DiskThrottle, so together they stay within the disk bandwidth.
+    - At most max_parallel rigs run at once, the others wait for a free slot.
+    target(config, throttle) runs one rig; it has to be a module-level function so it can be started
+    in a new process.
+    """
+
+    def __init__(self, target, rig_configs, disk_bandwidth_mb_s=0.0, max_parallel=None):
+        self.validate(rig_configs)
+        self._target = target
+        self._rig_configs = list(rig_configs)
+        self._max_parallel = max_parallel or len(self._rig_configs)
+        # Spawned processes do not inherit threads or open camera handles from the scheduler
+        self._context = multiprocessing.get_context("spawn")
+        self.throttle = DiskThrottle(disk_bandwidth_mb_s, context=self._context) if disk_bandwidth_mb_s > 0 else None
+
+    @staticmethod
+    def rig_name(config, index):
+        return config.get("rig_name") or f"rig{index}"
+
+    @staticmethod
+    def output_locations(config):
+        """
+        Places a rig writes to, by name: the image directory, the dataset directory above it (journal,
+        transforms files and default reference frames), the segmentation output and the scan container.
+        """
+        locations = {}
+        if config.get("images_path"):
+            images_path = os.path.abspath(config["images_path"])
+            locations["images_path"] = images_path
+            locations["dataset directory"] = os.path.dirname(images_path)
+            if config.get("segment"):
+                locations["segmentation_path"] = os.path.abspath(config.get("segmentation_path")
+                                                                 or images_path + "_rgba")
+        if config.get("scan_container"):
+            locations["scan_container"] = os.path.abspath(config["scan_container"])
+        return locations
+
+    @staticmethod
+    def validate(rig_configs):
+        """
+        Make sure no two rigs would open the same camera or board, or write to the same place.
+        """
+        for key in ("camera_serial", "arduino_port"):
+            values = [config.get(key) for config in rig_configs if config.get(key)]
+            duplicates = {value for value in values if values.count(value) > 1}
+            if duplicates:
+                raise ValueError(f"Several rigs use the same {key}: {', '.join(sorted(duplicates))}")
+
+        # Any place written by more than one rig, also e.g. one rig's images_path as another one's dataset directory
+        users = {}
+        for index, config in enumerate(rig_configs):
+            for name, location in RigScheduler.output_locations(config).items():
+                users.setdefault(location, []).append(f"{RigScheduler.rig_name(config, index)} ({name})")
+        for location, rigs in sorted(users.items()):
+            if len(rigs) > 1:
+                raise ValueError(f"Several rigs write to {location}: {', '.join(rigs)}")
+        if len(rig_configs) > 1:
+            for index, config in enumerate(rig_configs):
+                if config.get("simulate"):
+                    continue
+                if not config.get("camera_serial") or not config.get("arduino_port"):
+                    raise ValueError(f"{RigScheduler.rig_name(config, index)}: camera_serial and arduino_port "
+                                     f"must be set when several rigs run at once.")
+
+    def run(self, poll_interval=0.5):
+        """
+        Run all rigs and return {rig name: exit code}.
+        """
+        pending = [(self.rig_name(config, index), config) for index, config in enumerate(self._rig_configs)]
+        running = {}
+        results = {}
+        try:
+            while pending or running:
+                while pending and len(running) < self._max_parallel:
+                    name, config = pending.pop(0)
+                    process = self._context.Process(target=self._target, args=(config, self.throttle), name=name)
+                    process.start()
+                    running[name] = process
+                    log_event("rig_started", f"Started {name} (pid {process.pid})", rig=name, pid=process.pid)
+
+                for name, process in list(running.items()):
+                    if process.is_alive():
+                        continue
+                    process.join()
+                    results[name] = process.exitcode
+                    del running[name]
+                    if process.exitcode == 0:
+                        log_event("rig_finished", f"{name} finished", rig=name)
+                    else:
+                        log_event("rig_failed", f"{name} failed with exit code {process.exitcode}", logging.ERROR,
+                                  rig=name, exitcode=process.exitcode)
+                time.sleep(poll_interval)
+        finally:
+            # Only reached with rigs still running if the scheduler itself is interrupted
+            for name, process in running.items():
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.terminate()
+                results[name] = process.exitcode
+        return results
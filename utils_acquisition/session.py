@@ -0,0 +1,238 @@
+# utils_acquisition/session.py
+
+import asyncio
+import functools
+import logging
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils_arduino.utils import estimate_move_time
+from utils_acquisition.metrics import log_event
+from utils_acquisition.stop import ScanStopped
+
+
+class ConsoleInput:
+    """
+    Lines typed on the console as an asyncio stream.
+    A daemon thread reads stdin, so waiting for the user neither blocks the event loop nor keeps
+    the process alive, and a pending prompt can be cancelled like any other task.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._lines = None
+        self._thread = None
+
+    def _read(self):
+        while True:
+            line = sys.stdin.readline()
+            try:
+                self._loop.call_soon_threadsafe(self._lines.put_nowait, line or None)
+            except RuntimeError:
+                return  # Event loop already closed
+            if not line:
+                return  # End of input
+
+    async def readline(self, prompt=""):
+        if self._thread is None:
+            self._loop = asyncio.get_running_loop()
+            self._lines = asyncio.Queue()
+            self._thread = threading.Thread(target=self._read, name="ConsoleInput", daemon=True)
+            self._thread.start()
+        if prompt:
+            print(prompt, end="", flush=True)
+        line = await self._lines.get()
+        if line is None:
+            raise EOFError("Console input has been closed.")
+        return line.rstrip("\n")
+
+
+class AcquisitionSession:
+    """
+    asyncio session owning the Arduino (motor and LED strip) and the camera:
+    - Every resource has a worker thread of its own. Blocking driver calls run there, so a resource is never
+      used from two places at once, while operations on different resources overlap (e.g. saving a frame
+      during a move).
+    - Waiting for a move, a trigger event or the user does not occupy a resource thread, so LED and
+      query commands still go through while the stage is moving.
+    - Cancelling a task stops it at its next await; close() stops a running scan, then waits for the running
+      move and pending writes.
+    Use it as `async with AcquisitionSession(open_arduino, open_camera) as session:`, where open_arduino and
+    open_camera are blocking callables returning a connected ArduinoController and camera controller.
+    """
+
+    def __init__(self, open_arduino=None, open_camera=None):
+        self._open_arduino = open_arduino
+        self._open_camera = open_camera
+        self.arduino = None
+        self.camera = None
+        self.console = ConsoleInput()
+        self._executors = {
+            name: ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"session-{name}")
+            for name in ("serial", "camera", "storage", "scan")
+        }
+        self._stop_event = threading.Event()
+        self._scan_future = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def _call(self, resource, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executors[resource], functools.partial(fn, *args, **kwargs))
+
+    async def open(self):
+        """
+        Connect the Arduino and open the camera concurrently.
+        """
+        openers = {}
+        if self._open_arduino is not None:
+            openers["arduino"] = self._call("serial", self._open_arduino)
+        if self._open_camera is not None:
+            openers["camera"] = self._call("camera", self._open_camera)
+        results = await asyncio.gather(*openers.values(), return_exceptions=True)
+        for name, result in zip(openers, results):
+            if not isinstance(result, BaseException):
+                setattr(self, name, result)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            await self.close()
+            raise errors[0]
+        log_event("session_opened", "Acquisition session opened", resources=list(openers))
+        return self
+
+    async def stop_scan(self):
+        """
+        Ask the running scan routine to stop and wait until its thread has returned.
+        """
+        if self._scan_future is None or self._scan_future.done():
+            return
+        self._stop_event.set()
+        try:
+            await asyncio.wrap_future(self._scan_future)
+        except ScanStopped:
+            pass
+        except Exception as error:
+            log_event("session_scan_error", f"Scan failed while stopping: {error}", logging.WARNING,
+                      error=str(error))
+
+    async def close(self):
+        """
+        Stop a running scan and wait for the running move and pending writes,
+        then release the Arduino and the camera.
+        """
+        await self.stop_scan()
+        if self.arduino is not None:
+            try:
+                await self.wait_for_motion(timeout=30)
+            except Exception as error:
+                log_event("session_motion_error", f"Motion did not complete while closing: {error}",
+                          logging.WARNING, error=str(error))
+            await self._call("serial", self.arduino.close)
+            self.arduino = None
+        if self.camera is not None:
+            try:
+                await self._call("storage", self.camera.flush)
+            finally:
+                await self._call("camera", self.camera.close)
+                self.camera = None
+        for executor in self._executors.values():
+            executor.shutdown(wait=False)
+        log_event("session_closed", "Acquisition session closed")
+
+    async def prompt(self, message=""):
+        """
+        Wait for the user to enter a line on the console.
+        """
+        return await self.console.readline(message)
+
+    async def run_scan(self, scan_fn, *args, **kwargs):
+        """
+        Run a blocking scan routine scan_fn(*args, camera_controller, motor_controller, stop_event=..., **kwargs)
+        (e.g. main.aquire_images) on the scan thread of the session; it drives the camera and the Arduino directly.
+        scan_fn has to return (or raise ScanStopped) soon after the threading.Event stop_event is set,
+        which close() does before it releases the Arduino and the camera.
+        """
+        self._scan_future = self._executors["scan"].submit(
+            functools.partial(scan_fn, *args, self.camera, self.arduino, stop_event=self._stop_event, **kwargs)
+        )
+        return await asyncio.wrap_future(self._scan_future)
+
+    # Motor
+
+    async def move(self, steps):
+        """
+        Rotate by steps (negative: backwards) and return the position once the stage has stopped.
+        """
+        if steps >= 0:
+            await self._call("serial", self.arduino.rotate_forwards, steps, wait=False)
+        else:
+            await self._call("serial", self.arduino.rotate_backwards, -steps, wait=False)
+        move_time = estimate_move_time(steps, self.arduino.motor_max_speed, self.arduino.motor_acceleration,
+                                       self.arduino.micro_stepping)
+        return await self.wait_for_motion(timeout=2 * move_time + 2)
+
+    async def wait_for_motion(self, timeout=None):
+        """
+        Wait until all queued moves have finished and return the position.
+        """
+        # The wait only blocks on the motion complete event, so it runs outside of the serial thread
+        return await asyncio.to_thread(self.arduino.wait_for_motion_complete, timeout)
+
+    async def position(self):
+        return await self._call("serial", self.arduino.get_position)
+
+    async def read_trigger_event(self, timeout=None):
+        return await asyncio.to_thread(self.arduino.read_trigger_event, timeout)
+
+    # LED strip
+
+    async def set_led_brightness(self, brightness):
+        await self._call("serial", self.arduino.set_led_brightness, brightness)
+
+    async def set_led_color(self, color_hex):
+        await self._call("serial", self.arduino.set_led_color, color_hex)
+
+    async def led_off(self):
+        await self._call("serial", self.arduino.led_off)
+
+    async def rainbow(self, seconds, wait=True):
+        """
+        Run the rainbow effect; the sketch animates it on its own, so the session stays responsive meanwhile.
+        """
+        await self._call("serial", self.arduino.start_rainbow, seconds)
+        if wait:
+            await asyncio.sleep(seconds)
+
+    # Camera
+
+    async def capture(self):
+        """
+        Trigger the camera and return the frame as a FrameSlot, which the caller must save or release.
+        """
+        return await self._call("camera", self.camera.capture_frame)
+
+    async def receive_frame(self):
+        return await self._call("camera", self.camera.receive_frame)
+
+    async def save(self, slot, filename):
+        """
+        Save a captured frame as a TIFF file and release it; runs on the storage thread.
+        """
+        await self._call("storage", self.camera.save_frame, slot, filename)
+
+    async def save_to_container(self, slot, container, **metadata):
+        await self._call("storage", self.camera.save_frame_to_container, slot, container, **metadata)
+
+    async def live_view(self, camera_controller, interval=0.02):
+        """
+        Run the Tkinter live view of a CameraController alongside the other tasks until its window is closed.
+        The CameraController must have been created on the event loop thread.
+        """
+        camera_controller.start_live_view(mainloop=False)
+        while camera_controller.process_gui_events():
+            await asyncio.sleep(interval)
@@ -0,0 +1,56 @@
+# utils_acquisition/stop.py
+
+import queue
+import time
+
+# Longest time a blocking wait goes without looking at its stop event
+STOP_POLL_S = 0.1
+
+
+class ScanStopped(Exception):
+    """The scan was asked to stop, e.g. because its session is closing."""
+
+
+def check_stop(stop_event):
+    """
+    Raise ScanStopped if stop_event (a threading.Event, or None) has been set.
+    """
+    if stop_event is not None and stop_event.is_set():
+        raise ScanStopped("The scan has been stopped.")
+
+
+def _slices(timeout, stop_event):
+    # Timeouts of the successive waits: short slices with a stop check in between, until timeout has passed
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        check_stop(stop_event)
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            return
+        yield STOP_POLL_S if remaining is None else min(STOP_POLL_S, remaining)
+
+
+def wait_event(event, timeout=None, stop_event=None):
+    """
+    Like event.wait(timeout), but raises ScanStopped as soon as stop_event is set.
+    """
+    if stop_event is None:
+        return event.wait(timeout)
+    for wait_s in _slices(timeout, stop_event):
+        if event.wait(wait_s):
+            return True
+    return event.is_set()
+
+
+def get_queue(source, timeout=None, stop_event=None):
+    """
+    Like source.get(timeout=timeout) of a queue.Queue, but raises ScanStopped as soon as stop_event is set.
+    """
+    if stop_event is None:
+        return source.get(timeout=timeout)
+    for wait_s in _slices(timeout, stop_event):
+        try:
+            return source.get(timeout=wait_s)
+        except queue.Empty:
+            pass
+    return source.get_nowait()
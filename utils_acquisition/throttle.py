@@ -0,0 +1,38 @@
+# utils_acquisition/throttle.py
+
+import multiprocessing
+import time
+
+
+class DiskThrottle:
+    """
+    Token bucket limiting the combined write bandwidth of several processes:
+    - The bucket state lives in shared memory, so one instance can be handed to every rig process.
+    - acquire(nbytes) reserves bandwidth before a write and sleeps if the budget is used up;
+      reservations are served in order, so no rig is starved by another.
+    - Up to burst_s seconds of unused bandwidth can be spent at once.
+    """
+
+    def __init__(self, bandwidth_mb_s, burst_s=0.5, context=None):
+        context = context or multiprocessing.get_context()
+        self.rate = bandwidth_mb_s * 1e6
+        self.capacity = self.rate * burst_s
+        self._lock = context.Lock()
+        self._tokens = context.Value('d', self.capacity, lock=False)
+        self._updated = context.Value('d', time.monotonic(), lock=False)
+
+    def acquire(self, nbytes):
+        """
+        Reserve nbytes of write bandwidth, sleeping until it is available. Returns the time slept in seconds.
+        """
+        with self._lock:
+            now = time.monotonic()
+            tokens = min(self.capacity, self._tokens.value + (now - self._updated.value) * self.rate)
+            # Reserve even if the bucket runs into debt; the debt is what this caller has to wait for
+            tokens -= nbytes
+            self._tokens.value = tokens
+            self._updated.value = now
+        delay = -tokens / self.rate if tokens < 0 else 0.0
+        if delay > 0:
+            time.sleep(delay)
+        return delay
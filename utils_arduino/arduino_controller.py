@@ -1,14 +1,34 @@
 # utils_arduino/arduino_controller.py
 
 import serial
+import struct
+import queue
+import threading
 import time
 # Import the utility functions from utils_motor.utils
-from utils_arduino.utils import find_arduino, check_arduino_cli, upload_sketch
+from utils_arduino.utils import (find_arduino, remember_arduino, check_arduino_cli, upload_sketch, build_macros,
+                                 firmware_hash, estimate_move_time, FIRMWARE_VERSION)
+from utils_arduino.serial_protocol import SerialLink, CommandError
+from utils_acquisition.profiler import NULL_PROFILER
+from utils_acquisition.metrics import REGISTRY, log_event
+from utils_acquisition.stop import get_queue
+
+# Must match PLAN_BUFFER_SIZE and PLAN_TRIGGER in the sketch
+PLAN_BUFFER_SIZE = 16
+PLAN_POINTS_PER_FRAME = 4
+PLAN_TRIGGER = 0x01
+
+MOTOR_MOVES = REGISTRY.counter("motor_moves_total", "Moves queued on the Arduino, by command.")
+MOTOR_WAIT = REGISTRY.histogram("motor_wait_seconds", "Time spent waiting for the motor to report motion complete.")
 
 class ArduinoController:
-    def __init__(self,config, sketch_path = "utils_arduino/scripts_arduino/serial_connector_arduino/serial_connector_arduino.ino"):
+    def __init__(self,config, sketch_path = "utils_arduino/scripts_arduino/serial_connector_arduino/serial_connector_arduino.ino",
+                 port=None, fqbn=None, profiler=None):
         """
         Initialize the MotorController with given parameters.
+        port selects the board if several are connected; the FQBN is looked up unless fqbn is given as well
+        (e.g. for a SimulatedArduino).
+        A StageProfiler records serial round trips and the time spent waiting for the motor.
         """
         try:
             self.steps_per_revolution_base = config["steps_per_revolution_base"]
@@ -21,9 +41,16 @@ class ArduinoController:
             pass
         self.sketch_path = sketch_path
 
+        self.baud_rate = config.get("serial_baud_rate", 115200)
         self.ser = None  # Serial connection
-        self.port = None  # Arduino port
-        self.fqbn = None  # Arduino Fully Qualified Board Name
+        self._link = None  # Binary protocol on top of the serial connection
+        self._last_motion = None  # Most recent move, completes after all earlier moves
+        self._plan_feeder = None  # Thread streaming the rest of a scan plan to the Arduino
+        self._plan_error = None
+        self.port = port  # Arduino port
+        self.fqbn = fqbn  # Arduino Fully Qualified Board Name
+        self._discover = port is None
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
 
         self.config = config
         self._validate_parameters()
@@ -37,57 +64,321 @@ class ArduinoController:
 
     def connect(self):
         """
-        Find the Arduino, upload the sketch, and establish a serial connection.
+        Find the Arduino, upload the sketch if the board does not already run this build,
+        and establish a serial connection.
         """
         if not self.sketch_path:
             raise ValueError("Sketch path must be provided to upload the Arduino sketch.")
 
-        check_arduino_cli()
-        self.port, self.fqbn = find_arduino()
-        print(f"Found Arduino on port {self.port} with FQBN {self.fqbn}")
-        upload_sketch(self.sketch_path, self.port, self.fqbn, self.config)
+        if self._discover:
+            self.port, self.fqbn = find_arduino()
+        elif self.fqbn is None:
+            self.port, self.fqbn = find_arduino(port=self.port)
+        log_event("arduino_found", f"Found Arduino on port {self.port} with FQBN {self.fqbn}", port=self.port, fqbn=self.fqbn)
+
+        # Ask the running firmware for its build hash before compiling and uploading anything
+        expected_hash = int(firmware_hash(self.sketch_path, self.fqbn, build_macros(self.sketch_path, self.config))[:8], 16)
+        firmware_info = self._open_serial()
 
-        time.sleep(2)  # Wait for the Arduino to reset after uploading
+        if firmware_info == (expected_hash, FIRMWARE_VERSION):
+            log_event("firmware_up_to_date", "Firmware on the board is up to date, skipping upload.",
+                      firmware_hash=f"{expected_hash:08x}")
+        else:
+            self._close_serial()
+            check_arduino_cli()
+            upload_sketch(self.sketch_path, self.port, self.fqbn, self.config)
+            if self._open_serial() is None:
+                raise TimeoutError("The Arduino did not respond after uploading the sketch.")
+
+        # Speed, acceleration and microstepping are configured at runtime rather than compiled in
+        self.apply_motor_parameters()
+        if self._discover:
+            remember_arduino(self.port, self.fqbn)
 
+    def reconnect(self):
+        """
+        Re-open the serial connection after a USB glitch, without uploading the sketch again.
+        Queued moves are lost when the board resets, so the stage position has to be re-established.
+        """
+        self._close_serial()
+        if self._discover:
+            self.port, self.fqbn = find_arduino()
+        if self._open_serial() is None:
+            raise TimeoutError("The Arduino did not respond after reconnecting.")
+        self._last_motion = None
+        self.apply_motor_parameters()
+
+    def _open_serial(self, timeout=3.0):
+        """
+        Open the serial connection and wait until the sketch answers.
+        Returns the firmware info, or None if the sketch did not answer within the timeout.
+        """
         # Set up the serial connection
-        self.ser = serial.Serial(self.port, 9600, timeout=1)
-        print("Initializing Arduino serial connection")
-        time.sleep(1)  # Wait for the connection to initialize
+        self.ser = serial.Serial(self.port, self.baud_rate, timeout=0.05)
+        log_event("serial_open", "Initializing Arduino serial connection", port=self.port, baud_rate=self.baud_rate)
+        self._link = SerialLink(self.ser)
+        self._link.start()
+
+        # Opening the port resets the Arduino; poll until the sketch has started instead of sleeping
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                return self.get_firmware_info()
+            except (TimeoutError, CommandError):
+                continue
+        return None
 
-    def _send_command(self, command, value=None):
+    def _close_serial(self):
+        if self._link:
+            self._link.close()
+            self._link = None
+        if self.ser:
+            self.ser.close()
+            self.ser = None
+
+    def get_firmware_info(self):
+        """
+        Return (build hash, protocol version) reported by the sketch running on the board.
+        """
+        build_hash, version = struct.unpack('<IH', self._send_command('I').reply)
+        return build_hash, version
+
+    def set_max_speed(self, speed):
+        """
+        Set the maximum motor speed in full steps per second.
+        """
+        self._send_command('V', struct.pack('<i', int(speed)))
+        self.motor_max_speed = int(speed)
+
+    def set_acceleration(self, acceleration):
+        """
+        Set the motor acceleration in full steps per second squared.
+        """
+        self._send_command('A', struct.pack('<i', int(acceleration)))
+        self.motor_acceleration = int(acceleration)
+
+    def set_microstepping(self, micro_stepping):
+        """
+        Set the microstepping level (1, 2, 4, 8 or 16). The Arduino applies it once all queued moves have finished.
+        Step counts and positions are in microsteps, so they change scale with this setting.
+        """
+        assert micro_stepping in [1, 2, 4, 8, 16], "Invalid microstepping value. Allowed values are [1, 2, 4, 8, 16]"
+        self._send_command('M', bytes([micro_stepping]))
+        self.micro_stepping = micro_stepping
+
+    def get_motor_parameters(self):
+        """
+        Read back the motor parameters active on the Arduino.
+        """
+        max_speed, acceleration, micro_stepping = struct.unpack('<iiB', self._send_command('G').reply)
+        return {
+            "motor_max_speed": max_speed,
+            "motor_acceleration": acceleration,
+            "micro_stepping": micro_stepping,
+        }
+
+    def apply_motor_parameters(self):
+        """
+        Send the configured microstepping, maximum speed and acceleration to the Arduino.
+        """
+        self.set_microstepping(self.micro_stepping)
+        self.set_max_speed(self.motor_max_speed)
+        self.set_acceleration(self.motor_acceleration)
+
+    def _send_command(self, command, payload=b'', wait=True):
         """
         Send a command to the Arduino over serial communication.
+        Returns the PendingCommand, acknowledged by the Arduino if wait is set.
         """
-        if value is not None:
-            full_command = f"{command}{value}\n"
-        else:
-            full_command = f"{command}\n"
-        self.ser.write(full_command.encode())
+        with self.profiler.stage("serial"):
+            pending = self._link.send(command, payload)
+            if wait:
+                pending.wait_ack()
+        return pending
+
+    def _estimate_move_time(self, steps):
+        """
+        Estimate the duration of a move in seconds from the trapezoidal AccelStepper profile.
+        """
+        return estimate_move_time(steps, self.motor_max_speed, self.motor_acceleration, self.micro_stepping)
 
-    def rotate_forwards(self, steps=None):
+    def _queue_motion(self, command, payload):
+        pending = self._send_command(command, payload)
+        MOTOR_MOVES.inc(command=command)
+        self._last_motion = pending
+        return pending
+
+    def wait_for_motion_complete(self, timeout=None, stop_event=None):
+        """
+        Block until the Arduino reports that the last move has finished.
+        Moves are executed in order, so all earlier moves have finished as well.
+        Returns the absolute stepper position reported by the sketch.
+        A set stop_event ends the wait early with ScanStopped.
+        """
+        if self._last_motion is None:
+            return self.get_position()
+        with self.profiler.stage("motor"), MOTOR_WAIT.time():
+            position = self._last_motion.wait_done(timeout, stop_event)
+        if self._plan_feeder is not None:
+            self._plan_feeder.join()
+            self._plan_feeder = None
+        if self._plan_error is not None:
+            error, self._plan_error = self._plan_error, None
+            raise error
+        return position
+
+    def rotate_forwards(self, steps=None, wait=True, stop_event=None):
         """
         Rotate the motor by a specified number of steps.
+        If wait is set, block until the sketch acknowledges that the stage has stopped (or stop_event is set).
+        Otherwise the move is queued on the Arduino and the call returns once it has been accepted.
         #TODO: Restructure this class/remove this function
         """
         if steps is None:
             steps = self.steps_per_revolution_base * self.micro_stepping * self.revolutions
-        self._send_command('F', value=steps)
+        duration = self._estimate_move_time(steps)
+        pending = self._queue_motion('F', struct.pack('<i', int(steps)))
         #print(f"Motor rotating forwards by {steps} steps, equal to {self.revolutions/40:.2f} rotations of the camera, \n equal to {self.revolutions} revolutions, with micro stepping of size 1/{self.micro_stepping} ")
+        if wait:
+            with self.profiler.stage("motor"), MOTOR_WAIT.time():
+                return pending.wait_done(timeout=2 * duration + 2, stop_event=stop_event)
 
-    def rotate_backwards(self, steps=None):
+    def rotate_backwards(self, steps=None, wait=True):
         """
         Rotate the motor by a specified number of steps.
+        If wait is set, block until the sketch acknowledges that the stage has stopped.
         #TODO: Restructure this class/remove this function
         """
         if steps is None:
             steps = self.steps_per_revolution_base * self.micro_stepping * self.revolutions
-        self._send_command('B', value=steps)
+        duration = self._estimate_move_time(steps)
+        pending = self._queue_motion('B', struct.pack('<i', int(steps)))
+        if wait:
+            with self.profiler.stage("motor"), MOTOR_WAIT.time():
+                return pending.wait_done(timeout=2 * duration + 2)
+
+    def start_continuous_scan(self, total_steps, n_triggers, speed=None):
+        """
+        Rotate by total_steps at constant speed (steps per second, default set_motor_speed)
+        and let the sketch trigger the camera at n_triggers evenly spaced positions.
+        Returns the expected duration; use read_trigger_event() and wait_for_motion_complete().
+        """
+        if speed is None:
+            speed = self.set_motor_speed * self.micro_stepping
+        duration = abs(total_steps) / speed
+        self._queue_motion('S', struct.pack('<iii', int(total_steps), int(n_triggers), int(speed)))
+        return duration
+
+    def read_trigger_event(self, timeout=None, stop_event=None):
+        """
+        Wait for the next camera trigger reported by a continuous scan.
+        Returns (view index, stepper position, Arduino timestamp in microseconds).
+        A set stop_event ends the wait early with ScanStopped.
+        """
+        try:
+            return get_queue(self._link.trigger_events, timeout, stop_event)
+        except queue.Empty:
+            raise TimeoutError("Arduino did not report a camera trigger within the timeout period.")
+
+    def _send_plan_points(self, points):
+        # Up to 4 points of 7 bytes fit into one frame; a full plan buffer is retried until points have been run
+        for i in range(0, len(points), PLAN_POINTS_PER_FRAME):
+            payload = b''.join(struct.pack('<iHB', *point) for point in points[i:i + PLAN_POINTS_PER_FRAME])
+            self._send_command('P', payload)
+
+    def _feed_plan(self, points):
+        try:
+            self._send_plan_points(points)
+        except Exception as error:
+            self._plan_error = error
+
+    def start_plan(self, positions, dwell_ms=0, hold_ms=0, trigger=True):
+        """
+        Run a whole scan plan on the Arduino: move to each absolute position, wait dwell_ms,
+        pulse the camera trigger (if trigger is set) and hold for hold_ms before the next move.
+        The first points are uploaded before the plan starts, the rest is streamed in the background.
+        Returns the expected duration; use read_trigger_event(), read_plan_progress() and wait_for_motion_complete().
+        """
+        flags = PLAN_TRIGGER if trigger else 0
+        points = [(int(position), int(dwell_ms), flags) for position in positions]
+        previous = self.get_position()
+        self._send_command('K')
+        self._send_plan_points(points[:PLAN_BUFFER_SIZE])
+        self._queue_motion('X', struct.pack('<iH', len(points), int(hold_ms)))
+        if len(points) > PLAN_BUFFER_SIZE:
+            self._plan_feeder = threading.Thread(target=self._feed_plan, args=(points[PLAN_BUFFER_SIZE:],), daemon=True)
+            self._plan_feeder.start()
+
+        duration = 0.0
+        for position, _, _ in points:
+            duration += self._estimate_move_time(position - previous) + (dwell_ms + hold_ms) / 1000
+            previous = position
+        return duration
+
+    def read_plan_progress(self, timeout=None):
+        """
+        Wait until the next plan point has been completed.
+        Returns (point index, stepper position, Arduino timestamp in microseconds).
+        """
+        try:
+            return self._link.plan_events.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("Arduino did not report plan progress within the timeout period.")
+
+    def return_to_start(self, start_position, steps_per_turn, wait=True):
+        """
+        Rotate back to the angle of start_position along the shorter direction,
+        e.g. not at all after a full 360 degree scan.
+        """
+        offset = (self.wait_for_motion_complete() - start_position) % steps_per_turn
+        if offset == 0:
+            return start_position
+        if offset > steps_per_turn / 2:
+            return self.rotate_forwards(steps_per_turn - offset, wait=wait)
+        return self.rotate_backwards(offset, wait=wait)
+
+    def get_position(self):
+        """
+        Return the absolute stepper position.
+        """
+        position, moving, queued = struct.unpack('<iBB', self._send_command('Q').reply)
+        return position
+
+    def is_moving(self):
+        """
+        Return True while a move is running or queued on the Arduino.
+        """
+        position, moving, queued = struct.unpack('<iBB', self._send_command('Q').reply)
+        return bool(moving or queued)
+
+    def set_led_brightness(self, brightness):
+        """
+        Turn the whole LED strip on in white with the given brightness (0-255).
+        """
+        self._send_command('L', bytes([max(0, min(255, int(brightness)))]))
+
+    def set_led_color(self, color_hex):
+        """
+        Set the whole LED strip to a color given as RRGGBB.
+        """
+        self._send_command('C', bytes.fromhex(color_hex))
+
+    def led_off(self):
+        """
+        Turn the LED strip off.
+        """
+        self._send_command('O')
+
+    def start_rainbow(self, seconds=10):
+        """
+        Run the rainbow effect on the LED strip for the given number of seconds.
+        """
+        self._send_command('R', struct.pack('<i', int(seconds)))
 
     def close(self):
         """
         Close the serial connection to the Arduino.
         """
         if self.ser:
-            self.ser.close()
-            print("Serial connection closed.")
-
+            self._close_serial()
+            log_event("serial_closed", "Serial connection closed.", port=self.port)
@@ -13,6 +13,10 @@
 #define msc2 9
 #define msc3 10
 
+// Camera trigger output (connect to the TSI camera's trigger input)
+#define triggerPin 7
+#define triggerPulseUs 100
+
 // LED Strip Configuration
 #define LED_PIN 6
 #define LED_COUNT 60
@@ -35,6 +39,16 @@ Adafruit_NeoPixel strip = Adafruit_NeoPixel(LED_COUNT, LED_PIN, NEO_GRB + NEO_KH
 #define MOTOR_ACCELERATION 1600
 #endif
 
+#ifndef SERIAL_BAUD_RATE
+#define SERIAL_BAUD_RATE 115200
+#endif
+
+// Content hash of the build, set by utils.upload_sketch, and protocol version (FIRMWARE_VERSION in utils.py)
+#ifndef FIRMWARE_HASH
+#define FIRMWARE_HASH 0UL
+#endif
+#define FIRMWARE_VERSION 2
+
 long stepsPerRevolutionBase = STEPS_PER_REVOLUTION_BASE;
 long microstepping = MICRO_STEPPING;
 long maxSpeed = MOTOR_MAX_SPEED;
@@ -43,6 +57,80 @@ long acceleration = MOTOR_ACCELERATION;
 // Create a new instance of the AccelStepper class:
 AccelStepper stepper = AccelStepper(motorInterfaceType, stepPin, dirPin);
 
+// Binary serial protocol (see utils_arduino/serial_protocol.py):
+//   request: 0xA5 | seq | command | length | payload | crc8
+//   reply:   0x5A | seq | code    | length | payload | crc8
+// The CRC-8 (polynomial 0x07) covers everything after the sync byte.
+// Lines of plain text ("F12800\n", "L255\n", ...) are still accepted and handled with seq 0.
+#define REQUEST_SYNC 0xA5
+#define REPLY_SYNC 0x5A
+#define MAX_PAYLOAD 32
+
+#define STATUS_OK 0x00
+#define STATUS_CRC_ERROR 0x01
+#define STATUS_UNKNOWN_COMMAND 0x02
+#define STATUS_BAD_PAYLOAD 0x03
+#define STATUS_BUSY 0x04
+#define EVENT_MOTION_DONE 0x10
+#define EVENT_TRIGGER 0x11
+#define EVENT_PLAN_PROGRESS 0x12
+
+enum ParserState { WAIT_SYNC, READ_SEQ, READ_COMMAND, READ_LENGTH, READ_PAYLOAD, READ_CRC };
+ParserState parserState = WAIT_SYNC;
+uint8_t frameSeq, frameCommand, frameLength, frameIndex, frameCrc;
+uint8_t framePayload[MAX_PAYLOAD];
+
+char asciiLine[32];
+uint8_t asciiLength = 0;
+
+// Recently executed sequence numbers, so that retransmitted requests are acknowledged but not executed twice
+#define SEQ_HISTORY_SIZE 8
+uint8_t seqHistory[SEQ_HISTORY_SIZE];
+uint8_t seqHistoryIndex = 0;
+
+// Queue of moves, so the host can send the next move (or LED commands) while the stage is still moving
+#define MOVE_RELATIVE 0
+#define MOVE_SCAN 1
+#define MOVE_PLAN 2
+#define MOVE_QUEUE_SIZE 4
+struct Move {
+  uint8_t seq;
+  uint8_t type;
+  long steps;  // MOVE_RELATIVE, MOVE_SCAN: relative steps
+  long count;  // MOVE_SCAN: number of triggers, MOVE_PLAN: number of plan points
+  long param;  // MOVE_SCAN: constant speed, MOVE_PLAN: hold time in ms after each trigger
+};
+Move moveQueue[MOVE_QUEUE_SIZE];
+uint8_t moveQueueHead = 0;
+uint8_t moveQueueCount = 0;
+bool moving = false;
+Move currentMove;
+long scanStart = 0;
+long scanNextIndex = 0;
+
+// Scan plan: absolute positions streamed by the host into a small ring buffer and executed without host round trips
+#define PLAN_BUFFER_SIZE 16
+#define PLAN_TRIGGER 0x01
+struct PlanPoint {
+  long position;
+  uint16_t dwellMs;  // Settle time after arriving, before the trigger
+  uint8_t flags;
+};
+PlanPoint planBuffer[PLAN_BUFFER_SIZE];
+uint8_t planHead = 0;
+uint8_t planCount = 0;
+long planIndex = 0;
+enum PlanPhase { PLAN_NEXT, PLAN_MOVING, PLAN_SETTLING, PLAN_HOLDING };
+PlanPhase planPhase = PLAN_NEXT;
+PlanPoint planPoint;
+unsigned long planPhaseStart = 0;
+
+// Non-blocking rainbow effect
+bool rainbowActive = false;
+unsigned long rainbowEnd = 0;
+unsigned long rainbowLastUpdate = 0;
+uint8_t rainbowStep = 0;
+
 void setMicrostepping(int microsteps) {
   if (microsteps == 1) {
     digitalWrite(msc1, LOW);
@@ -67,13 +155,8 @@ void setMicrostepping(int microsteps) {
   }
 }
 
-void setup() {
-  Serial.begin(9600);
-  // Initialize microstepping pins:
-  pinMode(msc1, OUTPUT);
-  pinMode(msc2, OUTPUT);
-  pinMode(msc3, OUTPUT);
-
+// Apply microstepping, maximum speed and acceleration (in full steps per second) to the driver and stepper
+void applyMotorParameters() {
   // Set microstepping:
   setMicrostepping(microstepping);
 
@@ -84,6 +167,18 @@ void setup() {
   if (maxSpeed != 0) {
     stepper.setMaxSpeed(maxSpeed * microstepping);
   }
+}
+
+void setup() {
+  Serial.begin(SERIAL_BAUD_RATE);
+  // Initialize microstepping pins:
+  pinMode(msc1, OUTPUT);
+  pinMode(msc2, OUTPUT);
+  pinMode(msc3, OUTPUT);
+  pinMode(triggerPin, OUTPUT);
+  digitalWrite(triggerPin, LOW);
+
+  applyMotorParameters();
 
   // Initialize LED strip
   strip.begin();
@@ -91,16 +186,6 @@ void setup() {
   strip.show();
 }
 
-void rainbowEffect(int wait) {
-  for (int j = 0; j < 256; j++) { // Full cycle of colors
-    for (int i = 0; i < strip.numPixels(); i++) {
-      strip.setPixelColor(i, wheel((i + j) & 255));
-    }
-    strip.show();
-    delay(wait);
-  }
-}
-
 uint32_t wheel(byte wheelPos) {
   wheelPos = 255 - wheelPos;
   if (wheelPos < 85) {
@@ -114,54 +199,422 @@ uint32_t wheel(byte wheelPos) {
   return strip.Color(wheelPos * 3, 255 - wheelPos * 3, 0);
 }
 
-void loop() {
-  if (Serial.available() > 0) {
-    String inputString = Serial.readStringUntil('\n');
-    char command = inputString.charAt(0);
-    String valueString = inputString.substring(1);
-    long value = valueString.toInt();
-
-    // Motor Control Commands
-    if (command == 'F') {
-      stepper.moveTo(stepper.currentPosition() + value);
-      stepper.runToPosition();
-    } else if (command == 'B') {
-      stepper.moveTo(stepper.currentPosition() - value);
-      stepper.runToPosition();
+void fillStrip(uint8_t r, uint8_t g, uint8_t b) {
+  for (int i = 0; i < LED_COUNT; i++) {
+    strip.setPixelColor(i, strip.Color(r, g, b));
+  }
+  strip.show();
+}
+
+// Advance the rainbow effect by one color step every 20 ms
+void updateRainbow() {
+  if (!rainbowActive || millis() - rainbowLastUpdate < 20) {
+    return;
+  }
+  rainbowLastUpdate = millis();
+  if ((long)(rainbowLastUpdate - rainbowEnd) >= 0) {
+    rainbowActive = false;
+    fillStrip(0, 0, 0); // Clear after rainbow
+    return;
+  }
+  for (int i = 0; i < strip.numPixels(); i++) {
+    strip.setPixelColor(i, wheel((i + rainbowStep) & 255));
+  }
+  strip.show();
+  rainbowStep++;
+}
+
+uint8_t crc8(uint8_t crc, uint8_t data) {
+  crc ^= data;
+  for (uint8_t i = 0; i < 8; i++) {
+    crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : crc << 1;
+  }
+  return crc;
+}
+
+void sendReply(uint8_t seq, uint8_t code, const uint8_t *payload, uint8_t length) {
+  uint8_t header[4] = {REPLY_SYNC, seq, code, length};
+  uint8_t crc = 0;
+  for (uint8_t i = 1; i < 4; i++) {
+    crc = crc8(crc, header[i]);
+  }
+  for (uint8_t i = 0; i < length; i++) {
+    crc = crc8(crc, payload[i]);
+  }
+  Serial.write(header, 4);
+  Serial.write(payload, length);
+  Serial.write(crc);
+}
+
+void putLong(uint8_t *buffer, long value) {
+  memcpy(buffer, &value, 4); // AVR is little endian, like the protocol
+}
+
+long getLong(const uint8_t *buffer) {
+  long value;
+  memcpy(&value, buffer, 4);
+  return value;
+}
+
+// Tell the host that a move has finished, e.g. "D12800" for text commands
+void reportMotionDone(uint8_t seq) {
+  if (seq == 0) {
+    Serial.print('D');
+    Serial.println(stepper.currentPosition());
+    return;
+  }
+  uint8_t payload[4];
+  putLong(payload, stepper.currentPosition());
+  sendReply(seq, EVENT_MOTION_DONE, payload, 4);
+}
+
+// Pulse the camera trigger and report the view index, step position and time, e.g. "T3,3840,1234567"
+void triggerCamera(uint8_t seq, long index) {
+  digitalWrite(triggerPin, HIGH);
+  unsigned long triggerTime = micros();
+  delayMicroseconds(triggerPulseUs);
+  digitalWrite(triggerPin, LOW);
+  if (seq == 0) {
+    Serial.print('T');
+    Serial.print(index);
+    Serial.print(',');
+    Serial.print(stepper.currentPosition());
+    Serial.print(',');
+    Serial.println(triggerTime);
+    return;
+  }
+  uint8_t payload[12];
+  putLong(payload, index);
+  putLong(payload + 4, stepper.currentPosition());
+  putLong(payload + 8, (long)triggerTime);
+  sendReply(seq, EVENT_TRIGGER, payload, 12);
+}
+
+void startNextMove() {
+  currentMove = moveQueue[moveQueueHead];
+  moveQueueHead = (moveQueueHead + 1) % MOVE_QUEUE_SIZE;
+  moveQueueCount--;
+  moving = true;
+  stepper.moveTo(stepper.currentPosition() + currentMove.steps);
+  if (currentMove.type == MOVE_SCAN) {
+    // Rotate at a constant speed and trigger the camera at count evenly spaced positions
+    scanStart = stepper.currentPosition();
+    scanNextIndex = 0;
+    stepper.setSpeed(currentMove.steps < 0 ? -currentMove.param : currentMove.param);
+  } else if (currentMove.type == MOVE_PLAN) {
+    planIndex = 0;
+    planPhase = PLAN_NEXT;
+  }
+}
+
+// Report that a plan point has been completed (after its dwell and trigger)
+void reportPlanProgress(uint8_t seq, long index) {
+  uint8_t payload[12];
+  putLong(payload, index);
+  putLong(payload + 4, stepper.currentPosition());
+  putLong(payload + 8, (long)micros());
+  sendReply(seq, EVENT_PLAN_PROGRESS, payload, 12);
+}
+
+// Advance the scan plan; returns false once all plan points have been completed
+bool runPlan() {
+  switch (planPhase) {
+    case PLAN_NEXT:
+      if (planIndex >= currentMove.count) return false;
+      if (planCount == 0) return true; // Wait for the host to stream more points
+      planPoint = planBuffer[planHead];
+      planHead = (planHead + 1) % PLAN_BUFFER_SIZE;
+      planCount--;
+      stepper.moveTo(planPoint.position);
+      planPhase = PLAN_MOVING;
+      return true;
+    case PLAN_MOVING:
+      if (stepper.run()) return true;
+      planPhase = PLAN_SETTLING;
+      planPhaseStart = millis();
+      return true;
+    case PLAN_SETTLING:
+      if (millis() - planPhaseStart < planPoint.dwellMs) return true;
+      if (planPoint.flags & PLAN_TRIGGER) triggerCamera(currentMove.seq, planIndex);
+      planPhase = PLAN_HOLDING;
+      planPhaseStart = millis();
+      return true;
+    case PLAN_HOLDING:
+      if ((planPoint.flags & PLAN_TRIGGER) && millis() - planPhaseStart < (unsigned long)currentMove.param) return true;
+      reportPlanProgress(currentMove.seq, planIndex);
+      planIndex++;
+      planPhase = PLAN_NEXT;
+      return true;
+  }
+  return false;
+}
+
+// Advance the current move by at most one step; called on every loop iteration
+void runMotor() {
+  if (!moving) {
+    if (moveQueueCount > 0) {
+      startNextMove();
+    }
+    return;
+  }
+  if (currentMove.type == MOVE_SCAN) {
+    if (scanNextIndex < currentMove.count
+        && abs(stepper.currentPosition() - scanStart) >= abs(scanNextIndex * currentMove.steps / currentMove.count)) {
+      triggerCamera(currentMove.seq, scanNextIndex);
+      scanNextIndex++;
+    }
+    if (stepper.distanceToGo() != 0) {
+      stepper.runSpeedToPosition();
+      return;
     }
+    if (scanNextIndex < currentMove.count) {
+      return;
+    }
+  } else if (currentMove.type == MOVE_PLAN) {
+    if (runPlan()) {
+      return;
+    }
+  } else if (stepper.run()) {
+    return;
+  }
+  moving = false;
+  reportMotionDone(currentMove.seq);
+}
 
-    // LED Strip Control Commands
-    else if (command == 'L') { // Turn on entire LED strip with specified brightness (0-255)
-      uint8_t brightness = constrain(value, 0, 255);
-      strip.setBrightness(brightness);
-      for (int i = 0; i < LED_COUNT; i++) {
-        strip.setPixelColor(i, strip.Color(255, 255, 255)); // Default to white color
-      }
-      strip.show();
-    } else if (command == 'O') { // Turn off entire LED strip
-      for (int i = 0; i < LED_COUNT; i++) {
-        strip.setPixelColor(i, strip.Color(0, 0, 0));
-      }
-      strip.show();
-    } else if (command == 'C') { // Set color of entire LED strip (RRGGBB format)
-      long colorValue = strtol(valueString.c_str(), NULL, 16);
-      uint8_t r = (colorValue >> 16) & 0xFF;
-      uint8_t g = (colorValue >> 8) & 0xFF;
-      uint8_t b = colorValue & 0xFF;
-      for (int i = 0; i < LED_COUNT; i++) {
-        strip.setPixelColor(i, strip.Color(r, g, b));
+uint8_t queueMove(uint8_t seq, uint8_t type, long steps, long count, long param) {
+  if (moveQueueCount >= MOVE_QUEUE_SIZE) {
+    return STATUS_BUSY;
+  }
+  Move &move = moveQueue[(moveQueueHead + moveQueueCount) % MOVE_QUEUE_SIZE];
+  move.seq = seq;
+  move.type = type;
+  move.steps = steps;
+  move.count = count;
+  move.param = param;
+  moveQueueCount++;
+  return STATUS_OK;
+}
+
+// Execute one command; the reply payload (if any) is written to reply and its length to replyLength
+uint8_t executeCommand(uint8_t seq, uint8_t command, const uint8_t *payload, uint8_t length,
+                       uint8_t *reply, uint8_t &replyLength) {
+  replyLength = 0;
+
+  // Motor Control Commands
+  if (command == 'F' || command == 'B') { // Relative move by int32 steps
+    if (length != 4) return STATUS_BAD_PAYLOAD;
+    long steps = getLong(payload);
+    return queueMove(seq, MOVE_RELATIVE, command == 'F' ? steps : -steps, 0, 0);
+  } else if (command == 'S') { // Continuous scan: int32 total steps, int32 number of triggers, int32 speed
+    if (length != 12) return STATUS_BAD_PAYLOAD;
+    long nTriggers = getLong(payload + 4);
+    long speed = getLong(payload + 8);
+    if (nTriggers <= 0 || speed <= 0) return STATUS_BAD_PAYLOAD;
+    return queueMove(seq, MOVE_SCAN, getLong(payload), nTriggers, speed);
+  } else if (command == 'I') { // Firmware info: uint32 build hash, uint16 version
+    putLong(reply, (long)FIRMWARE_HASH);
+    reply[4] = FIRMWARE_VERSION & 0xFF;
+    reply[5] = FIRMWARE_VERSION >> 8;
+    replyLength = 6;
+    return STATUS_OK;
+  } else if (command == 'P') { // Append plan points: n x (int32 absolute position, uint16 dwell ms, uint8 flags)
+    if (length == 0 || length % 7 != 0) return STATUS_BAD_PAYLOAD;
+    uint8_t n = length / 7;
+    if (planCount + n > PLAN_BUFFER_SIZE) return STATUS_BUSY;
+    for (uint8_t i = 0; i < n; i++) {
+      PlanPoint &point = planBuffer[(planHead + planCount) % PLAN_BUFFER_SIZE];
+      point.position = getLong(payload + 7 * i);
+      point.dwellMs = payload[7 * i + 4] | (payload[7 * i + 5] << 8);
+      point.flags = payload[7 * i + 6];
+      planCount++;
+    }
+    reply[0] = PLAN_BUFFER_SIZE - planCount; // Free plan slots
+    replyLength = 1;
+    return STATUS_OK;
+  } else if (command == 'K') { // Clear the plan buffer
+    if (moving && currentMove.type == MOVE_PLAN) return STATUS_BUSY;
+    planHead = 0;
+    planCount = 0;
+    return STATUS_OK;
+  } else if (command == 'X') { // Run a plan: int32 number of points, uint16 hold time in ms after each trigger
+    if (length != 6 || getLong(payload) <= 0) return STATUS_BAD_PAYLOAD;
+    return queueMove(seq, MOVE_PLAN, 0, getLong(payload), payload[4] | (payload[5] << 8));
+  } else if (command == 'V') { // Set maximum speed: int32 full steps per second
+    if (length != 4 || getLong(payload) <= 0) return STATUS_BAD_PAYLOAD;
+    maxSpeed = getLong(payload);
+    applyMotorParameters();
+    return STATUS_OK;
+  } else if (command == 'A') { // Set acceleration: int32 full steps per second squared
+    if (length != 4 || getLong(payload) <= 0) return STATUS_BAD_PAYLOAD;
+    acceleration = getLong(payload);
+    applyMotorParameters();
+    return STATUS_OK;
+  } else if (command == 'M') { // Set microstepping: uint8 1, 2, 4, 8 or 16
+    if (length != 1) return STATUS_BAD_PAYLOAD;
+    uint8_t microsteps = payload[0];
+    if (microsteps != 1 && microsteps != 2 && microsteps != 4 && microsteps != 8 && microsteps != 16) {
+      return STATUS_BAD_PAYLOAD;
+    }
+    if (moving || moveQueueCount > 0) return STATUS_BUSY; // Only change the step size at rest
+    microstepping = microsteps;
+    applyMotorParameters();
+    return STATUS_OK;
+  } else if (command == 'G') { // Get motor parameters: int32 max speed, int32 acceleration, uint8 microstepping
+    putLong(reply, maxSpeed);
+    putLong(reply + 4, acceleration);
+    reply[8] = microstepping;
+    replyLength = 9;
+    return STATUS_OK;
+  } else if (command == 'Q') { // Query: int32 position, uint8 moving, uint8 queued moves
+    putLong(reply, stepper.currentPosition());
+    reply[4] = moving;
+    reply[5] = moveQueueCount;
+    replyLength = 6;
+    return STATUS_OK;
+  }
+
+  // LED Strip Control Commands
+  else if (command == 'L') { // Turn on entire LED strip with specified brightness (0-255)
+    if (length != 1) return STATUS_BAD_PAYLOAD;
+    rainbowActive = false;
+    strip.setBrightness(payload[0]);
+    fillStrip(255, 255, 255); // Default to white color
+    return STATUS_OK;
+  } else if (command == 'O') { // Turn off entire LED strip
+    rainbowActive = false;
+    fillStrip(0, 0, 0);
+    return STATUS_OK;
+  } else if (command == 'C') { // Set color of entire LED strip (r, g, b)
+    if (length != 3) return STATUS_BAD_PAYLOAD;
+    rainbowActive = false;
+    fillStrip(payload[0], payload[1], payload[2]);
+    return STATUS_OK;
+  } else if (command == 'R') { // Activate rainbow effect for int32 seconds
+    if (length != 4) return STATUS_BAD_PAYLOAD;
+    long duration = getLong(payload) > 0 ? getLong(payload) : 10; // Default duration is 10 seconds
+    rainbowActive = true;
+    rainbowEnd = millis() + duration * 1000;
+    return STATUS_OK;
+  }
+  return STATUS_UNKNOWN_COMMAND;
+}
+
+// Queries are answered again for retransmitted requests, other commands are not executed twice
+bool isQuery(uint8_t command) {
+  return command == 'Q' || command == 'I' || command == 'G';
+}
+
+bool isRepeatedSeq(uint8_t seq) {
+  for (uint8_t i = 0; i < SEQ_HISTORY_SIZE; i++) {
+    if (seqHistory[i] == seq) return true;
+  }
+  return false;
+}
+
+void handleFrame() {
+  uint8_t reply[MAX_PAYLOAD];
+  uint8_t replyLength = 0;
+  uint8_t status;
+  if (!isQuery(frameCommand) && isRepeatedSeq(frameSeq)) {
+    // The acknowledgement got lost and the host retransmitted; do not execute twice
+    status = STATUS_OK;
+  } else {
+    status = executeCommand(frameSeq, frameCommand, framePayload, frameLength, reply, replyLength);
+    if (status == STATUS_OK) {
+      seqHistory[seqHistoryIndex] = frameSeq;
+      seqHistoryIndex = (seqHistoryIndex + 1) % SEQ_HISTORY_SIZE;
+    }
+  }
+  sendReply(frameSeq, status, reply, replyLength);
+}
+
+// Translate a line of text ("F12800", "S128000,100,1600", "C00FF00", ...) into a command with seq 0
+void handleAsciiLine() {
+  asciiLine[asciiLength] = '\0';
+  char command = asciiLine[0];
+  char *valueString = asciiLine + 1;
+  long value = atol(valueString);
+  uint8_t payload[12];
+  uint8_t length = 0;
+  uint8_t reply[MAX_PAYLOAD];
+  uint8_t replyLength;
+
+  if (command == 'F' || command == 'B' || command == 'R') {
+    putLong(payload, value);
+    length = 4;
+  } else if (command == 'S') {
+    char *nTriggers = strchr(valueString, ',');
+    char *speed = nTriggers ? strchr(nTriggers + 1, ',') : NULL;
+    if (!speed) return;
+    putLong(payload, value);
+    putLong(payload + 4, atol(nTriggers + 1));
+    putLong(payload + 8, atol(speed + 1));
+    length = 12;
+  } else if (command == 'L') {
+    payload[0] = constrain(value, 0, 255);
+    length = 1;
+  } else if (command == 'C') {
+    long colorValue = strtol(valueString, NULL, 16);
+    payload[0] = (colorValue >> 16) & 0xFF;
+    payload[1] = (colorValue >> 8) & 0xFF;
+    payload[2] = colorValue & 0xFF;
+    length = 3;
+  }
+  executeCommand(0, command, payload, length, reply, replyLength);
+}
+
+void handleByte(uint8_t data) {
+  switch (parserState) {
+    case WAIT_SYNC:
+      if (data == REQUEST_SYNC && asciiLength == 0) {
+        parserState = READ_SEQ;
+      } else if (data == '\n' || data == '\r') {
+        if (asciiLength > 0) handleAsciiLine();
+        asciiLength = 0;
+      } else if (asciiLength < sizeof(asciiLine) - 1) {
+        asciiLine[asciiLength++] = data;
       }
-      strip.show();
-    } else if (command == 'R') { // Activate rainbow effect
-      int duration = value > 0 ? value : 10; // Default duration is 10 seconds
-      unsigned long startTime = millis();
-      while (millis() - startTime < duration * 1000) {
-        rainbowEffect(20); // Adjust speed with delay (in ms)
+      break;
+    case READ_SEQ:
+      frameSeq = data;
+      frameCrc = crc8(0, data);
+      parserState = READ_COMMAND;
+      break;
+    case READ_COMMAND:
+      frameCommand = data;
+      frameCrc = crc8(frameCrc, data);
+      parserState = READ_LENGTH;
+      break;
+    case READ_LENGTH:
+      frameLength = data;
+      frameCrc = crc8(frameCrc, data);
+      frameIndex = 0;
+      if (frameLength > MAX_PAYLOAD) {
+        parserState = WAIT_SYNC;
+      } else {
+        parserState = frameLength > 0 ? READ_PAYLOAD : READ_CRC;
       }
-      for (int i = 0; i < LED_COUNT; i++) {
-        strip.setPixelColor(i, strip.Color(0, 0, 0)); // Clear after rainbow
+      break;
+    case READ_PAYLOAD:
+      framePayload[frameIndex++] = data;
+      frameCrc = crc8(frameCrc, data);
+      if (frameIndex >= frameLength) parserState = READ_CRC;
+      break;
+    case READ_CRC:
+      parserState = WAIT_SYNC;
+      if (data == frameCrc) {
+        handleFrame();
+      } else {
+        sendReply(frameSeq, STATUS_CRC_ERROR, NULL, 0);
       }
-      strip.show();
-    }
+      break;
+  }
+}
+
+void loop() {
+  while (Serial.available() > 0) {
+    handleByte(Serial.read());
   }
+  runMotor();
+  updateRainbow();
 }
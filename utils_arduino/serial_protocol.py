@@ -0,0 +1,290 @@
+# utils_arduino/serial_protocol.py
+
+import logging
+import queue
+import struct
+import threading
+import time
+
+from utils_acquisition.metrics import REGISTRY, log_event
+from utils_acquisition.stop import wait_event
+
+# Framing of the binary protocol spoken by serial_connector_arduino.ino:
+#   request: 0xA5 | seq | command | length | payload | crc8
+#   reply:   0x5A | seq | code    | length | payload | crc8
+# The CRC-8 (polynomial 0x07) covers everything after the sync byte. Integers are little endian.
+REQUEST_SYNC = 0xA5
+REPLY_SYNC = 0x5A
+MAX_PAYLOAD = 32
+
+# Reply codes acknowledging a request
+STATUS_OK = 0x00
+STATUS_CRC_ERROR = 0x01
+STATUS_UNKNOWN_COMMAND = 0x02
+STATUS_BAD_PAYLOAD = 0x03
+STATUS_BUSY = 0x04
+
+# Reply codes sent later for a request that has already been acknowledged
+EVENT_MOTION_DONE = 0x10
+EVENT_TRIGGER = 0x11
+EVENT_PLAN_PROGRESS = 0x12
+
+STATUS_MESSAGES = {
+    STATUS_CRC_ERROR: "CRC mismatch",
+    STATUS_UNKNOWN_COMMAND: "unknown command",
+    STATUS_BAD_PAYLOAD: "invalid payload",
+    STATUS_BUSY: "move queue full",
+}
+
+# Commands that complete with an EVENT_MOTION_DONE after their acknowledgement
+MOTION_COMMANDS = {'F', 'B', 'S', 'X'}
+
+SERIAL_BYTES_SENT = REGISTRY.counter("serial_bytes_sent_total", "Bytes written to the Arduino.")
+SERIAL_BYTES_RECEIVED = REGISTRY.counter("serial_bytes_received_total", "Bytes read from the Arduino.")
+SERIAL_COMMANDS = REGISTRY.counter("serial_commands_total", "Commands sent to the Arduino, by command.")
+SERIAL_RETRANSMISSIONS = REGISTRY.counter("serial_retransmissions_total", "Command frames sent again, by command.")
+SERIAL_CRC_ERRORS = REGISTRY.counter("serial_crc_errors_total", "Reply frames dropped because of a CRC mismatch.")
+SERIAL_ACK_LATENCY = REGISTRY.histogram("serial_ack_latency_seconds", "Time from sending a command to its acknowledgement.")
+
+
+def crc8(data, crc=0):
+    """
+    CRC-8 with polynomial 0x07, as computed by the sketch.
+    """
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def encode_frame(sync, seq, code, payload=b''):
+    """
+    Build a frame; code is the command character for requests or the reply code for replies.
+    """
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"Payload of {len(payload)} bytes exceeds the maximum of {MAX_PAYLOAD} bytes.")
+    if isinstance(code, str):
+        code = ord(code)
+    body = bytes([seq, code, len(payload)]) + bytes(payload)
+    return bytes([sync]) + body + bytes([crc8(body)])
+
+
+class FrameParser:
+    """
+    Incremental frame parser: feed() raw bytes and get back the complete (seq, code, payload) frames.
+    Bytes outside of frames and frames with a wrong CRC are dropped and counted.
+    """
+
+    def __init__(self, sync):
+        self._sync = sync
+        self._buffer = bytearray()
+        self.crc_errors = 0
+
+    def feed(self, data):
+        self._buffer.extend(data)
+        frames = []
+        while True:
+            start = self._buffer.find(self._sync)
+            if start < 0:
+                self._buffer.clear()
+                return frames
+            del self._buffer[:start]
+            if len(self._buffer) < 4:
+                return frames
+            length = self._buffer[3]
+            if length > MAX_PAYLOAD:
+                del self._buffer[:1]
+                continue
+            if len(self._buffer) < 5 + length:
+                return frames
+            body = bytes(self._buffer[1:4 + length])
+            if crc8(body) != self._buffer[4 + length]:
+                self.crc_errors += 1
+                del self._buffer[:1]
+                continue
+            del self._buffer[:5 + length]
+            frames.append((body[0], body[1], body[3:]))
+
+
+class CommandError(Exception):
+    """Raised when the Arduino rejects a command."""
+
+    def __init__(self, command, status):
+        self.command = command
+        self.status = status
+        super().__init__(f"Arduino rejected command '{command}': {STATUS_MESSAGES.get(status, hex(status))}")
+
+
+class PendingCommand:
+    """
+    A command that has been sent to the Arduino:
+    - wait_ack() waits for the acknowledgement, retransmitting the frame if it does not arrive.
+    - wait_done() waits for the motion complete event of move commands.
+    """
+
+    def __init__(self, link, seq, command, frame):
+        self._link = link
+        self.seq = seq
+        self.command = command
+        self.frame = frame
+        self.status = None
+        self.reply = None
+        self.position = None
+        self.sent_at = time.monotonic()
+        self._acknowledged = threading.Event()
+        self._done = threading.Event()
+
+    def _set_ack(self, status, payload):
+        self.status = status
+        self.reply = payload
+        self._acknowledged.set()
+
+    def _set_done(self, position):
+        self.position = position
+        self._done.set()
+
+    def wait_ack(self, timeout=None):
+        """
+        Wait for the acknowledgement and return its payload.
+        A busy Arduino (full move queue) is asked again until the timeout expires.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        attempts = 0
+        while True:
+            if self._acknowledged.wait(self._link.ack_timeout):
+                if self.status == STATUS_OK:
+                    return self.reply
+                if self.status not in (STATUS_BUSY, STATUS_CRC_ERROR):
+                    raise CommandError(self.command, self.status)
+                self._acknowledged.clear()
+                if self.status == STATUS_BUSY:
+                    time.sleep(self._link.ack_timeout)
+                else:
+                    attempts += 1
+            else:
+                attempts += 1
+            if attempts > self._link.retries:
+                self._link._discard(self.seq)
+                raise TimeoutError(f"No acknowledgement for command '{self.command}' from the Arduino.")
+            if deadline is not None and time.monotonic() > deadline:
+                self._link._discard(self.seq)
+                raise TimeoutError(f"Command '{self.command}' was not accepted by the Arduino in time.")
+            SERIAL_RETRANSMISSIONS.inc(command=self.command)
+            self._link._write(self.frame)
+
+    def wait_done(self, timeout=None, stop_event=None):
+        """
+        Wait until the Arduino reports that this move has finished and return the stepper position.
+        A set stop_event ends the wait early with ScanStopped; the move itself goes on.
+        """
+        if not wait_event(self._done, timeout, stop_event):
+            raise TimeoutError("Arduino did not report motion complete within the timeout period.")
+        return self.position
+
+
+class SerialLink:
+    """
+    Host side of the binary protocol:
+    - A reader thread parses replies and routes them to the PendingCommand with the same sequence number.
+    - Several commands can be in flight at once; send() only waits for the serial write.
+    - Camera trigger events of continuous scans and plans are collected in trigger_events,
+      completed plan points in plan_events.
+    """
+
+    def __init__(self, ser, ack_timeout=0.2, retries=3):
+        self._ser = ser
+        self.ack_timeout = ack_timeout
+        self.retries = retries
+        self._parser = FrameParser(REPLY_SYNC)
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._next_seq = 1
+        self._stop_event = threading.Event()
+        self._reader = threading.Thread(target=self._read_loop, name="SerialLink", daemon=True)
+        self.trigger_events = queue.Queue()
+        self.plan_events = queue.Queue()
+
+    def start(self):
+        self._reader.start()
+
+    def close(self):
+        self._stop_event.set()
+        if self._reader.is_alive():
+            self._reader.join()
+
+    def _write(self, frame):
+        with self._write_lock:
+            self._ser.write(frame)
+        SERIAL_BYTES_SENT.inc(len(frame))
+
+    def _discard(self, seq):
+        with self._pending_lock:
+            self._pending.pop(seq, None)
+
+    def _allocate_seq(self):
+        # Sequence numbers 1..255; 0 is used by the sketch for plain text commands
+        for _ in range(255):
+            seq = self._next_seq
+            self._next_seq = self._next_seq % 255 + 1
+            if seq not in self._pending:
+                return seq
+        raise RuntimeError("Too many commands in flight.")
+
+    def send(self, command, payload=b''):
+        """
+        Send a command without waiting for its acknowledgement.
+        """
+        with self._pending_lock:
+            seq = self._allocate_seq()
+            frame = encode_frame(REQUEST_SYNC, seq, command, payload)
+            pending = PendingCommand(self, seq, command, frame)
+            self._pending[seq] = pending
+        SERIAL_COMMANDS.inc(command=command)
+        self._write(frame)
+        return pending
+
+    def request(self, command, payload=b'', timeout=None):
+        """
+        Send a command, wait for its acknowledgement and return the reply payload.
+        """
+        return self.send(command, payload).wait_ack(timeout)
+
+    def _read_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                data = self._ser.read(self._ser.in_waiting or 1)
+            except Exception as error:
+                log_event("serial_connection_lost", f"Serial connection lost: {error}", logging.ERROR, error=str(error))
+                break
+            SERIAL_BYTES_RECEIVED.inc(len(data))
+            crc_errors = self._parser.crc_errors
+            for seq, code, payload in self._parser.feed(data):
+                self._dispatch(seq, code, payload)
+            if self._parser.crc_errors > crc_errors:
+                SERIAL_CRC_ERRORS.inc(self._parser.crc_errors - crc_errors)
+
+    def _dispatch(self, seq, code, payload):
+        with self._pending_lock:
+            pending = self._pending.get(seq)
+            if pending is None:
+                return
+            # Busy and CRC error replies keep the command pending, it will be retransmitted
+            finished = (
+                code == EVENT_MOTION_DONE
+                or code in (STATUS_UNKNOWN_COMMAND, STATUS_BAD_PAYLOAD)
+                or (code == STATUS_OK and pending.command not in MOTION_COMMANDS)
+            )
+            if finished:
+                del self._pending[seq]
+
+        if code == EVENT_MOTION_DONE:
+            pending._set_done(struct.unpack('<i', payload)[0])
+        elif code == EVENT_TRIGGER:
+            self.trigger_events.put(struct.unpack('<iiI', payload))
+        elif code == EVENT_PLAN_PROGRESS:
+            self.plan_events.put(struct.unpack('<iiI', payload))
+        else:
+            SERIAL_ACK_LATENCY.observe(time.monotonic() - pending.sent_at)
+            pending._set_ack(code, payload)
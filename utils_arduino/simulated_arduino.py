@@ -0,0 +1,235 @@
+# utils_arduino/simulated_arduino.py
+
+import collections
+import os
+import select
+import struct
+import threading
+import time
+import tty
+
+from utils_arduino.serial_protocol import (
+    FrameParser, encode_frame, REQUEST_SYNC, REPLY_SYNC, STATUS_OK, STATUS_UNKNOWN_COMMAND, STATUS_BAD_PAYLOAD,
+    STATUS_BUSY, EVENT_MOTION_DONE, EVENT_TRIGGER, EVENT_PLAN_PROGRESS
+)
+from utils_arduino.utils import build_macros, firmware_hash, estimate_move_time, FIRMWARE_VERSION
+
+DEFAULT_SKETCH_PATH = "utils_arduino/scripts_arduino/serial_connector_arduino/serial_connector_arduino.ino"
+
+# Sizes of the buffers in the sketch
+MOVE_QUEUE_SIZE = 4
+PLAN_BUFFER_SIZE = 16
+PLAN_TRIGGER = 0x01
+SEQ_HISTORY_SIZE = 8
+
+
+class SimulatedArduino:
+    """
+    Virtual Arduino that emulates serial_connector_arduino.ino on a pseudo terminal:
+    - port is a /dev/pts device that ArduinoController opens like a real board.
+    - The binary command set is emulated, including the move queue, continuous scans and scan plans.
+    - Moves take as long as the AccelStepper profile would (scaled by time_scale).
+    - Camera triggers call trigger_callback, e.g. SimulatedTLCameraSDK.hardware_trigger.
+    - It reports the firmware hash of the given sketch and config, so ArduinoController never uploads to it.
+    Plain text commands are not emulated.
+    """
+
+    fqbn = 'arduino:avr:uno'
+
+    def __init__(self, config, sketch_path=DEFAULT_SKETCH_PATH, trigger_callback=None, time_scale=1.0):
+        self.micro_stepping = config.get("micro_stepping", 16)
+        self.motor_max_speed = config.get("motor_max_speed", 1600)
+        self.motor_acceleration = config.get("motor_acceleration", 1600)
+        self.trigger_callback = trigger_callback
+        self.time_scale = time_scale
+        self.position = 0
+        self._firmware_hash = int(firmware_hash(sketch_path, self.fqbn, build_macros(sketch_path, config))[:8], 16)
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+        self._parser = FrameParser(REQUEST_SYNC)
+        self._write_lock = threading.Lock()
+        self._condition = threading.Condition()
+        self._moves = collections.deque()
+        self._plan = collections.deque()
+        self._moving = False
+        self._seq_history = collections.deque(maxlen=SEQ_HISTORY_SIZE)
+        self._start_time = time.monotonic()
+        self._stop_event = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._read_loop, name="SimulatedArduino-serial", daemon=True),
+            threading.Thread(target=self._motion_loop, name="SimulatedArduino-motion", daemon=True),
+        ]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def close(self):
+        self._stop_event.set()
+        with self._condition:
+            self._condition.notify_all()
+        for thread in self._threads:
+            if thread.is_alive():
+                thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def _micros(self):
+        return int((time.monotonic() - self._start_time) * 1e6) & 0xFFFFFFFF
+
+    def _sleep(self, seconds):
+        if seconds > 0 and self.time_scale > 0:
+            self._stop_event.wait(seconds * self.time_scale)
+
+    def _send(self, seq, code, payload=b''):
+        with self._write_lock:
+            os.write(self._master, encode_frame(REPLY_SYNC, seq, code, payload))
+
+    def _read_loop(self):
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([self._master], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._master, 1024)
+            except OSError:
+                break
+            for seq, command, payload in self._parser.feed(data):
+                self._handle_frame(seq, chr(command), payload)
+
+    def _handle_frame(self, seq, command, payload):
+        reply = b''
+        if command not in 'QIG' and seq in self._seq_history:
+            # Retransmission of an executed command: acknowledge without executing it again
+            status = STATUS_OK
+        else:
+            status, reply = self._execute(seq, command, payload)
+            if status == STATUS_OK:
+                self._seq_history.append(seq)
+        self._send(seq, status, reply)
+
+    def _queue_move(self, move):
+        with self._condition:
+            if len(self._moves) >= MOVE_QUEUE_SIZE:
+                return STATUS_BUSY, b''
+            self._moves.append(move)
+            self._condition.notify_all()
+        return STATUS_OK, b''
+
+    def _execute(self, seq, command, payload):
+        if command in 'FB':
+            if len(payload) != 4:
+                return STATUS_BAD_PAYLOAD, b''
+            steps = struct.unpack('<i', payload)[0]
+            return self._queue_move((seq, 'move', steps if command == 'F' else -steps, 0, 0))
+        if command == 'S':
+            if len(payload) != 12:
+                return STATUS_BAD_PAYLOAD, b''
+            total_steps, n_triggers, speed = struct.unpack('<iii', payload)
+            if n_triggers <= 0 or speed <= 0:
+                return STATUS_BAD_PAYLOAD, b''
+            return self._queue_move((seq, 'scan', total_steps, n_triggers, speed))
+        if command == 'P':
+            if not payload or len(payload) % 7:
+                return STATUS_BAD_PAYLOAD, b''
+            with self._condition:
+                if len(self._plan) + len(payload) // 7 > PLAN_BUFFER_SIZE:
+                    return STATUS_BUSY, b''
+                for i in range(0, len(payload), 7):
+                    self._plan.append(struct.unpack('<iHB', payload[i:i + 7]))
+                self._condition.notify_all()
+                return STATUS_OK, bytes([PLAN_BUFFER_SIZE - len(self._plan)])
+        if command == 'K':
+            with self._condition:
+                self._plan.clear()
+            return STATUS_OK, b''
+        if command == 'X':
+            if len(payload) != 6:
+                return STATUS_BAD_PAYLOAD, b''
+            n_points, hold_ms = struct.unpack('<iH', payload)
+            if n_points <= 0:
+                return STATUS_BAD_PAYLOAD, b''
+            return self._queue_move((seq, 'plan', 0, n_points, hold_ms))
+        if command == 'Q':
+            with self._condition:
+                return STATUS_OK, struct.pack('<iBB', self.position, self._moving, len(self._moves))
+        if command == 'I':
+            return STATUS_OK, struct.pack('<IH', self._firmware_hash, FIRMWARE_VERSION)
+        if command == 'G':
+            return STATUS_OK, struct.pack('<iiB', self.motor_max_speed, self.motor_acceleration, self.micro_stepping)
+        if command in 'VA':
+            if len(payload) != 4 or struct.unpack('<i', payload)[0] <= 0:
+                return STATUS_BAD_PAYLOAD, b''
+            if command == 'V':
+                self.motor_max_speed = struct.unpack('<i', payload)[0]
+            else:
+                self.motor_acceleration = struct.unpack('<i', payload)[0]
+            return STATUS_OK, b''
+        if command == 'M':
+            if len(payload) != 1 or payload[0] not in (1, 2, 4, 8, 16):
+                return STATUS_BAD_PAYLOAD, b''
+            with self._condition:
+                if self._moving or self._moves:
+                    return STATUS_BUSY, b''
+            self.micro_stepping = payload[0]
+            return STATUS_OK, b''
+        if command in 'LOCR':
+            return STATUS_OK, b''
+        return STATUS_UNKNOWN_COMMAND, b''
+
+    def _trigger(self, seq, index):
+        if self.trigger_callback is not None:
+            self.trigger_callback()
+        self._send(seq, EVENT_TRIGGER, struct.pack('<iiI', index, self.position, self._micros()))
+
+    def _run_move(self, steps):
+        self._sleep(estimate_move_time(steps, self.motor_max_speed, self.motor_acceleration, self.micro_stepping))
+        self.position += steps
+
+    def _run_scan(self, seq, total_steps, n_triggers, speed):
+        start_position = self.position
+        start_time = time.monotonic()
+        for index in range(n_triggers):
+            offset = index * abs(total_steps) // n_triggers
+            self._sleep(start_time + offset / speed * self.time_scale - time.monotonic())
+            self.position = start_position + (offset if total_steps >= 0 else -offset)
+            self._trigger(seq, index)
+        self._sleep(start_time + abs(total_steps) / speed * self.time_scale - time.monotonic())
+        self.position = start_position + total_steps
+
+    def _run_plan(self, seq, n_points, hold_ms):
+        for index in range(n_points):
+            with self._condition:
+                self._condition.wait_for(lambda: self._plan or self._stop_event.is_set())
+                if self._stop_event.is_set():
+                    return
+                position, dwell_ms, flags = self._plan.popleft()
+            self._run_move(position - self.position)
+            self._sleep(dwell_ms / 1000)
+            if flags & PLAN_TRIGGER:
+                self._trigger(seq, index)
+                self._sleep(hold_ms / 1000)
+            self._send(seq, EVENT_PLAN_PROGRESS, struct.pack('<iiI', index, self.position, self._micros()))
+
+    def _motion_loop(self):
+        while not self._stop_event.is_set():
+            with self._condition:
+                self._condition.wait_for(lambda: self._moves or self._stop_event.is_set())
+                if self._stop_event.is_set():
+                    return
+                seq, kind, steps, count, param = self._moves.popleft()
+                self._moving = True
+            if kind == 'move':
+                self._run_move(steps)
+            elif kind == 'scan':
+                self._run_scan(seq, steps, count, param)
+            else:
+                self._run_plan(seq, count, param)
+            with self._condition:
+                self._moving = False
+            self._send(seq, EVENT_MOTION_DONE, struct.pack('<i', self.position))
@@ -2,104 +2,284 @@
 
 import subprocess
 import json
-import sys
+import os
+import re
 import shutil
+import hashlib
+import tempfile
+import logging
+from serial.tools import list_ports
+
+from utils_acquisition.metrics import log_event
+
+# Bumped whenever the command set of the sketch changes
+FIRMWARE_VERSION = 2
+
+# Macros that only set boot defaults; ArduinoController overrides them at runtime, so they do not force a rebuild
+RUNTIME_MACROS = {'MICRO_STEPPING', 'MOTOR_MAX_SPEED', 'MOTOR_ACCELERATION'}
+
+BUILD_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "experimental_setup_control", "builds")
+
+# Last successfully used board, tried first by find_arduino
+DISCOVERY_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "experimental_setup_control", "arduino.json")
+
+# USB (vendor id, product id) of common boards and their FQBN
+KNOWN_BOARDS = {
+    (0x2341, 0x0043): 'arduino:avr:uno',
+    (0x2341, 0x0001): 'arduino:avr:uno',
+    (0x2341, 0x0243): 'arduino:avr:uno',
+    (0x2A03, 0x0043): 'arduino:avr:uno',
+    (0x2341, 0x0010): 'arduino:avr:mega',
+    (0x2341, 0x0042): 'arduino:avr:mega',
+    (0x2341, 0x0242): 'arduino:avr:mega',
+    (0x2341, 0x8036): 'arduino:avr:leonardo',
+    (0x2341, 0x8037): 'arduino:avr:micro',
+}
+
+
+class ArduinoNotFoundError(Exception):
+    """Raised when no compatible Arduino board can be found."""
+
+
+class SketchUploadError(RuntimeError):
+    """Raised when the sketch cannot be compiled or uploaded; stderr holds the output of arduino-cli."""
+
+    def __init__(self, message, stderr=""):
+        super().__init__(f"{message}\n{stderr}" if stderr else message)
+        self.stderr = stderr
+
+
 def check_arduino_cli():
     """
     Check if arduino-cli is installed.
     """
     if not shutil.which('arduino-cli'):
-        print("arduino-cli is not installed or not in your PATH.")
-        print("Please install it from https://github.com/arduino/arduino-cli#installation")
-        sys.exit(1)
+        raise ArduinoNotFoundError(
+            "arduino-cli is not installed or not in your PATH. "
+            "Please install it from https://github.com/arduino/arduino-cli#installation"
+        )
 
-def find_arduino():
+def _load_cached_board():
+    try:
+        with open(DISCOVERY_CACHE_PATH) as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+
+def _save_cached_board(port, fqbn, serial_number):
+    try:
+        os.makedirs(os.path.dirname(DISCOVERY_CACHE_PATH), exist_ok=True)
+        with open(DISCOVERY_CACHE_PATH, 'w') as cache_file:
+            json.dump({"port": port, "fqbn": fqbn, "serial_number": serial_number}, cache_file)
+    except OSError as e:
+        log_event("board_cache_failed", f"Could not cache the Arduino board: {e}", logging.WARNING, error=str(e))
+
+def _find_cached_board(ports):
     """
-    Find the connected Arduino board and return its port and FQBN.
+    Look for the board of the last session, by USB serial number first since the port name
+    can change after the board re-enumerates.
+    """
+    cached = _load_cached_board()
+    if not cached:
+        return None
+    for port_info in ports:
+        if cached.get("serial_number") and port_info.serial_number == cached["serial_number"]:
+            return port_info.device, cached["fqbn"]
+    for port_info in ports:
+        if port_info.device == cached.get("port"):
+            return port_info.device, cached["fqbn"]
+    return None
+
+def _find_known_board(ports):
+    """
+    Look for a board with a known USB vendor/product id.
     """
+    for port_info in ports:
+        fqbn = KNOWN_BOARDS.get((port_info.vid, port_info.pid))
+        if fqbn:
+            return port_info.device, fqbn
+    return None
+
+def find_arduino_with_cli(port=None):
+    """
+    Find the connected Arduino board with 'arduino-cli board list' and return its port and FQBN.
+    If port is given, only the board on that port is considered.
+    This is slow (the CLI has to start up), so find_arduino only uses it as a last resort.
+    """
+    check_arduino_cli()
     result = subprocess.run(
         ['arduino-cli', 'board', 'list', '--format', 'json'],
         capture_output=True, text=True
     )
 
     if result.returncode != 0:
-        print("Error running 'arduino-cli board list':")
-        print(result.stderr)
-        sys.exit(1)
+        raise ArduinoNotFoundError(f"Error running 'arduino-cli board list': {result.stderr}")
 
     try:
         data = json.loads(result.stdout)
     except json.JSONDecodeError as e:
-        print("Failed to parse JSON output from arduino-cli:")
-        print(result.stdout)
-        sys.exit(1)
+        raise ArduinoNotFoundError(f"Failed to parse JSON output from arduino-cli: {result.stdout}") from e
 
     detected_ports = data.get('detected_ports', [])
     if not detected_ports:
-        print("No Arduino boards found.")
-        sys.exit(1)
+        raise ArduinoNotFoundError("No Arduino boards found.")
 
     for port_info in detected_ports:
-        port = port_info.get('port', {}).get('address')
+        address = port_info.get('port', {}).get('address')
+        if port is not None and address != port:
+            continue
         matching_boards = port_info.get('matching_boards', [])
         if not matching_boards:
             continue
         for board in matching_boards:
             fqbn = board.get('fqbn')
-            if port and fqbn:
-                return port, fqbn
+            if address and fqbn:
+                return address, fqbn
 
-    print("No compatible Arduino boards found.")
-    sys.exit(1)
+    if port is not None:
+        raise ArduinoNotFoundError(f"No compatible Arduino board found on {port}.")
+    raise ArduinoNotFoundError("No compatible Arduino boards found.")
 
-def upload_sketch(sketch_path, port, fqbn, config):
+def find_arduino(use_cache=True, port=None):
     """
-    Compile and upload the Arduino sketch to the board.
+    Find the connected Arduino board and return its port and FQBN.
+    With several boards connected, port selects the one to use.
+    Tries the board of the last session, then known USB ids, then arduino-cli.
+    Raises ArduinoNotFoundError if no board is found.
     """
+    ports = list_ports.comports()
+    if port is not None:
+        ports = [port_info for port_info in ports if port_info.device == port]
+    found = (_find_cached_board(ports) if use_cache else None) or _find_known_board(ports)
+    if found is None:
+        found = find_arduino_with_cli(port)
+
+    return found
 
-    # Construct the build properties string
-    build_props = "build.extra_flags="
+def remember_arduino(port, fqbn):
+    """
+    Cache a board after a successful session so the next find_arduino finds it without scanning.
+    """
+    serial_number = next((p.serial_number for p in list_ports.comports() if p.device == port), None)
+    _save_cached_board(port, fqbn, serial_number)
+
+def estimate_move_time(steps, max_speed, acceleration, micro_stepping):
+    """
+    Estimate the duration of a move in seconds from the trapezoidal AccelStepper profile.
+    Speed and acceleration are given in full steps, the sketch scales them by the microstepping factor.
+    """
+    speed = max_speed * micro_stepping
+    acceleration = acceleration * micro_stepping
+    steps = abs(steps)
+    if speed <= 0 or acceleration <= 0:
+        return 0.0
+    if steps >= speed ** 2 / acceleration:
+        return steps / speed + speed / acceleration
+    return 2 * (steps / acceleration) ** 0.5
 
-    # Add each config parameter as a macro definition
+def sketch_macros(sketch_path):
+    """
+    Return the names of the configuration macros the sketch declares with #ifndef.
+    """
+    with open(sketch_path) as sketch_file:
+        return set(re.findall(r'^\s*#ifndef\s+(\w+)', sketch_file.read(), flags=re.MULTILINE))
+
+
+def build_macros(sketch_path, config):
+    """
+    Select the config parameters the sketch actually uses and return them as {MACRO_NAME: value}.
+    """
+    used = sketch_macros(sketch_path)
+    macros = {}
     for key, value in config.items():
         # Convert the key to uppercase and replace any special characters to match macro naming conventions
-        macro_name = key.upper()
-        macro_name = macro_name.replace(' ', '_')  # Replace spaces with underscores if any
+        macro_name = key.upper().replace(' ', '_')
+        if macro_name in used and macro_name != 'FIRMWARE_HASH':
+            macros[macro_name] = value
+    return macros
 
-        # Append to the build properties string
-        build_props += f"-D{macro_name}={value} "
 
-    # Trim any trailing whitespace
-    build_props = build_props.strip()
-    print(build_props)
+def firmware_hash(sketch_path, fqbn, macros):
+    """
+    Content hash of a build: sketch source, board and the values of all macros except RUNTIME_MACROS.
+    The first 32 bits are compiled into the firmware and reported back by the 'I' command.
+    """
+    digest = hashlib.sha256()
+    with open(sketch_path, 'rb') as sketch_file:
+        digest.update(sketch_file.read())
+    digest.update(fqbn.encode())
+    for name in sorted(set(macros) - RUNTIME_MACROS):
+        digest.update(f"{name}={macros[name]}".encode())
+    return digest.hexdigest()
 
-    # Compile the sketch with build properties
-    compile_cmd = [
-         'arduino-cli', 'compile',
-        '--fqbn', fqbn,
-        '--build-properties', build_props,
-        sketch_path
-    ]
-    print("Compiling the sketch...")
-    result = subprocess.run(compile_cmd, capture_output=True, text=True,check=True)
 
-    if result.returncode != 0:
-        print("Compilation failed:")
-        print(result.stderr)
-        sys.exit(1)
+def upload_sketch(sketch_path, port, fqbn, config):
+    """
+    Compile and upload the Arduino sketch to the board.
+    Builds are cached by content hash, so an unchanged sketch is uploaded without recompiling.
+    Returns the 32 bit firmware hash compiled into the sketch; raises SketchUploadError if arduino-cli fails.
+    """
+    macros = build_macros(sketch_path, config)
+    build_hash = firmware_hash(sketch_path, fqbn, macros)
+    build_dir = os.path.join(BUILD_CACHE_DIR, build_hash)
+
+    if os.path.isdir(build_dir) and any(name.endswith('.hex') or name.endswith('.bin') for name in os.listdir(build_dir)):
+        log_event("sketch_build_cached", f"Using cached build {build_hash[:8]}.", build_hash=build_hash)
     else:
-        print("Compilation succeeded.")
+        # Construct the build properties string
+        build_props = "build.extra_flags="
+
+        # Add each used config parameter as a macro definition
+        for macro_name, value in macros.items():
+            build_props += f"-D{macro_name}={value} "
+        build_props += f"-DFIRMWARE_HASH=0x{build_hash[:8]}UL"
+
+        # Compile into a private directory and move the finished build into the cache in one step, so rigs
+        # compiling the same sketch in parallel never upload a half-written build; arduino-cli gets a private
+        # build path too, as its default one is shared by all compiles of the sketch
+        os.makedirs(BUILD_CACHE_DIR, exist_ok=True)
+        staging_dir = tempfile.mkdtemp(prefix=f"{build_hash}.", dir=BUILD_CACHE_DIR)
+        output_dir = os.path.join(staging_dir, "output")
+        compile_cmd = [
+             'arduino-cli', 'compile',
+            '--fqbn', fqbn,
+            '--build-properties', build_props,
+            '--build-path', os.path.join(staging_dir, "build"),
+            '--output-dir', output_dir,
+            sketch_path
+        ]
+        log_event("sketch_compile", "Compiling the sketch...", sketch_path=sketch_path, fqbn=fqbn,
+                  build_hash=build_hash, build_properties=build_props)
+        try:
+            result = subprocess.run(compile_cmd, capture_output=True, text=True)
+            if result.returncode == 0:
+                try:
+                    os.replace(output_dir, build_dir)
+                except OSError:
+                    # Another rig finished the same build first; its copy is identical
+                    if not os.path.isdir(build_dir):
+                        raise
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+        if result.returncode != 0:
+            log_event("sketch_compile_failed", f"Compilation failed:\n{result.stderr}", logging.ERROR,
+                      build_hash=build_hash, stderr=result.stderr)
+            raise SketchUploadError(f"Compiling {sketch_path} for {fqbn} failed.", result.stderr)
+        else:
+            log_event("sketch_compiled", "Compilation succeeded.", build_hash=build_hash)
 
     upload_cmd = [
         'arduino-cli', 'upload', '-p', port, '--fqbn', fqbn,
+        '--input-dir', build_dir,
         sketch_path
     ]
-    print("Uploading the sketch to the board...")
+    log_event("sketch_upload", "Uploading the sketch to the board...", port=port, fqbn=fqbn, build_hash=build_hash)
     result = subprocess.run(upload_cmd, capture_output=True, text=True)
 
     if result.returncode != 0:
-        print("Upload failed:")
-        print(result.stderr)
-        sys.exit(1)
+        log_event("sketch_upload_failed", f"Upload failed:\n{result.stderr}", logging.ERROR, port=port, stderr=result.stderr)
+        raise SketchUploadError(f"Uploading the sketch to {port} failed.", result.stderr)
     else:
-        print("Upload succeeded.")
+        log_event("sketch_uploaded", "Upload succeeded.", port=port, build_hash=build_hash)
+    return int(build_hash[:8], 16)
@@ -0,0 +1,148 @@
+# utils_camera/calibration.py
+
+import os
+import threading
+import numpy as np
+import tifffile
+
+from utils_acquisition.metrics import log_event
+from utils_camera.hdr import SATURATION
+
+# Rows corrected at a time, so the float scratch buffer stays small compared to a frame
+TILE_ROWS = 64
+
+
+def build_master(camera_controller, n_frames, method="mean", exposure_us=None):
+    """
+    Capture n_frames at exposure_us (default: the configured exposure) and combine them into a float32 master frame.
+    'mean' accumulates a running sum; 'median' is robust against outliers such as cosmic rays but keeps all frames.
+    """
+    total = None
+    stack = None
+    for i in range(n_frames):
+        slots = camera_controller.capture_bracket([exposure_us]) if exposure_us else [camera_controller.capture_frame()]
+        frame = slots[0].array
+        try:
+            if method == "median":
+                if stack is None:
+                    stack = np.empty((n_frames,) + frame.shape, dtype=frame.dtype)
+                stack[i] = frame
+            elif total is None:
+                total = frame.astype(np.float32)
+            else:
+                total += frame
+        finally:
+            slots[0].release()
+    if method == "median":
+        return np.median(stack, axis=0).astype(np.float32)
+    return total / n_frames
+
+
+class FrameCalibration:
+    """
+    Dark-frame and flat-field correction of raw frames at one exposure time:
+    corrected = (raw - dark) * gain, with gain = mean(flat - dark) / (flat - dark).
+    apply() corrects a frame in place, tile by tile, so no full-frame temporary is allocated.
+    Pixels saturated in the raw frame are set to full scale instead, so the correction cannot pull a clipped
+    value below the saturation level where e.g. the HDR merge would trust it.
+    """
+
+    def __init__(self, dark, bit_depth, gain=None):
+        self.dark = dark.astype(np.float32)
+        self.gain = gain
+        self._max_value = 2 ** bit_depth - 1
+        self._saturated_value = SATURATION * self._max_value
+
+    @staticmethod
+    def flat_gain(flat, dark, bayer=False):
+        """
+        Per-pixel gain normalizing the dark-corrected flat field to its mean; dead pixels keep a gain of 1.
+        For Bayer mosaics (bayer=True) each of the four phases is normalized to its own mean, so the gain
+        only evens out the pixels of a colour and the white balance is left to the ColorProcessor.
+        """
+        response = flat - dark
+        gain = np.ones(response.shape, dtype=np.float32)
+        phases = [(slice(y, None, 2), slice(x, None, 2)) for y in range(2) for x in range(2)] if bayer \
+            else [(slice(None), slice(None))]
+        for phase in phases:
+            phase_response, phase_gain = response[phase], gain[phase]
+            alive = phase_response > 1
+            if alive.any():
+                phase_gain[alive] = phase_response[alive].mean() / phase_response[alive]
+        return gain
+
+    def apply(self, frame):
+        scratch = np.empty((min(TILE_ROWS, frame.shape[0]), frame.shape[1]), dtype=np.float32)
+        saturated_scratch = np.empty(scratch.shape, dtype=bool)
+        for top in range(0, frame.shape[0], TILE_ROWS):
+            tile = frame[top:top + TILE_ROWS]
+            corrected = scratch[:tile.shape[0]]
+            saturated = saturated_scratch[:tile.shape[0]]
+            np.greater_equal(tile, self._saturated_value, out=saturated)
+            np.subtract(tile, self.dark[top:top + TILE_ROWS], out=corrected)
+            if self.gain is not None:
+                corrected *= self.gain[top:top + TILE_ROWS]
+            np.clip(corrected, 0, self._max_value, out=corrected)
+            np.rint(corrected, out=corrected)
+            np.copyto(corrected, self._max_value, where=saturated)
+            np.copyto(tile, corrected, casting='unsafe')
+        return frame
+
+
+class CalibrationCache:
+    """
+    Master dark and flat frames of one camera stored as float32 TIFF files in a directory, keyed by camera serial
+    number, kind, exposure and bit depth, so they are captured once and reused by every scan with the same settings,
+    and cameras sharing the directory never use each other's masters.
+    """
+
+    def __init__(self, directory, serial_number):
+        self.directory = directory
+        self.serial_number = serial_number
+        self._frames = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, kind, exposure_us, bit_depth):
+        return os.path.join(self.directory, f"{kind}_{self.serial_number}_{exposure_us}us_{bit_depth}bit.tiff")
+
+    def load(self, kind, exposure_us, bit_depth):
+        """
+        Return the master frame, or None if it has not been captured yet.
+        """
+        key = (self.serial_number, kind, exposure_us, bit_depth)
+        with self._lock:
+            if key not in self._frames:
+                path = self.path(kind, exposure_us, bit_depth)
+                if not os.path.exists(path):
+                    return None
+                self._frames[key] = tifffile.imread(path).astype(np.float32)
+            return self._frames[key]
+
+    def save(self, kind, exposure_us, bit_depth, frame):
+        path = self.path(kind, exposure_us, bit_depth)
+        tifffile.imwrite(path + ".tmp", frame.astype(np.float32))
+        os.replace(path + ".tmp", path)
+        with self._lock:
+            self._frames[(self.serial_number, kind, exposure_us, bit_depth)] = frame.astype(np.float32)
+        log_event("master_frame_saved", f"Saved master {kind} frame {path}", kind=kind, exposure_us=exposure_us,
+                  bit_depth=bit_depth, path=path, camera_serial=self.serial_number)
+
+    def calibrations(self, exposures_us, bit_depth, flat_exposure_us=None, bayer=False):
+        """
+        FrameCalibrations by exposure for all exposures with a master dark frame.
+        If flat_exposure_us is given, the flat field captured at that exposure corrects all of them;
+        bayer normalizes its gain per Bayer phase, for colour sensors.
+        """
+        gain = None
+        if flat_exposure_us is not None:
+            flat = self.load("flat", flat_exposure_us, bit_depth)
+            dark = self.load("dark", flat_exposure_us, bit_depth)
+            if flat is not None and dark is not None:
+                gain = FrameCalibration.flat_gain(flat, dark, bayer)
+        calibrations = {}
+        for exposure_us in exposures_us:
+            dark = self.load("dark", exposure_us, bit_depth)
+            if dark is not None:
+                calibrations[exposure_us] = FrameCalibration(dark, bit_depth, gain)
+        return calibrations
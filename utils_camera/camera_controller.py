@@ -1,6 +1,7 @@
 # utils_camera/camera_controller.py
 
 import threading,os
+import logging
 import tkinter as tk
 from PIL import Image, ImageTk
 import queue
@@ -9,31 +10,66 @@ import time
 import numpy as np
 import tifffile
 
-from thorlabs_tsi_sdk.tl_camera import TLCameraSDK, TLCamera, Frame
-from thorlabs_tsi_sdk.tl_camera_enums import SENSOR_TYPE
+try:
+    from thorlabs_tsi_sdk.tl_camera import TLCameraSDK, TLCamera, Frame
+except ImportError:
+    # Only the simulated camera backend can be used without the Thorlabs SDK
+    TLCameraSDK = None
+from utils_camera.simulated_camera import SENSOR_TYPE, OPERATION_MODE, TRIGGER_POLARITY
+
+from utils_camera.frame_ring import FrameRing
+from utils_camera.image_writer import ImageWriter
+from utils_camera.preview import PreviewRenderer
+from utils_camera.color import ColorProcessor
+from utils_camera.scan_container import ScanContainer, TAG_BITDEPTH, TAG_EXPOSURE
+from utils_camera.hdr import merge_exposures
+from utils_acquisition.profiler import NULL_PROFILER
+from utils_acquisition.metrics import REGISTRY, log_event
+
+FRAMES_RECEIVED = REGISTRY.counter("camera_frames_received_total", "Frames received from the camera, by consumer.")
+FRAMES_DROPPED = REGISTRY.counter("camera_frames_dropped_total", "Frames discarded before use, by reason.")
+IMAGES_WRITTEN = REGISTRY.counter("images_written_total", "Frames written to disk.")
+BYTES_WRITTEN = REGISTRY.counter("image_bytes_written_total", "Raw frame bytes written to disk.")
+IMAGE_WRITE_SECONDS = REGISTRY.histogram("image_write_seconds", "Time to encode and write one frame.")
+CAMERA_ERRORS = REGISTRY.counter("camera_errors_total", "Errors of the camera acquisition, by kind.")
 
 class LiveViewCanvas(tk.Canvas):
     """Tkinter Canvas for displaying live images."""
 
-    def __init__(self, parent, image_queue):
-        # type: (typing.Any, queue.Queue) -> LiveViewCanvas
+    def __init__(self, parent, image_queue, bit_depth=8, max_size=None, color=None):
+        # type: (typing.Any, queue.Queue, int, typing.Optional[typing.Tuple[int, int]], typing.Any) -> LiveViewCanvas
         self.image_queue = image_queue
         self._image_width = 0
         self._image_height = 0
+        self._photo_image = None
+        self._image_item = None  # Single canvas item, updated in place for every frame
         super().__init__(parent)
+        if max_size is None:
+            # Leave room for the controls next to the canvas
+            max_size = (int(self.winfo_screenwidth() * 0.75), int(self.winfo_screenheight() * 0.85))
+        self._renderer = PreviewRenderer(bit_depth, *max_size, color=color)
         self.pack()
         self._update_image()
 
     def _update_image(self):
         try:
-            image = self.image_queue.get_nowait()
-            self._photo_image = ImageTk.PhotoImage(master=self, image=image)
-            if (self._photo_image.width() != self._image_width) or (self._photo_image.height() != self._image_height):
+            slot = self.image_queue.get_nowait()
+            try:
+                image = Image.fromarray(self._renderer.render(slot.array))
+            finally:
+                slot.release()
+            if (image.width != self._image_width) or (image.height != self._image_height):
                 # Resize the canvas to match the new image size
-                self._image_width = self._photo_image.width()
-                self._image_height = self._photo_image.height()
+                self._image_width = image.width
+                self._image_height = image.height
+                self._photo_image = ImageTk.PhotoImage(master=self, image=image)
                 self.config(width=self._image_width, height=self._image_height)
-            self.create_image(0, 0, image=self._photo_image, anchor='nw')
+                if self._image_item is None:
+                    self._image_item = self.create_image(0, 0, image=self._photo_image, anchor='nw')
+                else:
+                    self.itemconfig(self._image_item, image=self._photo_image)
+            else:
+                self._photo_image.paste(image)
         except queue.Empty:
             pass
         # Schedule the next update
@@ -43,13 +79,22 @@ class LiveViewCanvas(tk.Canvas):
 class ImageAcquisitionThread(threading.Thread):
     """Thread for acquiring images from the camera."""
 
-    def __init__(self, camera):
-        # type: (TLCamera) -> None
+    def __init__(self, camera, ring_size=4):
+        # type: (TLCamera, int) -> None
         super().__init__()
         self._camera = camera
         self._bit_depth = camera.bit_depth
+        self._color = None
+        if camera.camera_sensor_type == SENSOR_TYPE.BAYER:
+            self._color = ColorProcessor.from_camera(camera, self._bit_depth)
         self._camera.image_poll_timeout_ms = 0  # Non-blocking
-        self._image_queue = queue.Queue(maxsize=2)
+        self._image_queue = queue.Queue(maxsize=1)  # Only the latest frame is shown
+        self._frame_ring = FrameRing(
+            ring_size,
+            camera.image_height_pixels,
+            camera.image_width_pixels,
+            dtype=np.uint8 if self._bit_depth <= 8 else np.uint16
+        )
         self._stop_event = threading.Event()
         self._save_event = threading.Event()
         self._save_path = None
@@ -58,16 +103,38 @@ class ImageAcquisitionThread(threading.Thread):
         # type: () -> queue.Queue
         return self._image_queue
 
+    @property
+    def bit_depth(self):
+        return self._bit_depth
+
+    @property
+    def color(self):
+        return self._color
+
     def stop(self):
         self._stop_event.set()
 
+    def _publish(self, slot):
+        # Replace a frame the live view has not picked up yet instead of queueing behind it
+        while True:
+            try:
+                self._image_queue.put_nowait(slot)
+                return
+            except queue.Full:
+                try:
+                    self._image_queue.get_nowait().release()
+                    FRAMES_DROPPED.inc(reason="preview_stale")
+                except queue.Empty:
+                    pass
+
     def save_next_frame(self, image_path):
         self._save_path = image_path
         self._save_event.set()
 
-    def _get_image(self, frame):
-        # Convert frame to PIL Image
-        scaled_image = frame.image_buffer >> (self._bit_depth - 8)
+    def _get_image(self, slot):
+        # Convert the frame to a PIL Image for saving
+        image = self._color.process(slot.array) if self._color is not None else slot.array
+        scaled_image = image >> (self._bit_depth - 8)
         return Image.fromarray(scaled_image.astype(np.uint8))
 
     def run(self):
@@ -75,33 +142,57 @@ class ImageAcquisitionThread(threading.Thread):
             try:
                 frame = self._camera.get_pending_frame_or_null()
                 if frame is not None:
-                    pil_image = self._get_image(frame)
-                    self._image_queue.put_nowait(pil_image)
-                    if self._save_event.is_set():
-                        pil_image.save(self._save_path)
-                        #print(f"Image saved to {self._save_path}")
-                        self._save_event.clear()
+                    FRAMES_RECEIVED.inc(source="live_view")
+                    # Copy the SDK buffer into the ring once; drop the frame if all slots are still in use
+                    slot = self._frame_ring.try_put(frame.image_buffer, frame.frame_count)
+                    if slot is None:
+                        FRAMES_DROPPED.inc(reason="ring_full")
+                        continue
+                    try:
+                        if self._save_event.is_set():
+                            self._get_image(slot).save(self._save_path)
+                            #print(f"Image saved to {self._save_path}")
+                            self._save_event.clear()
+                    except Exception:
+                        slot.release()
+                        raise
+                    self._publish(slot)
                 else:
                     # No frame available; sleep briefly
                     time.sleep(0.01)
-            except queue.Full:
-                pass
             except Exception as error:
-                print(f"Encountered error: {error}, image acquisition will stop.")
+                CAMERA_ERRORS.inc(kind="acquisition")
+                log_event("acquisition_error", f"Encountered error: {error}, image acquisition will stop.",
+                          logging.ERROR, error=str(error))
                 break
-        print("Image acquisition has stopped")
+        log_event("acquisition_stopped", "Image acquisition has stopped")
+
+
+def open_camera(sdk, serial_number=None):
+    """
+    Open the camera with the given serial number, or the first camera found if serial_number is None.
+    """
+    camera_list = sdk.discover_available_cameras()
+    if not camera_list:
+        raise Exception("No cameras found.")
+    if serial_number is None:
+        return sdk.open_camera(camera_list[0])
+    if serial_number not in camera_list:
+        raise Exception(f"Camera {serial_number} not found. Available cameras: {', '.join(camera_list)}")
+    return sdk.open_camera(serial_number)
 
 
 class CameraController:
     """Controller class for camera operations."""
 
-    def __init__(self):
+    def __init__(self, sdk=None, serial_number=None):
+        """
+        Open the camera with serial_number (default: the first one) of sdk
+        (default: the Thorlabs TLCameraSDK, or e.g. a SimulatedTLCameraSDK).
+        """
         # Initialize SDK and camera
-        self._sdk = TLCameraSDK()
-        camera_list = self._sdk.discover_available_cameras()
-        if not camera_list:
-            raise Exception("No cameras found.")
-        self._camera = self._sdk.open_camera(camera_list[0])
+        self._sdk = sdk if sdk is not None else TLCameraSDK()
+        self._camera = open_camera(self._sdk, serial_number)
 
         # Configure camera settings
         self._camera.frames_per_trigger_zero_for_unlimited = 0
@@ -135,7 +226,9 @@ class CameraController:
 
         self._live_view_canvas = LiveViewCanvas(
             parent=self._canvas_frame,
-            image_queue=self._image_acquisition_thread.get_output_queue()
+            image_queue=self._image_acquisition_thread.get_output_queue(),
+            bit_depth=self._image_acquisition_thread.bit_depth,
+            color=self._image_acquisition_thread.color
         )
 
         # Right frame for the exposure slider
@@ -143,8 +236,10 @@ class CameraController:
         self._slider_frame.pack(side=tk.RIGHT, fill=tk.Y, padx=10, pady=10)
 
         # Print exposure time range
-        print(
-            f"Exposure time range: {self._camera.exposure_time_range_us.min} us to {200000} us"
+        log_event(
+            "exposure_range",
+            f"Exposure time range: {self._camera.exposure_time_range_us.min} us to {200000} us",
+            min_us=self._camera.exposure_time_range_us.min, max_us=200000
         )  # self._camera.exposure_time_range_us.max
 
         # Configure and add exposure slider
@@ -166,36 +261,52 @@ class CameraController:
 
         # Handle window close event
         self._root.protocol("WM_DELETE_WINDOW", self.stop_live_view)
+        self._live_view_running = False
 
-    def start_live_view(self):
-        """Start the live view and image acquisition."""
-        print("Starting live view...")
+    def start_live_view(self, mainloop=True):
+        """
+        Start the live view and image acquisition.
+        With mainloop unset the caller drives the GUI with process_gui_events(), e.g. from an asyncio task.
+        """
+        log_event("live_view_start", "Starting live view...")
+        self._live_view_running = True
         self._image_acquisition_thread.start()
-        self._root.mainloop()
+        if mainloop:
+            self._root.mainloop()
+
+    def process_gui_events(self):
+        """
+        Handle pending GUI events; returns False once the live view has been stopped.
+        """
+        if self._live_view_running:
+            self._root.update()
+        return self._live_view_running
 
     def stop_live_view(self):
         """Stop the live view and clean up resources."""
-        print("Stopping live view...")
+        log_event("live_view_stop", "Stopping live view...")
+        self._live_view_running = False
         try:
             self._image_acquisition_thread.stop()
             self._image_acquisition_thread.join()
 
             self._camera.disarm()
-            print("Camera disarmed successfully.")
+            log_event("camera_disarmed", "Camera disarmed successfully.")
 
             # Dispose of the camera object if it hasn't been disposed of yet
             self._camera.dispose()
-            print("Camera disposed successfully.")
+            log_event("camera_disposed", "Camera disposed successfully.")
 
             # Dispose of the SDK
             self._sdk.dispose()
-            print("SDK disposed successfully.")
+            log_event("sdk_disposed", "SDK disposed successfully.")
 
         except Exception as e:
-            print(f"An error occurred while stopping the live view: {e}")
+            log_event("live_view_stop_failed", f"An error occurred while stopping the live view: {e}", logging.ERROR,
+                      error=str(e))
 
         self._root.quit()
-        print("Camera resources closed.")
+        log_event("camera_closed", "Camera resources closed.")
 
     def take_picture(self, image_path):
         """Capture an image and save it to the specified path."""
@@ -211,21 +322,21 @@ class CameraController:
         exposure_time_us = int(self._exposure_scale.get())
         try:
             self._camera.exposure_time_us = exposure_time_us
-            print(f"Exposure time set to {exposure_time_us} us")
+            log_event("exposure_set", f"Exposure time set to {exposure_time_us} us", exposure_us=exposure_time_us)
         except Exception as e:
-            print(f"Failed to set exposure time: {e}")
+            log_event("exposure_failed", f"Failed to set exposure time: {e}", logging.WARNING,
+                      exposure_us=exposure_time_us, error=str(e))
             try:
                 self._camera.disarm()
                 self._camera.exposure_time_us = exposure_time_us
                 self._camera.arm(2)
                 self._camera.issue_software_trigger()
-                print(f"Exposure time set to {exposure_time_us} us after re-arming")
+                log_event("exposure_set", f"Exposure time set to {exposure_time_us} us after re-arming",
+                          exposure_us=exposure_time_us, rearmed=True)
             except Exception as e:
-                print(f"Failed to set exposure time after re-arming: {e}")
-
-# Custom TIFF tags
-TAG_BITDEPTH = 32768
-TAG_EXPOSURE = 32769
+                CAMERA_ERRORS.inc(kind="exposure")
+                log_event("exposure_failed", f"Failed to set exposure time after re-arming: {e}", logging.ERROR,
+                          exposure_us=exposure_time_us, rearmed=True, error=str(e))
 
 class CameraControllerSimple:
     """
@@ -235,17 +346,27 @@ class CameraControllerSimple:
     - No live view functionality.
     """
 
-    def __init__(self, exposure_time_us: int = 10000, bit_depth: int = 16):
+    def __init__(self, exposure_time_us: int = 10000, bit_depth: int = 16, writer: ImageWriter = None,
+                 ring_size: int = 8, sdk=None, profiler=None, serial_number: str = None, throttle=None,
+                 demosaic: bool = True, white_balance=None):
         """
         Initialize the camera controller with given exposure time (in microseconds) and bit depth.
+        If a writer is given, TIFF encoding and disk writes are handed off to it and take_image
+        returns as soon as the frame has been retrieved.
+        Frames are copied once into a preallocated ring of ring_size buffers shared with the writer.
+        sdk defaults to the Thorlabs TLCameraSDK; pass e.g. a SimulatedTLCameraSDK to run without hardware.
+        A StageProfiler records the time spent triggering, waiting for readout, copying and writing each frame.
+        serial_number selects the camera (default: the first one found).
+        A DiskThrottle shared between processes limits the combined write bandwidth of several rigs.
+        Frames of colour cameras are saved as demosaiced RGB (with the camera's or the given white_balance
+        gains) unless demosaic is False, in which case the raw Bayer mosaics are kept.
         """
-        self._sdk = TLCameraSDK()
-        camera_list = self._sdk.discover_available_cameras()
-        if not camera_list:
+        self._sdk = sdk if sdk is not None else TLCameraSDK()
+        try:
+            self._camera = open_camera(self._sdk, serial_number)
+        except Exception:
             self._sdk.dispose()
-            raise Exception("No cameras found.")
-
-        self._camera = self._sdk.open_camera(camera_list[0])
+            raise
 
         # Configure the camera
         # Ensure that requested bit depth is supported by the camera
@@ -255,46 +376,250 @@ class CameraControllerSimple:
 
         self._camera.bit_depth = bit_depth
         self._camera.exposure_time_us = exposure_time_us
-        self._camera.frames_per_trigger_zero_for_unlimited = 0
+        self._camera.frames_per_trigger_zero_for_unlimited = 1  # One frame per trigger, no stale frames from a stream
         self._camera.image_poll_timeout_ms = 2000  # set a reasonable timeout (2s)
         self._camera.arm(2)  # Prepare camera for acquisition
 
         # Store parameters for later use (e.g. in TIFF tags)
         self._bit_depth = bit_depth
         self._exposure = exposure_time_us
+        self.serial_number = self._camera.serial_number
+        self._current_exposure = exposure_time_us
+        self._calibrations = {}
         self._image_width = self._camera.image_width_pixels
         self._image_height = self._camera.image_height_pixels
-        self._is_color_camera = (self._camera.camera_sensor_type == SENSOR_TYPE.BAYER)
+        self.is_color_camera = (self._camera.camera_sensor_type == SENSOR_TYPE.BAYER)
+        self.color = None
+        if self.is_color_camera and demosaic:
+            self.color = ColorProcessor.from_camera(self._camera, bit_depth, white_balance)
+        self._writer = writer
+        self._throttle = throttle
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
+        self._frame_ring = FrameRing(
+            ring_size, self._image_height, self._image_width,
+            dtype=np.uint8 if bit_depth <= 8 else np.uint16
+        )
 
-    def take_image(self, filename):
+    def capture_frame(self):
         """
-        Capture a single image from the camera and save it as a TIFF file.
+        Trigger the camera and return the frame as a FrameSlot of the frame ring.
+        The caller owns one reference and must release() it when done.
         """
-        if os.path.exists(filename):
-            os.remove(filename)
-
         # Issue a single software trigger to capture one frame
-        self._camera.issue_software_trigger()
+        with self.profiler.stage("trigger"):
+            self._camera.issue_software_trigger()
+        return self.receive_frame()
 
+    def receive_frame(self):
+        """
+        Wait for the next frame (e.g. from a hardware trigger) and return it as a FrameSlot of the frame ring.
+        """
         # Retrieve the frame
-        frame = self._camera.get_pending_frame_or_null()
+        with self.profiler.stage("readout"):
+            frame = self._camera.get_pending_frame_or_null()
         if frame is None:
+            CAMERA_ERRORS.inc(kind="frame_timeout")
             raise TimeoutError("No frame received from the camera within the timeout period.")
+        FRAMES_RECEIVED.inc(source="capture")
 
-        # Convert the image data depending on bit depth:
         # The frame.image_buffer is a numpy array of np.uint16 if bit_depth>8, np.uint8 otherwise.
-        # For higher bit depths, you may want to handle scaling or direct saving.
-        image_data = frame.image_buffer.reshape(self._image_height, self._image_width)
+        # It is owned by the SDK and reused for the next frame, so it is copied into the ring here.
+        with self.profiler.stage("copy"):
+            slot = self._frame_ring.put(frame.image_buffer, frame.frame_count)
 
-        # Save the image as a TIFF with custom tags
-        with tifffile.TiffWriter(filename+str(".tiff"), append=False) as tiff:
+        # Dark and flat correction in place on the ring, before any consumer sees the frame
+        calibration = self._calibrations.get(self._current_exposure)
+        if calibration is not None:
+            try:
+                with self.profiler.stage("calibrate"):
+                    calibration.apply(slot.array)
+            except Exception:
+                slot.release()
+                raise
+        return slot
+
+    def set_calibration(self, calibrations):
+        """
+        Correct every received frame with the FrameCalibration for its exposure time (a dict by exposure
+        in microseconds); frames at exposures without calibration are left as they are.
+        """
+        self._calibrations = dict(calibrations or {})
+
+    def _write_and_release(self, slots, nbytes, frame, write_fn, *args, on_written=None):
+        try:
+            if self._throttle is not None:
+                with self.profiler.stage("throttle", frame=frame):
+                    self._throttle.acquire(nbytes)
+            with self.profiler.stage("write", frame=frame, nbytes=nbytes), IMAGE_WRITE_SECONDS.time():
+                write_fn(*args)
+            IMAGES_WRITTEN.inc()
+            BYTES_WRITTEN.inc(nbytes)
+            if on_written is not None:
+                on_written()
+        finally:
+            for slot in slots:
+                slot.release()
+
+    def _store(self, slots, write_fn, *args, nbytes=None, on_written=None):
+        # Write the frames in the background if a writer is set; the slots are released once written
+        frame = self.profiler.current_frame
+        if nbytes is None:
+            nbytes = sum(slot.array.nbytes for slot in slots)
+        if self._writer is None:
+            self._write_and_release(slots, nbytes, frame, write_fn, *args, on_written=on_written)
+            return
+        try:
+            with self.profiler.stage("writer_wait"):
+                self._writer.submit(self._write_and_release, slots, nbytes, frame, write_fn, *args,
+                                    on_written=on_written)
+        except Exception:
+            for slot in slots:
+                slot.release()
+            raise
+
+    def write_tiff(self, filename, image_data):
+        """
+        Save image data as a TIFF file with the custom bit depth and exposure tags.
+        The file is written under a temporary name and renamed, so an existing image is only
+        replaced by a complete one.
+        """
+        filename = filename + str(".tiff")
+        temp_filename = filename + ".tmp"
+
+        with tifffile.TiffWriter(temp_filename, append=False) as tiff:
             tiff.write(
                 data=image_data,
+                photometric='rgb' if image_data.ndim == 3 else 'minisblack',
                 extratags=[
                     (TAG_BITDEPTH, 'I', 1, self._bit_depth, False),
                     (TAG_EXPOSURE, 'I', 1, self._exposure, False)
                 ]
             )
+        os.replace(temp_filename, filename)
+
+    def _develop(self, frame):
+        # Colour frames are demosaiced on the writer thread, so the capture loop only copies the raw mosaic
+        if self.color is None:
+            return frame
+        with self.profiler.stage("demosaic"):
+            return self.color.process(frame)
+
+    def _stored_nbytes(self, slot):
+        return slot.array.nbytes * (3 if self.color is not None else 1)
+
+    def write_frame(self, filename, frame):
+        """
+        Save a raw frame as a TIFF file, as RGB for colour cameras.
+        """
+        self.write_tiff(filename, self._develop(frame))
+
+    def _write_to_container(self, container, frame, metadata):
+        container.write_frame(self._develop(frame), metadata)
+
+    def save_frame(self, slot, filename, on_written=None):
+        """
+        Save a captured frame as a TIFF file and release it.
+        With a writer, the file is written in the background and errors surface on a later call.
+        on_written is called without arguments once the file is complete.
+        """
+        self._store([slot], self.write_frame, filename, slot.array, nbytes=self._stored_nbytes(slot),
+                    on_written=on_written)
+
+    def save_frame_to_container(self, slot, container: ScanContainer, on_written=None, **metadata):
+        """
+        Append a captured frame to a scan container together with per-frame metadata and release it.
+        """
+        metadata.setdefault("timestamp", time.time())
+        metadata["exposure_us"] = self._exposure
+        self._store([slot], self._write_to_container, container, slot.array, metadata,
+                    nbytes=self._stored_nbytes(slot), on_written=on_written)
+
+    def _set_exposure(self, exposure_time_us):
+        # The TSI cameras accept a new exposure while armed; otherwise fall back to re-arming like the live view
+        try:
+            self._camera.exposure_time_us = exposure_time_us
+        except Exception as e:
+            log_event("exposure_rearm", f"Setting the exposure while armed failed, re-arming: {e}", logging.WARNING,
+                      exposure_us=exposure_time_us, error=str(e))
+            self._camera.disarm()
+            self._camera.exposure_time_us = exposure_time_us
+            self._camera.arm(2)
+        self._current_exposure = exposure_time_us
+
+    def capture_bracket(self, exposures_us):
+        """
+        Capture one frame per exposure time, back to back without disarming the camera,
+        and return them as FrameSlots. The configured exposure is restored afterwards.
+        """
+        slots = []
+        try:
+            for exposure_us in exposures_us:
+                self._set_exposure(exposure_us)
+                slots.append(self.capture_frame())
+        except Exception:
+            for slot in slots:
+                slot.release()
+            raise
+        finally:
+            self._set_exposure(self._exposure)
+        return slots
+
+    def write_hdr(self, filename, frames, exposures_us):
+        """
+        Merge a bracket into float32 radiance, scaled to the configured exposure, and save it as a TIFF file.
+        Colour brackets are merged as raw mosaics and demosaiced afterwards.
+        """
+        with self.profiler.stage("merge"):
+            radiance = merge_exposures(frames, exposures_us, self._exposure, self._bit_depth)
+        self.write_frame(filename, radiance)
+
+    def save_bracket(self, slots, exposures_us, filename, on_written=None):
+        """
+        Merge and save a bracket from capture_bracket() and release its frames.
+        With a writer, the merge runs in the background, e.g. while the stage moves to the next view.
+        """
+        frames = [slot.array for slot in slots]
+        nbytes = frames[0].size * np.dtype(np.float32).itemsize * (3 if self.color is not None else 1)
+        self._store(slots, self.write_hdr, filename, frames, exposures_us, nbytes=nbytes, on_written=on_written)
+
+    def take_image(self, filename):
+        """
+        Capture a single image from the camera and save it as a TIFF file.
+        """
+        self.save_frame(self.capture_frame(), filename)
+
+    def take_image_to_container(self, container: ScanContainer, **metadata):
+        """
+        Capture a single image and append it to a scan container together with per-frame metadata.
+        """
+        metadata["timestamp"] = time.time()
+        self.save_frame_to_container(self.capture_frame(), container, **metadata)
+
+    def start_hardware_triggered(self):
+        """
+        Re-arm the camera so that every rising edge on its trigger input exposes exactly one frame.
+        """
+        self._camera.disarm()
+        self._camera.operation_mode = OPERATION_MODE.HARDWARE_TRIGGERED
+        self._camera.trigger_polarity = TRIGGER_POLARITY.ACTIVE_HIGH
+        self._camera.frames_per_trigger_zero_for_unlimited = 1
+        self._camera.arm(len(self._frame_ring))  # Buffer frames in the SDK while the host is busy
+
+    def stop_hardware_triggered(self):
+        """
+        Return to software triggered single frame acquisition.
+        """
+        self._camera.disarm()
+        self._camera.operation_mode = OPERATION_MODE.SOFTWARE_TRIGGERED
+        self._camera.frames_per_trigger_zero_for_unlimited = 1
+        self._camera.arm(2)
+
+    def flush(self):
+        """
+        Wait until all images handed to the writer have been saved.
+        """
+        if self._writer is not None:
+            self._writer.flush()
 
     def close(self):
         """
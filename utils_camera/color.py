@@ -0,0 +1,135 @@
+# utils_camera/color.py
+
+import numpy as np
+
+# Colour of the top left pixel of the 2x2 Bayer cell for the TSI FILTER_PHASE values
+BAYER_PATTERNS = {0: "RGGB", 1: "BGGR", 2: "GRBG", 3: "GBRG"}
+CHANNELS = {"R": 0, "G": 1, "B": 2}
+# Rows demosaiced at a time (even, so every tile starts on the same Bayer phase)
+TILE_ROWS = 64
+
+
+def parse_gains(text):
+    """
+    Parse white balance gains 'r,g,b', e.g. '1.9,1.0,1.6'; an empty string gives None.
+    """
+    gains = [float(value) for value in text.split(",") if value.strip()]
+    if gains and len(gains) != 3:
+        raise ValueError(f"Expected three white balance gains (r,g,b), got {text!r}.")
+    return gains or None
+
+
+class ColorProcessor:
+    """
+    Develops raw Bayer mosaics of colour sensors into RGB:
+    - Bilinear demosaicing, done on strided views of the four Bayer phases instead of per pixel.
+    - White balance gains and the colour correction matrix are combined into one 3x3 matrix applied per pixel.
+    - Full frames are processed in tiles of TILE_ROWS rows, so the float scratch buffers stay small.
+    - preview() bins every 2x2 cell into one RGB pixel, which is all a reduced-resolution live view needs.
+    """
+
+    def __init__(self, pattern, bit_depth, white_balance=None, color_matrix=None):
+        if pattern not in BAYER_PATTERNS.values():
+            raise ValueError(f"Unknown Bayer pattern {pattern!r}, expected one of {list(BAYER_PATTERNS.values())}.")
+        self.pattern = pattern
+        self.bit_depth = bit_depth
+        self._max_value = 2 ** bit_depth - 1
+        gains = np.diag(np.asarray(white_balance if white_balance is not None else (1, 1, 1), dtype=np.float32))
+        matrix = np.asarray(color_matrix if color_matrix is not None else np.eye(3), dtype=np.float32).reshape(3, 3)
+        self.matrix = matrix @ gains
+
+    @classmethod
+    def from_camera(cls, camera, bit_depth, white_balance=None):
+        """
+        Processor for a TSI colour camera, using its filter phase, default white balance and colour correction
+        matrix where the camera reports them; white_balance gains (r, g, b) override the camera's.
+        """
+        pattern = BAYER_PATTERNS[int(getattr(camera, "color_filter_array_phase", 0))]
+        if white_balance is None and hasattr(camera, "get_default_white_balance_matrix"):
+            white_balance = np.diag(np.asarray(camera.get_default_white_balance_matrix()).reshape(3, 3))
+        color_matrix = None
+        if hasattr(camera, "get_color_correction_matrix"):
+            color_matrix = camera.get_color_correction_matrix()
+        return cls(pattern, bit_depth, white_balance, color_matrix)
+
+    def _output(self, rgb, out):
+        # Colour transform of one tile into the output, clipped to the raw range for integer outputs
+        np.matmul(rgb, self.matrix.T, out=rgb)
+        if np.issubdtype(out.dtype, np.integer):
+            np.clip(rgb, 0, self._max_value, out=rgb)
+            np.rint(rgb, out=rgb)
+        else:
+            # Float (HDR) data may exceed full scale
+            np.maximum(rgb, 0, out=rgb)
+        np.copyto(out, rgb, casting='unsafe')
+
+    def _demosaic_tile(self, padded, rgb):
+        # padded holds the tile with a one pixel border; every colour is either measured at a pixel or the mean
+        # of its cross, diagonal, horizontal or vertical neighbours
+        height, width = rgb.shape[:2]
+        center = padded[1:-1, 1:-1]
+        up, down = padded[:-2, 1:-1], padded[2:, 1:-1]
+        left, right = padded[1:-1, :-2], padded[1:-1, 2:]
+        horizontal = (left + right) / 2
+        vertical = (up + down) / 2
+        cross = (horizontal + vertical) / 2
+        diagonal = (padded[:-2, :-2] + padded[:-2, 2:] + padded[2:, :-2] + padded[2:, 2:]) / 4
+        for y in range(2):
+            for x in range(2):
+                site = self.pattern[2 * y + x]
+                cell = (slice(y, height, 2), slice(x, width, 2))
+                if site == "G":
+                    row_color = self.pattern[2 * y + 1 - x]
+                    column_color = "B" if row_color == "R" else "R"
+                    rgb[cell + (1,)] = center[cell]
+                    rgb[cell + (CHANNELS[row_color],)] = horizontal[cell]
+                    rgb[cell + (CHANNELS[column_color],)] = vertical[cell]
+                else:
+                    other = "B" if site == "R" else "R"
+                    rgb[cell + (CHANNELS[site],)] = center[cell]
+                    rgb[cell + (1,)] = cross[cell]
+                    rgb[cell + (CHANNELS[other],)] = diagonal[cell]
+
+    def process(self, frame, out=None):
+        """
+        Demosaic a full raw frame into an RGB image (height x width x 3) of the same data type,
+        white balanced and colour corrected. out may be a preallocated result array.
+        """
+        height, width = frame.shape
+        if out is None:
+            out = np.empty((height, width, 3), dtype=frame.dtype if np.issubdtype(frame.dtype, np.integer)
+                           else np.float32)
+        rgb = np.empty((min(TILE_ROWS, height), width, 3), dtype=np.float32)
+        for top in range(0, height, TILE_ROWS):
+            bottom = min(top + TILE_ROWS, height)
+            # The tile with one row of context above and below; mirroring at the frame edges keeps the Bayer phase
+            halo = frame[max(top - 1, 0):bottom + 1].astype(np.float32)
+            if top == 0:
+                halo = np.concatenate([halo[1:2], halo])
+            if bottom == height:
+                halo = np.concatenate([halo, halo[-2:-1]])
+            padded = np.pad(halo, ((0, 0), (1, 1)), mode='reflect')
+            tile = rgb[:bottom - top]
+            self._demosaic_tile(padded, tile)
+            self._output(tile, out[top:bottom])
+        return out
+
+    def preview(self, frame, step=1):
+        """
+        Reduced-resolution RGB image of a raw frame: every 2x2 Bayer cell becomes one pixel
+        (the two greens are averaged), keeping every step-th cell. Returned with the data type of the frame.
+        """
+        stride = 2 * max(step, 1)
+        planes = {}
+        for y in range(2):
+            for x in range(2):
+                planes.setdefault(self.pattern[2 * y + x], []).append(frame[y::stride, x::stride])
+        height = min(plane.shape[0] for channel in planes.values() for plane in channel)
+        width = min(plane.shape[1] for channel in planes.values() for plane in channel)
+        rgb = np.empty((height, width, 3), dtype=np.float32)
+        for color, channel in planes.items():
+            rgb[..., CHANNELS[color]] = sum(plane[:height, :width].astype(np.float32) for plane in channel)
+            rgb[..., CHANNELS[color]] /= len(channel)
+        out = np.empty((height, width, 3), dtype=frame.dtype)
+        self._output(rgb, out)
+        return out
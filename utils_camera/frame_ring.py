@@ -0,0 +1,99 @@
+# utils_camera/frame_ring.py
+
+import threading
+import collections
+import numpy as np
+
+
+class FrameSlot:
+    """
+    A frame stored in one slot of a FrameRing.
+    - array is a view into the ring, shared by all consumers (writer, live view, analysis) without copying.
+    - Every consumer that keeps the slot beyond the producer's hand-off calls retain() and later release().
+    - The slot is reused for a new frame once its last reference has been released.
+    """
+
+    def __init__(self, ring, index, array, frame_count=None):
+        self._ring = ring
+        self.index = index
+        self.array = array
+        self.frame_count = frame_count
+
+    def retain(self):
+        self._ring._retain(self.index)
+        return self
+
+    def release(self):
+        self._ring._release(self.index)
+
+
+class FrameRing:
+    """
+    Preallocated ring of frame buffers:
+    - Camera frames are copied into a free slot exactly once (the SDK reuses its own buffer for the next frame).
+    - No arrays are allocated per frame, which avoids allocation churn and GC pauses at high frame rates.
+    - put() blocks while all slots are in use (backpressure), try_put() returns None so callers can drop the frame.
+    """
+
+    def __init__(self, n_slots, height, width, dtype=np.uint16):
+        self.height = height
+        self.width = width
+        self._buffers = np.empty((n_slots, height, width), dtype=dtype)
+        self._refcounts = [0] * n_slots
+        self._free = collections.deque(range(n_slots))
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return len(self._refcounts)
+
+    @property
+    def dtype(self):
+        return self._buffers.dtype
+
+    def _retain(self, index):
+        with self._condition:
+            if self._refcounts[index] <= 0:
+                raise RuntimeError(f"Frame slot {index} has already been released.")
+            self._refcounts[index] += 1
+
+    def _release(self, index):
+        with self._condition:
+            if self._refcounts[index] <= 0:
+                raise RuntimeError(f"Frame slot {index} has already been released.")
+            self._refcounts[index] -= 1
+            if self._refcounts[index] == 0:
+                self._free.append(index)
+                self._condition.notify()
+
+    def _acquire(self, timeout):
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._free, timeout=timeout):
+                return None
+            index = self._free.popleft()
+            self._refcounts[index] = 1
+            return index
+
+    def _fill(self, index, image_buffer, frame_count):
+        array = self._buffers[index]
+        # Single copy from the SDK buffer (flat or 2D) into the preallocated slot
+        np.copyto(array, np.reshape(image_buffer, (self.height, self.width)))
+        return FrameSlot(self, index, array, frame_count)
+
+    def put(self, image_buffer, frame_count=None, timeout=None):
+        """
+        Copy image_buffer into a free slot, waiting for one if necessary.
+        The returned slot holds one reference owned by the caller.
+        """
+        index = self._acquire(timeout)
+        if index is None:
+            raise TimeoutError("No free frame buffer became available within the timeout period.")
+        return self._fill(index, image_buffer, frame_count)
+
+    def try_put(self, image_buffer, frame_count=None):
+        """
+        Like put(), but return None instead of waiting when all slots are in use.
+        """
+        index = self._acquire(timeout=0)
+        if index is None:
+            return None
+        return self._fill(index, image_buffer, frame_count)
@@ -0,0 +1,54 @@
+# utils_camera/hdr.py
+
+import functools
+import numpy as np
+
+# Raw values above this fraction of full scale count as saturated
+SATURATION = 0.98
+
+
+@functools.lru_cache(maxsize=None)
+def exposure_weights(bit_depth):
+    """
+    Lookup table of the merge weight of every raw value: a hat function peaking at mid scale,
+    with a small floor for dark values and no weight for saturated ones.
+    """
+    max_value = 2 ** bit_depth - 1
+    values = np.arange(max_value + 1, dtype=np.float32)
+    weights = np.maximum(1 - np.abs(2 * values / max_value - 1), 1e-3)
+    weights[values >= SATURATION * max_value] = 0
+    return weights
+
+
+def parse_exposures(text):
+    """
+    Parse a comma separated list of exposure times in microseconds, e.g. '2500,10000,40000'.
+    """
+    return [int(value) for value in text.split(",") if value.strip()]
+
+
+def merge_exposures(frames, exposures_us, reference_exposure_us, bit_depth):
+    """
+    Merge a bracket of raw frames of one view into float32 radiance, in counts of a frame taken at
+    reference_exposure_us (values above full scale are highlights that clipped at that exposure).
+    The frames are accumulated one at a time into two buffers, so memory does not grow with the bracket size.
+    """
+    weights = exposure_weights(bit_depth)
+    shape = frames[0].shape
+    numerator = np.zeros(shape, dtype=np.float32)
+    denominator = np.zeros(shape, dtype=np.float32)
+    weight = np.empty(shape, dtype=np.float32)
+    scaled = np.empty(shape, dtype=np.float32)
+    for frame, exposure_us in zip(frames, exposures_us):
+        np.take(weights, frame, out=weight)
+        np.multiply(frame, reference_exposure_us / exposure_us, out=scaled)
+        scaled *= weight
+        numerator += scaled
+        denominator += weight
+
+    # Pixels saturated in every frame keep the clipped value of the shortest exposure
+    clipped = denominator == 0
+    np.divide(numerator, denominator, out=numerator, where=~clipped)
+    shortest = int(np.argmin(exposures_us))
+    numerator[clipped] = frames[shortest][clipped] * (reference_exposure_us / exposures_us[shortest])
+    return numerator
@@ -0,0 +1,98 @@
+# utils_camera/image_writer.py
+
+import logging
+import queue
+import threading
+
+from utils_acquisition.metrics import REGISTRY, log_event
+
+WRITER_QUEUE_DEPTH = REGISTRY.gauge("writer_queue_depth", "Write jobs waiting for an ImageWriter worker.")
+WRITER_JOBS = REGISTRY.counter("writer_jobs_total", "Write jobs completed by ImageWriter workers.")
+WRITER_ERRORS = REGISTRY.counter("writer_errors_total", "Write jobs that raised an error.")
+WRITER_BLOCKED = REGISTRY.histogram("writer_submit_blocked_seconds", "Time submit() waited for room in a full queue.")
+
+
+class ImageWriter:
+    """
+    Bounded background stage for encoding and writing images:
+    - Write jobs are executed on worker threads, so disk I/O overlaps with the next motor move.
+    - submit() blocks once max_pending jobs are waiting (backpressure).
+    - Errors raised by a job are re-raised on the acquisition thread by the next submit(), flush() or close().
+    """
+
+    def __init__(self, max_pending=4, num_workers=1):
+        """
+        Start the worker threads. Use a single worker if jobs must be written in order.
+        """
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._errors = []
+        self._errors_lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._run, name=f"ImageWriter-{i}", daemon=True)
+            for i in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        self._closed = False
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                write_fn, args, kwargs = job
+                write_fn(*args, **kwargs)
+                WRITER_JOBS.inc()
+            except Exception as error:
+                WRITER_ERRORS.inc()
+                log_event("write_failed", f"Writing an image failed: {error}", logging.ERROR, error=str(error))
+                with self._errors_lock:
+                    self._errors.append(error)
+            finally:
+                self._queue.task_done()
+                WRITER_QUEUE_DEPTH.set(self._queue.qsize())
+
+    def check(self):
+        """
+        Raise the first error reported by a worker since the last check.
+        """
+        with self._errors_lock:
+            if not self._errors:
+                return
+            error = self._errors[0]
+            self._errors.clear()
+        raise RuntimeError(f"Writing an image failed: {error}") from error
+
+    def submit(self, write_fn, *args, **kwargs):
+        """
+        Queue write_fn(*args, **kwargs) and return immediately unless the queue is full.
+        """
+        if self._closed:
+            raise RuntimeError("ImageWriter has already been closed.")
+        self.check()
+        with WRITER_BLOCKED.time():
+            self._queue.put((write_fn, args, kwargs))
+        WRITER_QUEUE_DEPTH.set(self._queue.qsize())
+
+    def flush(self):
+        """
+        Wait until all queued jobs have been written.
+        """
+        self._queue.join()
+        self.check()
+
+    def close(self):
+        """
+        Write all pending jobs and stop the worker threads.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.flush()
+        finally:
+            for _ in self._workers:
+                self._queue.put(None)
+            for worker in self._workers:
+                worker.join()
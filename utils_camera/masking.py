@@ -0,0 +1,209 @@
+# utils_camera/masking.py
+
+import os
+import json
+import bisect
+import shutil
+import itertools
+import numpy as np
+import tifffile
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageDraw
+
+from utils_camera.scan_container import ScanContainer
+
+MASK_EXTENSIONS = ('.png', '.tif', '.tiff')
+
+
+def rasterize_polygons(polygons, shape):
+    """
+    Boolean mask (height x width) of the polygons, filled by PIL's ImageDraw like the masks of the editor,
+    boundary pixels included. Polygons are lists of (x, y) points in pixel coordinates, as drawn in the editor.
+    """
+    height, width = shape
+    mask = Image.new('1', (width, height), 0)
+    draw = ImageDraw.Draw(mask)
+    for polygon in polygons:
+        # PIL needs at least two points; like in the editor, coordinates are truncated to whole pixels
+        if len(polygon) >= 2:
+            draw.polygon([tuple(point) for point in polygon], fill=1)
+    return np.array(mask, dtype=bool)
+
+
+def apply_mask(image, mask, fill=0):
+    """
+    Mask an image array in place: RGBA images become transparent in the masked area, others are set to fill.
+    """
+    if mask.shape != image.shape[:2]:
+        raise ValueError(f"Mask of shape {mask.shape} does not fit an image of shape {image.shape[:2]}.")
+    if image.ndim == 3 and image.shape[2] == 4:
+        image[mask, 3] = 0
+    else:
+        image[mask] = fill
+    return image
+
+
+class AngularMasks:
+    """
+    Masks of a turntable scan, drawn as polygon sets on a few keyframe views:
+    - A single keyframe, e.g. for the fixed background, applies to all angles.
+    - Between two keyframes, polygon sets with matching point counts are interpolated point by point,
+      so a mask can follow parts that turn with the stage; otherwise the nearer keyframe is used.
+    - Rasterized masks are cached per angle, so each is only computed once per process.
+    """
+
+    def __init__(self, shape, keyframes):
+        """
+        shape is the (height, width) of the images, keyframes maps angles in degrees to lists of polygons.
+        """
+        if not keyframes:
+            raise ValueError("At least one keyframe is needed.")
+        self.shape = tuple(shape)
+        self.keyframes = {float(angle) % 360: polygons for angle, polygons in keyframes.items()}
+        self._angles = sorted(self.keyframes)
+        self._cache = {}
+
+    def _compatible(self, first, second):
+        return len(first) == len(second) and all(len(a) == len(b) for a, b in zip(first, second))
+
+    def polygons_at(self, angle_deg):
+        """
+        Return the polygon set for a view at the given angle.
+        """
+        angle_deg = angle_deg % 360
+        if len(self._angles) == 1 or angle_deg in self.keyframes:
+            return self.keyframes.get(angle_deg, self.keyframes[self._angles[0]])
+
+        following = bisect.bisect_right(self._angles, angle_deg) % len(self._angles)
+        before, after = self._angles[following - 1], self._angles[following]
+        t = ((angle_deg - before) % 360) / ((after - before) % 360)
+        first, second = self.keyframes[before], self.keyframes[after]
+        if not self._compatible(first, second):
+            return first if t < 0.5 else second
+        return [
+            ((1 - t) * np.asarray(a, dtype=np.float64) + t * np.asarray(b, dtype=np.float64)).tolist()
+            for a, b in zip(first, second)
+        ]
+
+    def mask_at(self, angle_deg):
+        """
+        Return the boolean mask for a view at the given angle.
+        """
+        key = round(angle_deg % 360, 6)
+        if len(self._angles) == 1:
+            key = self._angles[0]
+        if key not in self._cache:
+            self._cache[key] = rasterize_polygons(self.polygons_at(key), self.shape)
+        return self._cache[key]
+
+    def save(self, path):
+        data = {
+            "shape": list(self.shape),
+            "keyframes": [{"angle_deg": angle, "polygons": self.keyframes[angle]} for angle in self._angles],
+        }
+        with open(path, "w") as f:
+            json.dump(data, f, indent=4)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["shape"], {keyframe["angle_deg"]: keyframe["polygons"] for keyframe in data["keyframes"]})
+
+
+# Masks of the worker processes, sent once when a worker starts instead of with every job
+_worker_masks = None
+
+
+def _init_worker(masks):
+    global _worker_masks
+    _worker_masks = masks
+
+
+def _mask_file(path, output_path, angle_deg, fill):
+    mask = _worker_masks.mask_at(angle_deg)
+    if path.lower().endswith(('.tif', '.tiff')):
+        # Uncompressed TIFF files are masked in place through a memory map, keeping their tags
+        if output_path != path:
+            shutil.copyfile(path, output_path)
+        image = tifffile.memmap(output_path, mode='r+')
+        apply_mask(image, mask, fill)
+        image.flush()
+    else:
+        image = np.array(Image.open(path).convert("RGBA"))
+        Image.fromarray(apply_mask(image, mask, fill)).save(output_path)
+
+
+def _mask_frames(path, start, angles, fill):
+    frames = ScanContainer.open_memmap(path, mode='r+')
+    for i, angle_deg in enumerate(angles, start):
+        apply_mask(frames[i], _worker_masks.mask_at(angle_deg), fill)
+    frames.flush()
+
+
+def view_angles(filenames, n_views=None):
+    """
+    Angles in degrees of views named by their index ({i}.tiff as written by the acquisition).
+    Files without an index in their name are numbered in order. The number of views of the scan defaults to
+    the highest index + 1, like in ScanDataset, so missing views or a view saved in several formats
+    do not shift the angles of the others.
+    """
+    stems = [os.path.splitext(filename)[0] for filename in filenames]
+    indices = [int(stem) if stem.isdigit() else i for i, stem in enumerate(stems)]
+    n_views = n_views or max([index + 1 for index in indices] + [len(set(stems))])
+    return [360.0 * index / n_views for index in indices]
+
+
+def _chunksize(n_jobs, processes):
+    return max(1, n_jobs // (4 * (processes or os.cpu_count() or 1)))
+
+
+def mask_directory(folder_path, masks, output_path=None, fill=0, n_views=None, processes=None):
+    """
+    Apply masks to all PNG and TIFF views in a folder with a pool of processes.
+    The files are overwritten unless output_path is given. Returns the number of masked images.
+    """
+    output_path = output_path or folder_path
+    os.makedirs(output_path, exist_ok=True)
+    filenames = sorted(
+        (filename for filename in os.listdir(folder_path) if filename.lower().endswith(MASK_EXTENSIONS)),
+        key=lambda filename: (len(filename), filename),
+    )
+    angles = view_angles(filenames, n_views)
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(masks,)) as executor:
+        # Neighbouring views go to the same worker, so interpolated masks are reused from its cache
+        list(executor.map(
+            _mask_file,
+            [os.path.join(folder_path, filename) for filename in filenames],
+            [os.path.join(output_path, filename) for filename in filenames],
+            angles,
+            itertools.repeat(fill),
+            chunksize=_chunksize(len(filenames), processes),
+        ))
+    return len(filenames)
+
+
+def mask_container(path, masks, output_path=None, fill=0, processes=None):
+    """
+    Apply masks to all frames of a scan container with a pool of processes, using the angle in the frame metadata.
+    The container is masked in place unless output_path is given. Returns the number of masked frames.
+    """
+    if output_path and output_path != path:
+        shutil.copyfile(path, output_path)
+        shutil.copyfile(ScanContainer.metadata_path_for(path), ScanContainer.metadata_path_for(output_path))
+        path = output_path
+    records = ScanContainer.read_metadata(path)
+    angles = [record.get("angle_deg", 360.0 * i / len(records)) for i, record in enumerate(records)]
+
+    # Every job masks a contiguous range of frames through its own memory map of the container
+    chunk = _chunksize(len(angles), processes)
+    starts = list(range(0, len(angles), chunk))
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(masks,)) as executor:
+        list(executor.map(
+            _mask_frames,
+            itertools.repeat(path),
+            starts,
+            [angles[start:start + chunk] for start in starts],
+            itertools.repeat(fill),
+        ))
+    return len(angles)
@@ -0,0 +1,62 @@
+# utils_camera/preview.py
+
+import math
+import numpy as np
+
+
+class PreviewRenderer:
+    """
+    Turns full-sensor frames into small 8 bit preview images for the live view:
+    - Frames are decimated with a strided view to fit the preview size before any pixel is converted.
+    - Values are mapped to 8 bit with a precomputed auto-contrast lookup table instead of per-frame arithmetic.
+    - The lookup table is refreshed from the frame percentiles every lut_interval frames.
+    - Bayer mosaics of colour cameras are binned into RGB by a ColorProcessor, at the decimated size.
+    """
+
+    def __init__(self, bit_depth, max_width, max_height, lut_interval=15, percentiles=(0.5, 99.5), color=None):
+        self._bit_depth = bit_depth
+        self._color = color
+        self._max_width = max_width
+        self._max_height = max_height
+        self._lut_interval = lut_interval
+        self._percentiles = percentiles
+        self._frames_since_lut = lut_interval
+        self._lut = self.build_lut(bit_depth, 0, 2 ** bit_depth - 1)
+        self._buffer = None
+
+    @staticmethod
+    def build_lut(bit_depth, low, high):
+        """
+        Lookup table mapping [low, high] of a bit_depth image linearly to [0, 255].
+        """
+        values = np.arange(2 ** bit_depth, dtype=np.float32)
+        scale = 255.0 / max(high - low, 1)
+        return np.clip((values - low) * scale, 0, 255).astype(np.uint8)
+
+    def _update_lut(self, decimated):
+        # A sparse sample is enough to estimate the percentiles
+        sample = decimated[::4, ::4]
+        low, high = np.percentile(sample, self._percentiles)
+        self._lut = self.build_lut(self._bit_depth, low, high)
+        self._frames_since_lut = 0
+
+    def render(self, frame):
+        """
+        Return the decimated, contrast-stretched 8 bit preview of frame (RGB for colour cameras).
+        The returned array is reused by the next call.
+        """
+        height, width = frame.shape
+        step = max(math.ceil(height / self._max_height), math.ceil(width / self._max_width), 1)
+        if self._color is not None:
+            # Binning the 2x2 Bayer cells already halves the resolution
+            decimated = self._color.preview(frame, math.ceil(step / 2))
+        else:
+            decimated = frame[::step, ::step]
+        if self._frames_since_lut >= self._lut_interval:
+            self._update_lut(decimated)
+        self._frames_since_lut += 1
+
+        if self._buffer is None or self._buffer.shape != decimated.shape:
+            self._buffer = np.empty(decimated.shape, dtype=np.uint8)
+        np.take(self._lut, decimated, out=self._buffer, mode='clip')
+        return self._buffer
@@ -0,0 +1,93 @@
+# utils_camera/scan_container.py
+
+import os
+import json
+import tifffile
+
+# Custom TIFF tags, shared with the per-view TIFF files of CameraControllerSimple
+TAG_BITDEPTH = 32768
+TAG_EXPOSURE = 32769
+
+
+class ScanContainer:
+    """
+    Single-file container holding all views of a scan:
+    - Frames are appended to one BigTIFF as a contiguous, uncompressed series, so it can be memory-mapped.
+    - The custom bit depth and exposure tags are written once, on the first page.
+    - Per-frame metadata (view, angle, steps, exposure, timestamp, ...) is appended to a JSON lines sidecar.
+    Frames must be written in order, e.g. from a single-worker ImageWriter.
+    """
+
+    def __init__(self, path, bit_depth, exposure_time_us):
+        """
+        Create a new container at path (an existing container is replaced).
+        """
+        self.path = path
+        self.metadata_path = self.metadata_path_for(path)
+        self._bit_depth = bit_depth
+        self._exposure = exposure_time_us
+        self._n_frames = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        for existing in (self.path, self.metadata_path):
+            if os.path.exists(existing):
+                os.remove(existing)
+
+        self._tiff = tifffile.TiffWriter(self.path, bigtiff=True)
+        self._metadata_file = open(self.metadata_path, "w")
+
+    @staticmethod
+    def metadata_path_for(path):
+        return os.path.splitext(path)[0] + ".jsonl"
+
+    def __len__(self):
+        return self._n_frames
+
+    def write_frame(self, image_data, metadata=None):
+        """
+        Append one frame and its metadata to the container.
+        """
+        extratags = None
+        if self._n_frames == 0:
+            extratags = [
+                (TAG_BITDEPTH, 'I', 1, self._bit_depth, False),
+                (TAG_EXPOSURE, 'I', 1, self._exposure, False)
+            ]
+        self._tiff.write(data=image_data, contiguous=True, extratags=extratags)
+
+        record = {"index": self._n_frames}
+        record.update(metadata or {})
+        self._metadata_file.write(json.dumps(record) + "\n")
+        self._metadata_file.flush()
+        self._n_frames += 1
+
+    def close(self):
+        """
+        Finalize the TIFF series and close the metadata sidecar.
+        """
+        if self._tiff is not None:
+            self._tiff.close()
+            self._tiff = None
+        if not self._metadata_file.closed:
+            self._metadata_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def open_memmap(path, mode='r'):
+        """
+        Memory-map all frames of a finished container as a (n_views, height, width) array.
+        """
+        return tifffile.memmap(path, mode=mode)
+
+    @staticmethod
+    def read_metadata(path):
+        """
+        Return the per-frame metadata records of a container as a list of dicts.
+        """
+        with open(ScanContainer.metadata_path_for(path)) as metadata_file:
+            return [json.loads(line) for line in metadata_file if line.strip()]
@@ -0,0 +1,234 @@
+# utils_camera/scan_dataset.py
+
+import os
+import json
+import bisect
+import threading
+import numpy as np
+import tifffile
+from PIL import Image
+
+from utils_camera.scan_container import ScanContainer, TAG_BITDEPTH, TAG_EXPOSURE
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff')
+
+
+def view_number(filename):
+    """
+    Index of a view named by its number ('10.png' -> 10), or None for other names.
+    """
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return int(stem) if stem.isdigit() else None
+
+
+def natural_key(filename):
+    # '2.png' sorts before '10.png'
+    number = view_number(filename)
+    return (0, number, filename) if number is not None else (1, 0, filename)
+
+
+class ScanView:
+    """
+    One view of a scan: index, angle, pose and metadata are known from the index,
+    the image and its TIFF tags are only read when used.
+    """
+
+    def __init__(self, dataset, index, path, angle_deg, pose=None, metadata=None):
+        self._dataset = dataset
+        self.index = index
+        self.path = path
+        self.angle_deg = angle_deg
+        self.pose = pose
+        self.metadata = metadata or {}
+
+    @property
+    def image(self):
+        return self._dataset.image(self.index)
+
+    @property
+    def bit_depth(self):
+        return self._dataset.tags(self.index).get("bit_depth")
+
+    @property
+    def exposure_us(self):
+        return self.metadata.get("exposure_us", self._dataset.tags(self.index).get("exposure_us"))
+
+    def __repr__(self):
+        return f"ScanView(index={self.index}, angle_deg={self.angle_deg:.2f}, path={self.path!r})"
+
+
+class ScanDataset:
+    """
+    Lazy reader of a scan, either a directory data/<scan> with images/ and transforms*.json
+    or a scan container:
+    - Opening only builds an index of view -> file, angle, pose and metadata; no image is decoded.
+    - Views are ordered by their number, so '10.png' comes after '2.png'.
+    - Angles come from the stage positions in the scan journal if there is one, otherwise from the view numbers.
+    - Uncompressed TIFF views and containers are memory-mapped, other formats are decoded on access,
+      so only touched frames use memory.
+    - dataset[i] returns the image of a view, dataset[a:b] a list of images, view(i) the ScanView
+      and between(start_deg, stop_deg) the views in an angle range.
+    """
+
+    def __init__(self, path, transforms="transforms.json", images="images"):
+        self.path = path
+        self.camera_angle_x = None
+        self.camera_angle_y = None
+        self._is_container = os.path.isfile(path)
+        self._container = None
+        self._headers = {}
+        self._lock = threading.Lock()
+
+        if self._is_container:
+            self._views = self._index_container(path)
+        else:
+            self._views = self._index_directory(path, transforms, images)
+        self._sorted_angles = sorted((view.angle_deg, i) for i, view in enumerate(self._views))
+
+    def _index_container(self, path):
+        records = ScanContainer.read_metadata(path)
+        return [
+            ScanView(self, i, path, record.get("angle_deg", 360.0 * i / len(records)), metadata=record)
+            for i, record in enumerate(records)
+        ]
+
+    def _journal_angles(self):
+        # View number -> angle from the stage positions in the scan journal
+        journal_path = os.path.join(self.path, "journal.jsonl")
+        if not os.path.exists(journal_path):
+            return {}
+        steps_per_turn = None
+        angles = {}
+        with open(journal_path) as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                if record["event"] == "scan_started":
+                    steps_per_turn = record["steps_per_turn"]
+                elif record["event"] == "frame_written" and steps_per_turn:
+                    angles[record["view"]] = 360.0 * record["steps"] / steps_per_turn
+        return angles
+
+    def _index_directory(self, path, transforms, images):
+        poses = {}
+        transforms_path = os.path.join(path, transforms)
+        if os.path.exists(transforms_path):
+            with open(transforms_path) as f:
+                data = json.load(f)
+            self.camera_angle_x = data.get("camera_angle_x")
+            self.camera_angle_y = data.get("camera_angle_y")
+            for frame in data["frames"]:
+                file_path = os.path.normpath(os.path.join(path, frame["file_path"]))
+                if not os.path.splitext(file_path)[1]:
+                    file_path += ".png"  # Blender style paths without extension
+                poses[file_path] = np.asarray(frame["transform_matrix"], dtype=np.float64)
+            files = list(poses)
+        else:
+            image_directory = os.path.join(path, images)
+            files = [
+                os.path.join(image_directory, filename) for filename in os.listdir(image_directory)
+                if filename.lower().endswith(IMAGE_EXTENSIONS)
+            ]
+        files.sort(key=natural_key)
+
+        journal_angles = self._journal_angles()
+        numbers = [view_number(file_path) for file_path in files]
+        n_views = max([number + 1 for number in numbers if number is not None] + [len(files)])
+        views = []
+        for i, (file_path, number) in enumerate(zip(files, numbers)):
+            number = i if number is None else number
+            angle_deg = journal_angles.get(number, 360.0 * number / n_views)
+            views.append(ScanView(self, i, file_path, angle_deg, poses.get(file_path)))
+        return views
+
+    def __len__(self):
+        return len(self._views)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.image(i) for i in range(*index.indices(len(self)))]
+        return self.image(index)
+
+    def __iter__(self):
+        return (self.image(i) for i in range(len(self)))
+
+    def view(self, index):
+        return self._views[index]
+
+    @property
+    def views(self):
+        return list(self._views)
+
+    @property
+    def angles(self):
+        return np.array([view.angle_deg for view in self._views])
+
+    @property
+    def poses(self):
+        """
+        Camera-to-world matrices of all views (N x 4 x 4), or None if the scan has no transforms.
+        """
+        if any(view.pose is None for view in self._views):
+            return None
+        return np.stack([view.pose for view in self._views])
+
+    def between(self, start_deg, stop_deg):
+        """
+        Views with start_deg <= angle < stop_deg, in order of angle; ranges may wrap around 360 degrees.
+        """
+        if stop_deg - start_deg >= 360:
+            return [self._views[i] for _, i in self._sorted_angles]
+        start_deg, stop_deg = start_deg % 360, stop_deg % 360
+        first = bisect.bisect_left(self._sorted_angles, (start_deg, -1))
+        last = bisect.bisect_left(self._sorted_angles, (stop_deg, -1))
+        if start_deg <= stop_deg:
+            selected = self._sorted_angles[first:last]
+        else:
+            selected = self._sorted_angles[first:] + self._sorted_angles[:last]
+        return [self._views[i] for _, i in selected]
+
+    def _header(self, index):
+        # TIFF tags and data layout of a view, read once
+        path = self._views[index].path
+        with self._lock:
+            if path not in self._headers:
+                with tifffile.TiffFile(path) as tiff:
+                    page = tiff.pages.first
+                    bit_depth = page.tags.get(TAG_BITDEPTH)
+                    exposure = page.tags.get(TAG_EXPOSURE)
+                    self._headers[path] = {
+                        "bit_depth": bit_depth.value if bit_depth is not None else None,
+                        "exposure_us": exposure.value if exposure is not None else None,
+                        "offset": page.dataoffsets[0] if page.is_memmappable else None,
+                        "shape": page.shape,
+                        "dtype": page.dtype,
+                    }
+            return self._headers[path]
+
+    def tags(self, index):
+        """
+        Custom bit depth and exposure tags of a TIFF view (or of the container), empty for other formats.
+        """
+        if not self._views[index].path.lower().endswith(('.tif', '.tiff')):
+            return {}
+        return self._header(index)
+
+    def image(self, index):
+        """
+        Image of a view; memory-mapped and read-only for uncompressed TIFF data.
+        """
+        view = self._views[index]
+        if self._is_container:
+            with self._lock:
+                if self._container is None:
+                    self._container = ScanContainer.open_memmap(self.path)
+            return self._container[index]
+        if view.path.lower().endswith(('.tif', '.tiff')):
+            header = self._header(index)
+            if header["offset"] is not None:
+                return np.memmap(view.path, dtype=header["dtype"], mode='r', offset=header["offset"],
+                                 shape=header["shape"])
+            return tifffile.imread(view.path)
+        return np.asarray(Image.open(view.path))
@@ -0,0 +1,181 @@
+# utils_camera/segmentation.py
+
+import os
+import json
+import threading
+import numpy as np
+import tifffile
+from PIL import Image
+
+from utils_acquisition.metrics import REGISTRY, log_event
+
+SEGMENTED_VIEWS = REGISTRY.counter("segmented_views_total", "Views cut out into RGBA images.")
+SEGMENTATION_SECONDS = REGISTRY.histogram("segmentation_seconds", "Time to segment and write one view.")
+
+
+def capture_average(camera_controller, n_frames):
+    """
+    Mean of n_frames captures as float32, e.g. for the empty-stage or the dark reference frame.
+    """
+    total = None
+    for _ in range(n_frames):
+        slot = camera_controller.capture_frame()
+        try:
+            if total is None:
+                total = slot.array.astype(np.float32)
+            else:
+                total += slot.array
+        finally:
+            slot.release()
+    return total / n_frames
+
+
+def read_reference(path):
+    return tifffile.imread(path).astype(np.float32)
+
+
+def dilate(mask, radius):
+    """
+    Binary dilation with a (2 radius + 1) square, as separable ORs of shifted masks.
+    """
+    if radius <= 0:
+        return mask
+    rows = mask.copy()
+    for shift in range(1, radius + 1):
+        rows[shift:] |= mask[:-shift]
+        rows[:-shift] |= mask[shift:]
+    dilated = rows.copy()
+    for shift in range(1, radius + 1):
+        dilated[:, shift:] |= rows[:, :-shift]
+        dilated[:, :-shift] |= rows[:, shift:]
+    return dilated
+
+
+def erode(mask, radius):
+    return ~dilate(~mask, radius)
+
+
+def bin_cells(frame):
+    """
+    Mean of every 2x2 cell as float32: one value per Bayer cell, without the colour pattern of the mosaic.
+    """
+    height, width = frame.shape[0] // 2, frame.shape[1] // 2
+    cells = frame[:2 * height, :2 * width].reshape(height, 2, width, 2)
+    return cells.mean(axis=(1, 3), dtype=np.float32)
+
+
+def unbin_cells(mask, shape):
+    # Back to full resolution; an odd last row or column repeats its neighbour
+    full = np.repeat(np.repeat(mask, 2, axis=0), 2, axis=1)
+    return np.pad(full, ((0, shape[0] - full.shape[0]), (0, shape[1] - full.shape[1])), mode='edge')
+
+
+class Segmenter:
+    """
+    Cuts the object out of turntable views by comparing them with a reference frame of the empty stage:
+    - Pixels differing from the reference by more than threshold are foreground. Without a dark frame the threshold
+      is a fraction of full scale; with one it is a fraction of the dark-corrected reference level, so dim parts of
+      the stage are as sensitive as bright ones. That level is floored at min_level of full scale, so noise in
+      nearly black areas does not count as object.
+    - A morphological opening removes speckles, a closing fills small holes in the object.
+    - Every view is written as an RGBA PNG to output_path, named like its raw TIFF file.
+    - close() lists the few views whose masks look unreliable in review.json, for touching up in mask_interactive.py.
+    - Raw Bayer mosaics of colour cameras (with color, their ColorProcessor) are compared in binned 2x2 cells,
+      so the colour pattern does not show in the mask, and written with demosaiced RGB.
+    process() is thread-safe, so it can run on the image writer threads as the frames arrive.
+    """
+
+    def __init__(self, output_path, background, bit_depth, dark=None, threshold=0.04, opening=1, closing=3,
+                 max_review=5, color=None, min_level=0.05):
+        self.output_path = output_path
+        self._color = color
+        max_value = 2 ** bit_depth - 1
+        self._background = self._compared(background)
+        # Differences are multiplied by scale, so they are fractions of full scale or of the reference level
+        if dark is not None:
+            self._scale = 1 / np.maximum(self._background - self._compared(dark), min_level * max_value)
+        else:
+            self._scale = np.float32(1 / max_value)
+        self._threshold = threshold
+        self._shift = max(bit_depth - 8, 0)
+        self._opening = opening
+        self._closing = closing
+        self._max_review = max_review
+        self._stats = {}  # view -> (foreground fraction, fraction of pixels close to the threshold)
+        self._lock = threading.Lock()
+        os.makedirs(output_path, exist_ok=True)
+
+    def _compared(self, frame):
+        # The values compared with the reference: pixels, or the cells of a Bayer mosaic
+        return bin_cells(frame) if self._color is not None else frame.astype(np.float32)
+
+    def segment(self, frame):
+        """
+        Return the foreground mask of a raw frame and the fraction of pixels close to the threshold.
+        """
+        difference = self._compared(frame)
+        difference -= self._background
+        np.abs(difference, out=difference)
+        difference *= self._scale
+
+        foreground = difference > self._threshold
+        ambiguous = np.count_nonzero((difference > 0.5 * self._threshold) & (difference < 2 * self._threshold))
+        ambiguous /= difference.size
+        if self._color is not None:
+            foreground = unbin_cells(foreground, frame.shape)
+        mask = dilate(erode(foreground, self._opening), self._opening)
+        mask = erode(dilate(mask, self._closing), self._closing)
+        return mask, ambiguous
+
+    def process(self, view, frame):
+        """
+        Segment one view and write it as an RGBA PNG.
+        """
+        with SEGMENTATION_SECONDS.time():
+            mask, ambiguous = self.segment(frame)
+            rgba = np.empty(frame.shape + (4,), dtype=np.uint8)
+            if self._color is not None:
+                rgba[..., :3] = self._color.process(frame) >> self._shift
+            else:
+                rgba[..., :3] = (frame >> self._shift)[..., None]
+            np.multiply(mask, 255, out=rgba[..., 3], casting='unsafe')
+            Image.fromarray(rgba).save(os.path.join(self.output_path, f"{view}.png"))
+        with self._lock:
+            self._stats[view] = (np.count_nonzero(mask) / mask.size, ambiguous)
+        SEGMENTED_VIEWS.inc()
+
+    def review(self, ambiguous_limit=0.01, area_tolerance=0.3):
+        """
+        Pick the views most likely to need manual touch-up: many pixels close to the threshold,
+        or a foreground area far from the median of the scan.
+        """
+        with self._lock:
+            views = sorted(self._stats)
+            foreground, ambiguous = np.array([self._stats[view] for view in views]).reshape(-1, 2).T
+        if not views:
+            return []
+        area_deviation = np.abs(foreground - np.median(foreground)) / max(np.median(foreground), 1e-6)
+        score = area_deviation / area_tolerance + ambiguous / ambiguous_limit
+        flagged = []
+        for i in np.argsort(-score):
+            reasons = []
+            if area_deviation[i] > area_tolerance:
+                reasons.append("foreground_area")
+            if ambiguous[i] > ambiguous_limit:
+                reasons.append("ambiguous_pixels")
+            if reasons and len(flagged) < self._max_review:
+                flagged.append({
+                    "view": views[i],
+                    "file": f"{views[i]}.png",
+                    "foreground": float(foreground[i]),
+                    "ambiguous": float(ambiguous[i]),
+                    "reasons": reasons,
+                })
+        return flagged
+
+    def close(self):
+        flagged = self.review()
+        with open(os.path.join(self.output_path, "review.json"), "w") as f:
+            json.dump({"views": flagged}, f, indent=4)
+        log_event("segmentation_review", f"{len(flagged)} segmented views should be checked by hand",
+                  output_path=self.output_path, views=[entry["view"] for entry in flagged])
@@ -0,0 +1,168 @@
+# utils_camera/simulated_camera.py
+
+import enum
+import queue
+import random
+import threading
+import numpy as np
+
+try:
+    from thorlabs_tsi_sdk.tl_camera_enums import SENSOR_TYPE, OPERATION_MODE, TRIGGER_POLARITY
+except ImportError:
+    # Minimal stand-ins so that the simulated backend works without the Thorlabs SDK installed
+    class SENSOR_TYPE(enum.IntEnum):
+        MONOCHROME = 0
+        BAYER = 1
+        MONOCHROME_POLARIZED = 2
+
+    class OPERATION_MODE(enum.IntEnum):
+        SOFTWARE_TRIGGERED = 0
+        HARDWARE_TRIGGERED = 1
+        BULB = 2
+
+    class TRIGGER_POLARITY(enum.IntEnum):
+        ACTIVE_HIGH = 0
+        ACTIVE_LOW = 1
+
+
+class _Range:
+    def __init__(self, min, max):
+        self.min = min
+        self.max = max
+
+
+class SimulatedFrame:
+    def __init__(self, image_buffer, frame_count):
+        self.image_buffer = image_buffer
+        self.frame_count = frame_count
+
+
+class SimulatedTLCamera:
+    """
+    Stand-in for TLCamera with the subset of its interface used by the camera controllers:
+    - A trigger (software or hardware) produces one frame after the exposure time plus readout latency and jitter.
+    - Frames are served from a few pregenerated synthetic images, so the simulation itself does not allocate per frame.
+    """
+
+    def __init__(self, serial_number, width=1440, height=1080, bit_depths=(8, 10, 12, 16), readout_ms=15.0,
+                 jitter_ms=2.0, sensor_type=SENSOR_TYPE.MONOCHROME):
+        self.serial_number = serial_number
+        self.name = f"Simulated camera {serial_number}"
+        self.model = "SIMULATED"
+        self.image_width_pixels = width
+        self.image_height_pixels = height
+        self.bit_depths = list(bit_depths)
+        self.bit_depth = max(bit_depths)
+        self.camera_sensor_type = sensor_type
+        self.color_filter_array_phase = 0  # Red top left (FILTER_PHASE.BAYER_RED) for Bayer sensors
+        self.exposure_time_us = 10000
+        self.exposure_time_range_us = _Range(40, 26843)
+        self.frames_per_trigger_zero_for_unlimited = 1
+        self.image_poll_timeout_ms = 0
+        self.operation_mode = OPERATION_MODE.SOFTWARE_TRIGGERED
+        self.trigger_polarity = TRIGGER_POLARITY.ACTIVE_HIGH
+        self.readout_ms = readout_ms
+        self.jitter_ms = jitter_ms
+
+        self._armed = False
+        self._frames = None
+        self._frame_count = 0
+        self._pending = queue.Queue()
+        self._lock = threading.Lock()
+
+    def _synthetic_frames(self, n=4):
+        # Smooth gradient with a bright disc whose position changes between the frames
+        dtype = np.uint8 if self.bit_depth <= 8 else np.uint16
+        max_value = 2 ** self.bit_depth - 1
+        y, x = np.mgrid[0:self.image_height_pixels, 0:self.image_width_pixels]
+        background = (x / self.image_width_pixels * max_value * 0.3).astype(dtype)
+        frames = []
+        for i in range(n):
+            frame = background.copy()
+            cx = self.image_width_pixels * (0.3 + 0.4 * i / n)
+            cy = self.image_height_pixels / 2
+            disc = (x - cx) ** 2 + (y - cy) ** 2 < (self.image_height_pixels / 6) ** 2
+            frame[disc] = int(max_value * 0.8)
+            frames.append(frame.ravel())
+        return frames
+
+    def arm(self, frames_to_buffer):
+        self._frames = self._synthetic_frames()
+        self._pending = queue.Queue(maxsize=max(frames_to_buffer, 1))
+        self._armed = True
+
+    def disarm(self):
+        self._armed = False
+
+    def _expose(self):
+        # Deliver the frame once exposure and readout are over
+        delay = (self.exposure_time_us / 1e6 + self.readout_ms / 1e3
+                 + random.uniform(-self.jitter_ms, self.jitter_ms) / 1e3)
+        with self._lock:
+            self._frame_count += 1
+            frame_count = self._frame_count
+        timer = threading.Timer(max(delay, 0), self._deliver, args=(frame_count,))
+        timer.daemon = True
+        timer.start()
+
+    def _deliver(self, frame_count):
+        if not self._armed:
+            return
+        image_buffer = self._frames[frame_count % len(self._frames)]
+        try:
+            self._pending.put_nowait(SimulatedFrame(image_buffer, frame_count))
+        except queue.Full:
+            pass  # Like the SDK, frames are lost when the host does not keep up
+
+    def issue_software_trigger(self):
+        if not self._armed:
+            raise RuntimeError("Camera must be armed before it can be triggered.")
+        self._expose()
+
+    def hardware_trigger(self):
+        """
+        Rising edge on the trigger input, e.g. from the simulated Arduino.
+        """
+        if self._armed and self.operation_mode == OPERATION_MODE.HARDWARE_TRIGGERED:
+            self._expose()
+
+    def get_pending_frame_or_null(self):
+        try:
+            return self._pending.get(timeout=self.image_poll_timeout_ms / 1000)
+        except queue.Empty:
+            return None
+
+    def dispose(self):
+        self._armed = False
+
+
+class SimulatedTLCameraSDK:
+    """
+    Stand-in for TLCameraSDK that opens SimulatedTLCamera instances.
+    Keyword arguments are passed on to every simulated camera (resolution, bit depths, latency, jitter).
+    serial_numbers names the cameras explicitly, e.g. to simulate a rig configured for a specific camera.
+    """
+
+    def __init__(self, n_cameras=1, serial_numbers=None, **camera_kwargs):
+        self._serial_numbers = list(serial_numbers or [f"SIM{i:05d}" for i in range(n_cameras)])
+        self._camera_kwargs = camera_kwargs
+        self.cameras = []
+
+    def discover_available_cameras(self):
+        return list(self._serial_numbers)
+
+    def open_camera(self, serial_number):
+        camera = SimulatedTLCamera(serial_number, **self._camera_kwargs)
+        self.cameras.append(camera)
+        return camera
+
+    def hardware_trigger(self):
+        """
+        Send a trigger pulse to all opened cameras.
+        """
+        for camera in self.cameras:
+            camera.hardware_trigger()
+
+    def dispose(self):
+        for camera in self.cameras:
+            camera.dispose()
@@ -0,0 +1,255 @@
+# utils_camera/transcode.py
+
+import os
+import json
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+
+from utils_acquisition.metrics import log_event
+from utils_acquisition.nerf_transforms import write_json_atomic
+from utils_camera.masking import AngularMasks
+from utils_camera.scan_dataset import ScanDataset
+
+TONE_METHODS = ('shift', 'percentile', 'gamma')
+TRANSFORMS_FILES = ("transforms.json", "transforms_0.json", "transforms_1.json", "transforms_train.json",
+                    "transforms_test.json")
+# Image size and intrinsics in pixels that shrink with the images
+IMAGE_SIZE = ("w", "h")
+PIXEL_INTRINSICS = ("fl_x", "fl_y", "cx", "cy")
+
+
+def tone_map(values, bit_depth, method="shift", low=0, high=None, gamma=2.2):
+    """
+    Map raw values to 8 bit:
+    - 'shift' drops the low bits, like the live view (raw >> (bit_depth - 8)).
+    - 'percentile' stretches the raw levels low..high linearly to 0..255.
+    - 'gamma' encodes the full raw range with the given gamma.
+    Float values, e.g. merged HDR radiance, may exceed the full scale of bit_depth and are clipped.
+    """
+    max_value = 2 ** bit_depth - 1
+    values = np.asarray(values, dtype=np.float64)
+    if method == "shift":
+        scaled = np.floor(values / 2 ** max(bit_depth - 8, 0)) / 255
+    elif method == "percentile":
+        high = max_value if high is None else high
+        scaled = (values - low) / max(high - low, 1)
+    elif method == "gamma":
+        scaled = np.clip(values / max_value, 0, 1) ** (1 / gamma)
+    else:
+        raise ValueError(f"Unknown tone mapping {method!r}, expected one of {TONE_METHODS}.")
+    return np.rint(255 * np.clip(scaled, 0, 1)).astype(np.uint8)
+
+
+def downscale(image, factor):
+    """
+    Shrink an image by an integer factor, averaging factor x factor blocks; the remainder rows and columns are cropped.
+    """
+    if factor <= 1:
+        return image
+    height, width = image.shape[0] // factor, image.shape[1] // factor
+    blocks = image[:height * factor, :width * factor].reshape((height, factor, width, factor) + image.shape[2:])
+    mean = blocks.mean(axis=(1, 3), dtype=np.float32)
+    return np.rint(mean).astype(image.dtype) if np.issubdtype(image.dtype, np.integer) else mean
+
+
+def percentile_levels(dataset, percentiles=(0.5, 99.5), n_samples=8, stride=4):
+    """
+    Raw levels at the given percentiles, sampled from n_samples views spread over the scan, so that
+    all views of a scan are stretched alike and the brightness does not flicker between them.
+    """
+    indices = np.unique(np.linspace(0, len(dataset) - 1, min(n_samples, len(dataset))).astype(int))
+    samples = np.concatenate([np.asarray(dataset[i][::stride, ::stride]).ravel() for i in indices])
+    low, high = np.percentile(samples, percentiles)
+    return float(low), float(high)
+
+
+class Transcoder:
+    """
+    Settings of a transcode job, shared with the worker processes: tone curve, downscale factor and alpha source.
+    Alpha comes from the RGBA views of the segmentation (alpha_path is their folder) or from a masks file
+    (masked areas become transparent). Views with alpha are written as RGBA PNG, the others keep their channels.
+    """
+
+    def __init__(self, bit_depth, method="shift", levels=None, gamma=2.2, factor=1, alpha_path=None):
+        self.bit_depth = bit_depth
+        self.method = method
+        self.levels = levels
+        self.gamma = gamma
+        self.factor = factor
+        self.alpha_path = alpha_path
+        self._curve = None
+        self._masks = None
+
+    def settings(self):
+        return {
+            "bit_depth": self.bit_depth,
+            "method": self.method,
+            "levels": list(self.levels) if self.levels else None,
+            "gamma": self.gamma if self.method == "gamma" else None,
+            "factor": self.factor,
+            "alpha_path": os.path.abspath(self.alpha_path) if self.alpha_path else None,
+        }
+
+    def tone_map(self, image):
+        low, high = self.levels or (0, None)
+        if not np.issubdtype(image.dtype, np.integer):
+            return tone_map(image, self.bit_depth, self.method, low, high, self.gamma)
+        # Integer views go through a lookup table of all raw values, computed once per process
+        if self._curve is None:
+            self._curve = tone_map(np.arange(2 ** self.bit_depth), self.bit_depth, self.method, low, high, self.gamma)
+        return np.take(self._curve, image, mode='clip')
+
+    def alpha_source(self, view):
+        """
+        File the alpha channel of a view is read from, or None.
+        """
+        if not self.alpha_path:
+            return None
+        if os.path.isdir(self.alpha_path):
+            return os.path.join(self.alpha_path, f"{view}.png")
+        return self.alpha_path
+
+    def alpha(self, view, angle_deg, shape):
+        source = self.alpha_source(view)
+        if source is None:
+            return None
+        if os.path.isdir(self.alpha_path):
+            return np.asarray(Image.open(source))[..., 3]
+        if self._masks is None:
+            self._masks = AngularMasks.load(self.alpha_path)
+        if self._masks.shape != shape:
+            raise ValueError(f"Masks of shape {self._masks.shape} do not fit views of shape {shape}.")
+        return np.where(self._masks.mask_at(angle_deg), 0, 255).astype(np.uint8)
+
+    def convert(self, image, alpha=None):
+        """
+        8 bit image (RGBA if alpha is given) from a raw image.
+        """
+        converted = self.tone_map(downscale(np.asarray(image), self.factor))
+        if alpha is None:
+            return converted
+        rgba = np.empty(converted.shape[:2] + (4,), dtype=np.uint8)
+        rgba[..., :3] = converted[..., :3] if converted.ndim == 3 else converted[..., None]
+        rgba[..., 3] = downscale(alpha, self.factor)
+        return rgba
+
+
+# Dataset and settings of the worker processes, sent once when a worker starts instead of with every job
+_worker_dataset = None
+_worker_transcoder = None
+
+
+def _init_worker(source, transcoder):
+    global _worker_dataset, _worker_transcoder
+    _worker_dataset = ScanDataset(source)
+    _worker_transcoder = transcoder
+
+
+def _transcode_view(index, view, output_path):
+    scan_view = _worker_dataset.view(index)
+    image = _worker_dataset[index]
+    alpha = _worker_transcoder.alpha(view, scan_view.angle_deg, image.shape[:2])
+    # Written under a temporary name, so an interrupted run never leaves a truncated file that looks up to date
+    Image.fromarray(_worker_transcoder.convert(image, alpha)).save(output_path + ".tmp", format="PNG")
+    os.replace(output_path + ".tmp", output_path)
+
+
+def _is_current(output_path, sources):
+    if not os.path.exists(output_path):
+        return False
+    output_mtime = os.path.getmtime(output_path)
+    return all(os.path.getmtime(source) <= output_mtime for source in sources if os.path.exists(source))
+
+
+def _view_names(dataset):
+    # Container frames are named by their index, files keep their view number
+    if os.path.isfile(dataset.path):
+        return list(range(len(dataset)))
+    return [os.path.splitext(os.path.basename(view.path))[0] for view in dataset.views]
+
+
+def write_transforms(dataset, output_path, names, factor):
+    """
+    Copy the NeRF transforms files of a scan directory to output_path, pointing to the transcoded images
+    and with the image size and pixel intrinsics (if any) scaled to the downscaled images.
+    """
+    file_paths = {
+        os.path.normpath(view.path): f"images/{name}.png" for view, name in zip(dataset.views, names)
+    }
+    for filename in TRANSFORMS_FILES:
+        path = os.path.join(dataset.path, filename)
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            data = json.load(f)
+        # downscale() crops the remainder rows and columns at the bottom and right, which moves neither the
+        # focal length nor the principal point, so only the size is rounded down
+        for key in IMAGE_SIZE:
+            if key in data:
+                data[key] = int(data[key]) // factor
+        for key in PIXEL_INTRINSICS:
+            if key in data:
+                data[key] = data[key] / factor
+        for frame in data["frames"]:
+            source = os.path.normpath(os.path.join(dataset.path, frame["file_path"]))
+            frame["file_path"] = file_paths.get(source, file_paths.get(source + ".png", frame["file_path"]))
+        write_json_atomic(os.path.join(output_path, filename), data)
+
+
+def transcode_scan(source, output_path, method="shift", bit_depth=None, percentiles=(0.5, 99.5), gamma=2.2,
+                   factor=1, alpha_path=None, processes=None, force=False):
+    """
+    Convert the raw views of a scan directory or container into 8 bit PNG files in output_path/images,
+    with a pool of processes, and copy the transforms files next to them, so output_path is a training dataset.
+    Views whose PNG is newer than the raw view and its alpha source are skipped, unless the settings changed,
+    an earlier run left views without recording its settings, or force is set. Returns the number of converted views.
+    """
+    dataset = ScanDataset(source)
+    if not len(dataset):
+        raise ValueError(f"No views found in {source}.")
+    if bit_depth is None:
+        # Untagged integer views use their full data type, untagged float views the camera's 16 bit
+        dtype = np.asarray(dataset[0]).dtype
+        bit_depth = dataset.view(0).bit_depth or (8 * dtype.itemsize if np.issubdtype(dtype, np.integer) else 16)
+    levels = percentile_levels(dataset, percentiles) if method == "percentile" else None
+    transcoder = Transcoder(bit_depth, method, levels, gamma, factor, alpha_path)
+
+    images_path = os.path.join(output_path, "images")
+    os.makedirs(images_path, exist_ok=True)
+    settings_path = os.path.join(output_path, "transcode.json")
+    if os.path.exists(settings_path):
+        with open(settings_path) as f:
+            force = force or json.load(f) != transcoder.settings()
+        if force:
+            # Removed before the first view is rewritten, so an interrupted run cannot leave old and new views
+            # under the old settings; the next run then converts everything again
+            os.remove(settings_path)
+    elif any(name.endswith(".png") for name in os.listdir(images_path)):
+        # Views of an interrupted run with unknown settings
+        force = True
+
+    names = _view_names(dataset)
+    jobs = []
+    for index, (view, name) in enumerate(zip(dataset.views, names)):
+        png_path = os.path.join(images_path, f"{name}.png")
+        sources = [view.path] + [path for path in [transcoder.alpha_source(name)] if path]
+        if force or not _is_current(png_path, sources):
+            jobs.append((index, name, png_path))
+
+    if jobs:
+        processes = processes or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                 initargs=(source, transcoder)) as executor:
+            indices, views, png_paths = zip(*jobs)
+            list(executor.map(_transcode_view, indices, views, png_paths,
+                              chunksize=max(1, len(jobs) // (4 * processes))))
+    # The settings are only recorded once all views match them
+    write_json_atomic(settings_path, transcoder.settings())
+    if not os.path.isfile(source):
+        write_transforms(dataset, output_path, names, factor)
+
+    log_event("transcode_finished", f"Converted {len(jobs)} of {len(dataset)} views to {images_path}",
+              source=source, output_path=output_path, converted=len(jobs), skipped=len(dataset) - len(jobs),
+              **transcoder.settings())
+    return len(jobs)